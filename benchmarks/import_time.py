@@ -0,0 +1,142 @@
+# benchmarks/import_time.py
+"""
+Время холодного старта: импорт bot_app.bot / main в свежем процессе.
+
+Каждый замер — новый интерпретатор во временном каталоге (своя SQLite),
+берётся медиана. Для сравнения меряется baseline — голые зависимости
+(aiogram + sqlalchemy), от которых бот никуда не денется; накладные
+расходы бота = target - baseline.
+
+Заодно проверяется, что тяжёлые модули, нужные только по требованию
+(yt_dlp, ffmpeg, boto3, fastapi/uvicorn в режиме polling), при импорте
+не загружаются. Код выхода 1 — регрессия, годится для CI:
+
+    python -m benchmarks.import_time --runs 5 --overhead-budget 0.8
+    python -m benchmarks.import_time --top 15      # самые дорогие модули
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BASELINE = "import aiogram, aiogram.types, sqlalchemy.ext.asyncio"
+TARGETS = {
+    "bot": "import bot_app.bot",
+    "main": "import main",
+}
+# не должны попадать в sys.modules при импорте (загружаются лениво)
+FORBIDDEN = ("yt_dlp", "ffmpeg", "boto3", "fastapi", "uvicorn")
+
+_PROBE = """
+import sys, time, json
+began = time.perf_counter()
+{code}
+elapsed = time.perf_counter() - began
+print(json.dumps({{"elapsed": elapsed, "modules": sorted(m for m in {forbidden!r} if m in sys.modules)}}))
+"""
+
+
+def _env(workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update(
+        {
+            "PYTHONPATH": os.pathsep.join(filter(None, [str(ROOT), env.get("PYTHONPATH")])),
+            "SQLITE_PATH": os.path.join(workdir, "bench.db"),
+            "DOWNLOADS_DIR": os.path.join(workdir, "downloads"),
+            "BOT_MODE": "polling",
+            "METRICS_ENABLED": "0",
+        }
+    )
+    env.pop("DATABASE_URL", None)
+    return env
+
+
+def measure(code: str, env: Dict[str, str], cwd: str) -> Tuple[float, List[str]]:
+    out = subprocess.run(
+        [sys.executable, "-c", _PROBE.format(code=code, forbidden=FORBIDDEN)],
+        env=env,
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    return result["elapsed"], result["modules"]
+
+
+def top_modules(code: str, env: Dict[str, str], cwd: str, n: int) -> List[Tuple[int, str]]:
+    """
+    Самые дорогие модули по собственному времени (-X importtime, мкс).
+    """
+    err = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        env=env,
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in err.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        rows.append((int(self_us), name.strip()))
+    return sorted(rows, reverse=True)[:n]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--targets", nargs="+", choices=list(TARGETS), default=list(TARGETS))
+    parser.add_argument("--budget", type=float, default=None, help="предел медианы импорта, с")
+    parser.add_argument("--overhead-budget", type=float, default=None, help="предел (target - baseline), с")
+    parser.add_argument("--top", type=int, default=0, help="показать N самых дорогих модулей")
+    args = parser.parse_args()
+
+    failed = False
+    with tempfile.TemporaryDirectory() as workdir:
+        env = _env(workdir)
+        # первый прогон прогревает .pyc и page cache, в замер не идёт
+        measure(BASELINE, env, workdir)
+        base = statistics.median(measure(BASELINE, env, workdir)[0] for _ in range(args.runs))
+        print(f"{'baseline':<9} {base:6.3f} s  ({BASELINE})")
+
+        for name in args.targets:
+            code = TARGETS[name]
+            measure(code, env, workdir)
+            times, loaded = [], set()
+            for _ in range(args.runs):
+                elapsed, modules = measure(code, env, workdir)
+                times.append(elapsed)
+                loaded.update(modules)
+            median = statistics.median(times)
+            overhead = median - base
+            print(f"{name:<9} {median:6.3f} s  overhead {overhead:+.3f} s  (min {min(times):.3f}, max {max(times):.3f})")
+
+            if loaded:
+                print(f"  FAIL: loaded at import: {', '.join(sorted(loaded))}")
+                failed = True
+            if args.budget is not None and median > args.budget:
+                print(f"  FAIL: {median:.3f} s > budget {args.budget:.3f} s")
+                failed = True
+            if args.overhead_budget is not None and overhead > args.overhead_budget:
+                print(f"  FAIL: overhead {overhead:.3f} s > budget {args.overhead_budget:.3f} s")
+                failed = True
+
+            if args.top:
+                for self_us, module in top_modules(code, env, workdir, args.top):
+                    print(f"  {self_us / 1000:8.1f} ms  {module}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+# benchmarks/queue_claim.py
+"""
+Бенчмарк захвата задач очередью на БД (bot_app/jobqueue.py, DbQueue).
+
+Для каждого размера очереди создаётся SQLite с N pending-задачами,
+разложенными по U пользователям, и меряется время одного _claim (захват
+и возврат строки в pending, чтобы размер очереди не менялся). Захват
+идёт поиском по частичному индексу ix_downloads_pending_head, поэтому
+время не должно расти вместе с N. Заодно печатается план запросов SQLite.
+
+    python -m benchmarks.queue_claim --pending 1000 10000 50000 --users 500
+"""
+import argparse
+import asyncio
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import insert, update  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from bot_app.db import Base, apply_sqlite_pragmas  # noqa: E402
+from bot_app.jobqueue import PRIORITY_HIGH, PRIORITY_NORMAL, DbQueue  # noqa: E402
+from bot_app.models import Download, DownloadStatus, User  # noqa: E402
+
+
+async def _fill(Session: sessionmaker, pending: int, users: int) -> None:
+    async with Session() as session:
+        await session.execute(insert(User), [{"telegram_id": n} for n in range(users)])
+        rows = [
+            {
+                "user_id": 1 + n % users,
+                "url": f"https://youtu.be/{n:011d}",
+                "status": DownloadStatus.pending,
+                # каждая десятая задача — короткий ролик
+                "priority": PRIORITY_HIGH if n % 10 == 0 else PRIORITY_NORMAL,
+            }
+            for n in range(pending)
+        ]
+        await session.execute(insert(Download), rows)
+        await session.commit()
+
+
+async def _plans(engine) -> None:
+    queries = {
+        "next user": (
+            "SELECT user_id FROM downloads WHERE downloads.status = 'pending' "
+            "AND priority = 1 AND user_id > 10 ORDER BY user_id LIMIT 1"
+        ),
+        "user head": (
+            "SELECT id FROM downloads WHERE downloads.status = 'pending' "
+            "AND priority = 1 AND user_id = 10 ORDER BY id LIMIT 1"
+        ),
+    }
+    async with engine.connect() as conn:
+        for name, sql in queries.items():
+            plan = (await conn.exec_driver_sql("EXPLAIN QUERY PLAN " + sql)).all()
+            print(f"  {name:<10} {' / '.join(row[-1] for row in plan)}")
+
+
+async def run_size(pending: int, args, tmp: str) -> float:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/queue-{pending}.db")
+    apply_sqlite_pragmas(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    await _fill(Session, pending, args.users)
+
+    queue = DbQueue(session_factory=Session, per_user_limit=args.per_user)
+    times = []
+    for _ in range(args.claims):
+        began = time.perf_counter()
+        job = await queue._claim()
+        times.append(time.perf_counter() - began)
+        async with Session() as session:
+            await session.execute(
+                update(Download).where(Download.id == job.download_id).values(status=DownloadStatus.pending)
+            )
+            await session.commit()
+
+    if args.plan:
+        await _plans(engine)
+    await engine.dispose()
+    return statistics.median(times)
+
+
+async def run(args) -> None:
+    print(f"{args.users} users, {args.claims} claims per size")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for pending in args.pending:
+            median = await run_size(pending, args, tmp)
+            print(f"{pending:>8} pending  {median * 1000:7.2f} ms/claim")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pending", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--per-user", type=int, default=2)
+    parser.add_argument("--claims", type=int, default=200)
+    parser.add_argument("--plan", action="store_true", help="показать план запросов SQLite")
+    parser.add_argument("--dir", default=None)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+# benchmarks/range_download.py
+"""
+Локальный бенчмарк параллельного Range-скачивания (bot_app/rangefetch.py).
+
+Поднимает HTTP-сервер, который отдаёт файл с ограничением скорости на
+КАЖДОЕ соединение (как CDN с per-connection throttling), и качает его
+одним и несколькими соединениями.
+
+    python -m benchmarks.range_download --size-mb 32 --rate-kb 2048 --connections 1 4 8
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from bot_app.rangefetch import download_ranges  # noqa: E402
+
+
+def make_handler(blob: bytes, rate: int, latency: float = 0):
+    """
+    rate — байт/с на соединение; latency — пауза перед ответом (секунды).
+    Путь запроса не важен: по любому отдаётся blob.
+    """
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if latency:
+                time.sleep(latency)
+            start, end = 0, len(blob) - 1
+            header = self.headers.get("Range")
+            if header and header.startswith("bytes="):
+                a, _, b = header[6:].partition("-")
+                start = int(a or 0)
+                end = min(int(b), end) if b else end
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{end}/{len(blob)}")
+            else:
+                self.send_response(200)
+            self.send_header("Accept-Ranges", "bytes")
+            self.send_header("Content-Length", str(end - start + 1))
+            self.end_headers()
+
+            # отдаём порциями по 1/20 секунды, выдерживая rate байт/с
+            step = max(1, rate // 20)
+            pos = start
+            began = time.monotonic()
+            while pos <= end:
+                n = min(step, end - pos + 1)
+                self.wfile.write(blob[pos:pos + n])
+                pos += n
+                ahead = (pos - start) / rate - (time.monotonic() - began)
+                if ahead > 0:
+                    time.sleep(ahead)
+
+    return Handler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=int, default=32)
+    parser.add_argument("--rate-kb", type=int, default=2048, help="лимит на одно соединение, KB/s")
+    parser.add_argument("--chunk-mb", type=float, default=2)
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    blob = os.urandom(args.size_mb * 1024 * 1024)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), make_handler(blob, args.rate_kb * 1024))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/video.mp4"
+
+    print(f"file {args.size_mb} MB, per-connection limit {args.rate_kb} KB/s")
+    baseline = None
+    with tempfile.TemporaryDirectory() as tmp:
+        for n in args.connections:
+            dest = Path(tmp) / f"out-{n}.mp4"
+            began = time.perf_counter()
+            size = download_ranges(
+                url,
+                dest,
+                connections=n,
+                total_size=len(blob),
+                chunk_size=int(args.chunk_mb * 1024 * 1024),
+            )
+            elapsed = time.perf_counter() - began
+            assert size == len(blob) and dest.read_bytes() == blob
+            baseline = baseline or elapsed
+            print(
+                f"connections={n:<3} {elapsed:7.2f} s  "
+                f"{size / elapsed / 1024 / 1024:7.2f} MB/s  speedup x{baseline / elapsed:.2f}"
+            )
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# benchmarks/status_writes.py
+"""
+Бенчмарк записи статусов задач в SQLite (bot_app/statuswriter.py, db.py).
+
+Каждая задача проходит путь воркера: INSERT строки (как enqueue_download
+в хендлере), переход в processing, затем done. Сравниваются:
+
+    baseline — журнал по умолчанию (DELETE, synchronous=FULL), commit на переход
+    pragmas  — WAL + synchronous=NORMAL + busy_timeout, commit на переход
+    batched  — то же + StatusWriter (group commit переходов)
+
+    python -m benchmarks.status_writes --jobs 2000 --workers 32
+"""
+import argparse
+import asyncio
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from sqlalchemy import update  # noqa: E402
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine  # noqa: E402
+from sqlalchemy.orm import sessionmaker  # noqa: E402
+
+from bot_app.db import Base, apply_sqlite_pragmas  # noqa: E402
+from bot_app.models import Download, DownloadStatus, User  # noqa: E402
+from bot_app.statuswriter import StatusWriter  # noqa: E402
+
+MODES = ("baseline", "pragmas", "batched")
+
+
+async def run_mode(mode: str, args, tmp: str) -> float:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp}/{mode}.db")
+    if mode != "baseline":
+        apply_sqlite_pragmas(engine)
+    Session = sessionmaker(bind=engine, expire_on_commit=False, class_=AsyncSession)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with Session() as session:
+        user = User(telegram_id=1)
+        session.add(user)
+        await session.commit()
+        user_id = user.id
+
+    writer = StatusWriter(args.interval, args.batch, session_factory=Session) if mode == "batched" else None
+
+    async def transition(download_id: int, **values) -> None:
+        if writer is not None:
+            await writer.write(download_id, **values)
+            return
+        async with Session() as session:
+            await session.execute(update(Download).where(Download.id == download_id).values(**values))
+            await session.commit()
+
+    async def job(n: int) -> None:
+        async with Session() as session:
+            d = Download(user_id=user_id, url=f"https://youtu.be/{n:011d}", status=DownloadStatus.pending)
+            session.add(d)
+            await session.commit()
+        await transition(d.id, status=DownloadStatus.processing)
+        if args.work_ms:
+            await asyncio.sleep(args.work_ms / 1000)
+        await transition(d.id, status=DownloadStatus.done, file_size=n, lease_until=None)
+
+    pending = iter(range(args.jobs))
+
+    async def worker() -> None:
+        for n in pending:
+            await job(n)
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(args.workers)))
+    elapsed = time.perf_counter() - began
+
+    if writer is not None:
+        await writer.close()
+        print(f"  {writer.writes} transitions in {writer.batches} batches")
+    await engine.dispose()
+    return args.jobs / elapsed
+
+
+async def run(args) -> None:
+    print(f"{args.jobs} jobs, {args.workers} concurrent workers, work {args.work_ms} ms")
+    baseline = None
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for mode in args.modes:
+            rate = await run_mode(mode, args, tmp)
+            baseline = baseline or rate
+            print(f"{mode:<9} {rate:8.0f} jobs/s  x{rate / baseline:.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--jobs", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--work-ms", type=float, default=0, help="имитация загрузки между переходами")
+    parser.add_argument("--interval", type=float, default=0.005, help="окно group commit, с")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    parser.add_argument("--dir", default=None, help="где создавать БД (важна ФС: fsync)")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# benchmarks/webhook_load.py
+"""
+Нагрузочный тест webhook-режима (bot_app/web.py).
+
+Шлёт синтетические обновления Telegram POST-запросами и меряет время
+ответа webhook и скорость, с которой Dispatcher разбирает очередь.
+Без --url поднимает приложение в этом же процессе (БД — временный SQLite,
+исходящие сообщения никуда не отправляются: outbox не запущен).
+
+    python -m benchmarks.webhook_load --updates 5000 --concurrency 200
+    python -m benchmarks.webhook_load --url http://127.0.0.1:8080/telegram/webhook
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+from urllib.parse import urlsplit
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def synthetic_update(update_id: int, text: str, users: int) -> dict:
+    user_id = 100000 + update_id % users
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "load"},
+            "text": text,
+        },
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _serve_in_process(args):
+    """
+    Поднимает FastAPI-приложение на свободном порту. Возвращает (url, ingress, stop).
+    """
+    os.environ.setdefault("SQLITE_PATH", str(Path(tempfile.mkdtemp()) / "load.db"))
+    import uvicorn
+    from aiogram import Bot
+    from bot_app import web
+    from bot_app.db import init_db
+
+    await init_db()
+    bot = Bot(token="123456:LOAD-TEST")
+    ingress = web.UpdateIngress(bot, maxsize=args.queue_size, consumers=args.consumers)
+    port = _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(web.create_app(bot, ingress=ingress), host="127.0.0.1", port=port, log_level="warning")
+    )
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.05)
+
+    async def stop():
+        server.should_exit = True
+        await task
+        await bot.session.close()
+
+    return f"http://127.0.0.1:{port}{web.WEBHOOK_PATH}", ingress, stop
+
+
+async def _post_loop(url: str, bodies, headers: dict, statuses: Counter, latencies: list) -> None:
+    """
+    Одно keep-alive соединение, запросы по очереди. Сырой HTTP/1.1 вместо
+    httpx: клиент не должен быть узким местом при сотнях соединений.
+    """
+    parts = urlsplit(url)
+    reader, writer = await asyncio.open_connection(parts.hostname, parts.port or 80)
+    extra = "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+    try:
+        for body in bodies:
+            payload = json.dumps(body).encode()
+            began = time.perf_counter()
+            writer.write(
+                (
+                    f"POST {parts.path} HTTP/1.1\r\nHost: {parts.netloc}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(payload)}\r\n{extra}\r\n"
+                ).encode()
+                + payload
+            )
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            length = 0
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name.lower() == "content-length":
+                    length = int(value)
+            if length:
+                await reader.readexactly(length)
+            latencies.append(time.perf_counter() - began)
+            statuses[int(lines[0].split()[1])] += 1
+    finally:
+        writer.close()
+
+
+async def run(args) -> None:
+    ingress = stop = None
+    url = args.url
+    if url is None:
+        url, ingress, stop = await _serve_in_process(args)
+
+    statuses: Counter = Counter()
+    latencies = []
+    # общий генератор: соединения разбирают обновления по мере готовности
+    bodies = (synthetic_update(i, args.text, args.users) for i in range(1, args.updates + 1))
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+
+    began = time.perf_counter()
+    await asyncio.gather(
+        *(_post_loop(url, bodies, headers, statuses, latencies) for _ in range(args.concurrency))
+    )
+    sent = time.perf_counter() - began
+
+    latencies.sort()
+    q = statistics.quantiles(latencies, n=100)
+    print(f"sent {args.updates} updates in {sent:.2f} s ({args.updates / sent:.0f} req/s), statuses {dict(statuses)}")
+    print(f"webhook latency p50 {q[49] * 1000:.1f} ms  p95 {q[94] * 1000:.1f} ms  p99 {q[98] * 1000:.1f} ms")
+
+    if ingress is not None:
+        while ingress.backlog:
+            await asyncio.sleep(0.01)
+        total = time.perf_counter() - began
+        print(
+            f"processed {ingress.accepted} updates in {total:.2f} s ({ingress.accepted / total:.0f} upd/s), "
+            f"rejected {ingress.rejected}"
+        )
+        await stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="внешний webhook; без него приложение поднимается в процессе")
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--users", type=int, default=50, help="число разных отправителей")
+    parser.add_argument("--text", default="hello", help="текст сообщений (ссылка включит prefetch)")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--consumers", type=int, default=16)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
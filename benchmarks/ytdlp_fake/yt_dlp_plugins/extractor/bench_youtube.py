@@ -0,0 +1,35 @@
+# benchmarks/ytdlp_fake/yt_dlp_plugins/extractor/bench_youtube.py
+"""
+Фейковый экстрактор YouTube для бенчмарков (плагин yt-dlp).
+
+Подключается, когда каталог benchmarks/ytdlp_fake есть в sys.path/PYTHONPATH:
+плагины yt-dlp проверяются раньше встроенных экстракторов. Ссылки
+youtube.com/watch?v=… и youtu.be/… превращаются в прямой файл на локальном
+сервере BENCH_VIDEO_URL (см. benchmarks/e2e.py).
+"""
+import os
+import time
+
+from yt_dlp.extractor.common import InfoExtractor
+
+
+class BenchYoutubeIE(InfoExtractor):
+    _VALID_URL = r"https?://(?:www\.)?(?:youtube\.com/watch\?v=|youtu\.be/)(?P<id>[\w-]{11})"
+    IE_NAME = "bench:youtube"
+
+    def _real_extract(self, url):
+        video_id = self._match_id(url)
+        # задержка «разбора страницы»
+        delay = float(os.getenv("BENCH_EXTRACT_DELAY", "0"))
+        if delay:
+            time.sleep(delay)
+        size = int(os.getenv("BENCH_VIDEO_BYTES", str(2 * 1024 * 1024)))
+        return {
+            "id": video_id,
+            "title": f"bench {video_id}",
+            "url": f"{os.environ['BENCH_VIDEO_URL'].rstrip('/')}/{video_id}.mp4",
+            "ext": "mp4",
+            "protocol": "http",
+            "duration": 60,
+            "filesize": size,
+        }
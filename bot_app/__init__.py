@@ -7,6 +7,23 @@ __all__ = [
     "keyboard",
     "downloader",
     "worker",
+    "cache",
+    "delivery",
+    "jobqueue",
+    "metadata",
+    "outbox",
+    "progress",
+    "staging",
+    "diskbudget",
+    "storage",
+    "web",
+    "fsm",
+    "users",
+    "statuswriter",
+    "history",
+    "metrics",
+    "batches",
+    "postprocess",
 ]
 
 __version__ = "0.1.0"
@@ -0,0 +1,112 @@
+# bot_app/batches.py
+import os
+import logging
+from contextlib import aclosing
+from datetime import datetime
+from typing import AsyncIterator, List, Optional, Sequence
+
+from sqlalchemy import update
+
+from .db import AsyncSessionLocal
+from .downloader import DownloadError, iter_playlist, PLAYLIST_MAX_ITEMS
+from .models import Batch
+from .users import get_or_create_user_id
+from .utils import extract_video_id, is_playlist_url
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Сколько задач максимум в одном пакете (все ссылки и плейлисты вместе)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "100"))
+
+
+# ------------------------------------------------------------
+# Пакет: создание и подтверждение
+# ------------------------------------------------------------
+async def create_batch(user_tg_id: int, chat_id: int, urls: Sequence[str]) -> int:
+    """
+    Сохраняет ссылки сообщения до подтверждения (и одиночную ссылку —
+    см. keyboard.confirm_download). ID пакета уходит в callback_data
+    кнопки — сами ссылки туда не помещаются (64 байта).
+    """
+    user_id = await get_or_create_user_id(user_tg_id)
+    async with AsyncSessionLocal() as session:
+        batch = Batch(user_id=user_id, chat_id=chat_id, urls="\n".join(urls))
+        session.add(batch)
+        await session.commit()
+        return batch.id
+
+
+async def start_batch(batch_id: int, user_tg_id: int) -> Optional[List[str]]:
+    """
+    Отмечает пакет подтверждённым и возвращает его ссылки.
+    None — пакет чужой или уже запущен (повторное нажатие кнопки).
+    """
+    user_id = await get_or_create_user_id(user_tg_id)
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            update(Batch)
+            .where(
+                Batch.id == batch_id,
+                Batch.user_id == user_id,
+                Batch.started_at.is_(None),
+            )
+            .values(started_at=datetime.utcnow())
+            .returning(Batch.urls)
+        )
+        urls = q.scalar_one_or_none()
+        await session.commit()
+    return urls.split("\n") if urls is not None else None
+
+
+async def set_total(batch_id: int, total: int) -> None:
+    # после этого пакет может считаться завершённым (см. delivery.deliver_batch)
+    async with AsyncSessionLocal() as session:
+        await session.execute(update(Batch).where(Batch.id == batch_id).values(total=total))
+        await session.commit()
+
+
+# ------------------------------------------------------------
+# Разворот ссылок в список видео
+# ------------------------------------------------------------
+class Expansion:
+    """
+    Поток ссылок на видео пакета: обычные ссылки как есть, плейлисты и
+    каналы — по мере чтения их страниц (downloader.iter_playlist).
+    Повторы одного видео отбрасываются, всего не больше limit.
+    """
+
+    def __init__(self, urls: Sequence[str], limit: int = BATCH_MAX_ITEMS) -> None:
+        self.urls = list(urls)
+        self.limit = limit
+        # ссылки, которые не удалось развернуть
+        self.failed = 0
+
+    async def _videos(self) -> AsyncIterator[str]:
+        for url in self.urls:
+            if not is_playlist_url(url):
+                yield url
+                continue
+            try:
+                # aclosing: прерванный обход сразу останавливает поток yt-dlp
+                async with aclosing(iter_playlist(url, min(PLAYLIST_MAX_ITEMS, self.limit))) as videos:
+                    async for video_url in videos:
+                        yield video_url
+            except DownloadError as e:
+                logger.info("playlist expansion failed for %s: %s", url, e)
+                self.failed += 1
+
+    async def __aiter__(self) -> AsyncIterator[str]:
+        seen = set()
+        async with aclosing(self._videos()) as videos:
+            async for url in videos:
+                key = extract_video_id(url) or url
+                if key in seen:
+                    continue
+                seen.add(key)
+                yield url
+                if len(seen) >= self.limit:
+                    return
@@ -1,6 +1,8 @@
 # bot_app/bot.py
 from aiogram import Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+
+from . import metrics
+from .fsm import create_storage
 
 # ------------------------------------------------------------
 # Dispatcher setup
@@ -8,7 +10,11 @@ from aiogram.fsm.storage.memory import MemoryStorage
 # Тут не создаём Bot, чтобы избежать дубликатов экземпляров.
 # Bot создаётся и управляется в main.py, а сюда просто импортируется dp.
 # Это нужно, чтобы aiogram не открывал лишних HTTP-сессий.
-dp = Dispatcher(storage=MemoryStorage())
+# FSM-хранилище выбирается FSM_STORAGE (см. fsm.py)
+dp = Dispatcher(storage=create_storage())
+# время обработки обновлений (METRICS_ENABLED=1, см. metrics.py)
+if metrics.METRICS_ENABLED:
+    dp.update.outer_middleware(metrics.UpdateTimingMiddleware())
 
 # Импортируем хендлеры, чтобы они зарегистрировались при импорте
 from . import handlers  # noqa: F401
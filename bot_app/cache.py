@@ -0,0 +1,68 @@
+# bot_app/cache.py
+import os
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Tuple, Union
+
+from .storage import is_remote
+
+
+# ------------------------------------------------------------
+# Content-addressed кеш готовых файлов
+# ------------------------------------------------------------
+# Ключ — (канонический video_id, format spec yt-dlp), значение — location
+# уже скачанного файла в хранилище (см. storage.py). Живёт в памяти процесса,
+# размер ограничен DOWNLOAD_CACHE_SIZE записей, вытеснение — LRU.
+CACHE_MAX_ENTRIES = int(os.getenv("DOWNLOAD_CACHE_SIZE", "512"))
+
+CacheKey = Tuple[str, str]
+
+
+@dataclass
+class CachedFile:
+    path: str
+    size: int
+
+
+class DownloadCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max(0, max_entries)
+        self._entries: "OrderedDict[CacheKey, CachedFile]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, video_id: str, fmt: str) -> Optional[CachedFile]:
+        """
+        Возвращает запись кеша и помечает её как недавно использованную.
+        Если локальный файл уже удалён с диска — запись выбрасывается
+        (удалённые объекты не проверяем: это был бы сетевой запрос).
+        """
+        key = (video_id, fmt)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if not is_remote(entry.path) and not os.path.exists(entry.path):
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def put(self, video_id: str, fmt: str, path: Union[str, Path], size: int) -> None:
+        if self.max_entries == 0:
+            return
+        key = (video_id, fmt)
+        self._entries[key] = CachedFile(path=str(path), size=size)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def discard(self, video_id: str, fmt: str) -> None:
+        self._entries.pop((video_id, fmt), None)
+
+    def clear(self) -> None:
+        self._entries.clear()
+
+
+download_cache = DownloadCache()
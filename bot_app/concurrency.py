@@ -0,0 +1,204 @@
+# bot_app/concurrency.py
+import os
+import shutil
+import asyncio
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Callable, Deque, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Границы числа одновременных загрузок; при MIN == MAX регулятор выключен.
+# По умолчанию обе равны WORKER_CONCURRENCY: регулятор включается только
+# явно — WORKER_CONCURRENCY_MIN ниже или WORKER_CONCURRENCY_MAX выше него
+_FIXED = os.getenv("WORKER_CONCURRENCY", "2")
+CONCURRENCY_MIN = int(os.getenv("WORKER_CONCURRENCY_MIN", _FIXED))
+CONCURRENCY_MAX = int(os.getenv("WORKER_CONCURRENCY_MAX", _FIXED))
+# Как часто пересматривать лимит, сек
+ADAPT_INTERVAL = float(os.getenv("CONCURRENCY_ADAPT_INTERVAL", "10"))
+# Сигналы перегрузки
+CPU_HIGH = float(os.getenv("CONCURRENCY_CPU_HIGH", "0.9"))  # loadavg на ядро
+MIN_FREE_BYTES = int(os.getenv("CONCURRENCY_MIN_FREE_BYTES", str(2 * 1024 ** 3)))
+ERROR_RATE_HIGH = float(os.getenv("CONCURRENCY_ERROR_RATE_HIGH", "0.5"))
+# Если после увеличения пропускная способность выросла меньше, чем на
+# столько, прибавка не помогла и откатывается
+THROUGHPUT_GAIN = float(os.getenv("CONCURRENCY_THROUGHPUT_GAIN", "0.05"))
+
+
+# ------------------------------------------------------------
+# Семафор с изменяемым лимитом
+# ------------------------------------------------------------
+class AdaptiveLimiter:
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self.active = 0
+        # максимум занятых слотов с последнего сброса (для регулятора)
+        self.peak = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    async def acquire(self) -> None:
+        if self.active < self.limit and not self._waiters:
+            self._take()
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # слот уже выдан — вернём его
+                self.release()
+            else:
+                self._waiters.remove(fut)
+            raise
+
+    def _take(self) -> None:
+        self.active += 1
+        self.peak = max(self.peak, self.active)
+
+    def release(self) -> None:
+        self.active -= 1
+        self._wake()
+
+    def set_limit(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._wake()
+
+    def _wake(self) -> None:
+        while self._waiters and self.active < self.limit:
+            fut = self._waiters.popleft()
+            if not fut.done():
+                self._take()
+                fut.set_result(None)
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+
+# ------------------------------------------------------------
+# AIMD-регулятор
+# ------------------------------------------------------------
+class AdaptiveController:
+    """
+    Раз в interval пересматривает лимит:
+      - перегрузка (CPU, мало места во временной папке, много ошибок
+        yt-dlp) — лимит делится пополам;
+      - слоты заняты полностью и пропускная способность после прошлой
+        прибавки выросла — лимит +1;
+      - прибавка не дала прироста — откат на шаг назад.
+    """
+
+    def __init__(
+        self,
+        limiter: AdaptiveLimiter,
+        min_limit: int = CONCURRENCY_MIN,
+        max_limit: int = CONCURRENCY_MAX,
+        temp_dir: Optional[Path] = None,
+        interval: float = ADAPT_INTERVAL,
+        on_change: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.limiter = limiter
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.temp_dir = temp_dir
+        self.interval = interval
+        self.on_change = on_change
+
+        self._bytes = 0
+        self._ok = 0
+        self._failed = 0
+        self._last_throughput: Optional[float] = None
+        self._last_step = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_limit > self.min_limit
+
+    def record(self, ok: bool, nbytes: int = 0) -> None:
+        self._bytes += nbytes
+        if ok:
+            self._ok += 1
+        else:
+            self._failed += 1
+
+    def _cpu_overloaded(self) -> bool:
+        try:
+            load = os.getloadavg()[0]
+        except (AttributeError, OSError):
+            return False
+        return load / (os.cpu_count() or 1) > CPU_HIGH
+
+    def _disk_low(self) -> bool:
+        if self.temp_dir is None:
+            return False
+        try:
+            return shutil.disk_usage(self.temp_dir).free < MIN_FREE_BYTES
+        except OSError:
+            return False
+
+    def step(self) -> int:
+        limit = self.limiter.limit
+        throughput = self._bytes / self.interval
+        finished = self._ok + self._failed
+        error_rate = self._failed / finished if finished else 0.0
+        saturated = self.limiter.peak >= limit or self.limiter.waiting > 0
+
+        reason = None
+        if self._cpu_overloaded():
+            reason = "cpu"
+        elif self._disk_low():
+            reason = "disk"
+        elif finished >= 2 and error_rate > ERROR_RATE_HIGH:
+            reason = "errors"
+
+        if reason is not None:
+            new = max(self.min_limit, limit // 2)
+        elif (
+            self._last_step > 0
+            and finished
+            and self._last_throughput
+            and throughput < self._last_throughput * (1 + THROUGHPUT_GAIN)
+        ):
+            new = max(self.min_limit, limit - 1)
+        elif saturated:
+            new = min(self.max_limit, limit + 1)
+        else:
+            new = limit
+
+        if finished:
+            self._last_throughput = throughput
+        self._last_step = new - limit
+        self._bytes = self._ok = self._failed = 0
+        self.limiter.peak = self.limiter.active
+
+        if new != limit:
+            logger.info(
+                "concurrency %s -> %s (throughput=%.0f B/s, errors=%.0f%%%s)",
+                limit, new, throughput, error_rate * 100,
+                f", pressure={reason}" if reason else "",
+            )
+            self.limiter.set_limit(new)
+            if self.on_change is not None:
+                self.on_change(new)
+        return new
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.step()
+            except Exception:
+                logger.exception("concurrency controller step failed")
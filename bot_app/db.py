@@ -1,8 +1,12 @@
 # bot_app/db.py
 import os
+import logging
 import pathlib
-from typing import AsyncIterator
+from typing import Any, AsyncIterator, Optional
 
+from sqlalchemy import event, inspect, text
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql.sqltypes import SchemaType
 from sqlalchemy.ext.asyncio import (
     AsyncEngine,
     AsyncSession,
@@ -10,6 +14,8 @@ from sqlalchemy.ext.asyncio import (
 )
 from sqlalchemy.orm import sessionmaker, declarative_base
 
+logger = logging.getLogger(__name__)
+
 # ------------------------------------------------------------
 # Base metadata (импортируется в bot_app/models.py)
 # ------------------------------------------------------------
@@ -59,19 +65,112 @@ AsyncSessionLocal: sessionmaker = sessionmaker(
 )
 
 
+# ------------------------------------------------------------
+# SQLite: WAL, synchronous=NORMAL, busy_timeout
+# ------------------------------------------------------------
+# WAL — читатели не блокируют писателя и наоборот; NORMAL в WAL не делает
+# fsync на каждый commit (только при checkpoint), целостность сохраняется;
+# busy_timeout — сколько ждать чужую запись вместо «database is locked»
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+
+def _set_sqlite_pragmas(dbapi_connection: Any, connection_record: Any) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+    finally:
+        cursor.close()
+
+
+def apply_sqlite_pragmas(target: AsyncEngine) -> None:
+    """
+    Настраивает каждое новое соединение SQLite-движка (для других БД — ничего).
+    """
+    if target.dialect.name == "sqlite":
+        event.listen(target.sync_engine, "connect", _set_sqlite_pragmas)
+
+
+apply_sqlite_pragmas(engine)
+
+
+# ------------------------------------------------------------
+# INSERT ... ON CONFLICT для текущего диалекта
+# ------------------------------------------------------------
+def dialect_insert(table: Any) -> Optional[Any]:
+    """
+    insert() с поддержкой on_conflict_do_update/do_nothing для SQLite и
+    PostgreSQL. Для других диалектов — None (вызывающий делает fallback).
+    """
+    name = engine.dialect.name
+    if name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        return None
+    return insert(table)
+
+
 # ------------------------------------------------------------
 # Инициализация схемы
 # ------------------------------------------------------------
 async def init_db() -> None:
     """
-    Создаёт таблицы при первом запуске.
+    Создаёт таблицы при первом запуске и дополняет схему после обновления бота.
     Важно: импортируем models, чтобы все маппинги были зарегистрированы в Base.metadata.
     """
     # Ленивая регистрация моделей
     from . import models  # noqa: F401  # регистрирует таблицы в Base
 
     async with engine.begin() as conn:
-        await conn.run_sync(Base.metadata.create_all)
+        await conn.run_sync(upgrade_schema)
+
+
+def upgrade_schema(conn: Any) -> None:
+    """
+    Приводит схему к моделям: новые таблицы, затем колонки и индексы,
+    которых нет в базе, созданной предыдущей версией бота.
+    """
+    Base.metadata.create_all(conn)
+    _add_missing_columns(conn)
+    _create_missing_indexes(conn)
+
+
+def _add_missing_columns(conn: Any) -> None:
+    """
+    create_all не трогает уже существующие таблицы: колонки, добавленные
+    в модели позже (база создана старой версией бота), досоздаём через
+    ALTER TABLE ... ADD COLUMN. Новые колонки либо nullable, либо с
+    server_default — иначе ADD COLUMN на непустой таблице невозможен.
+    Внешние ключи таких колонок в старой базе не создаются (ALTER TABLE
+    в SQLite их не добавляет), сами значения от этого не зависят.
+    """
+    inspector = inspect(conn)
+    preparer = conn.dialect.identifier_preparer
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {c["name"] for c in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            if isinstance(column.type, SchemaType):
+                # PostgreSQL: тип ENUM создаётся отдельно от колонки
+                column.type.create(conn, checkfirst=True)
+            ddl = CreateColumn(column).compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+            logger.info("added column %s.%s", table.name, column.name)
+
+
+def _create_missing_indexes(conn: Any) -> None:
+    # индексы новых колонок и индексы, добавленные в модели позже
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
 
 
 # ------------------------------------------------------------
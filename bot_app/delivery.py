@@ -0,0 +1,337 @@
+# bot_app/delivery.py
+import os
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, List, Optional, Sequence, Tuple
+
+from aiogram.exceptions import TelegramBadRequest, TelegramEntityTooLarge
+from aiogram.types import InputMediaAudio, InputMediaVideo, Message
+from sqlalchemy import delete, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal
+from .downloader import YTDLP_FORMAT, format_for
+from .keyboard import main_menu
+from .models import Batch, Download, DownloadStatus, MediaKind, TelegramFile, User
+from .outbox import outbox, PRIORITY_STATUS
+from .storage import storage_for
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Хранилище Telegram file_id (side-таблица по video_id + формат)
+# ------------------------------------------------------------
+async def get_file_id(video_id: str, fmt: str = YTDLP_FORMAT) -> Optional[str]:
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            select(TelegramFile.file_id).where(
+                TelegramFile.video_id == video_id,
+                TelegramFile.format == fmt,
+            )
+        )
+        return q.scalar_one_or_none()
+
+
+async def _remember_file_id(video_id: str, fmt: str, file_id: str, file_unique_id: Optional[str]) -> None:
+    async with AsyncSessionLocal() as session:
+        session.add(
+            TelegramFile(
+                video_id=video_id,
+                format=fmt,
+                file_id=file_id,
+                file_unique_id=file_unique_id,
+            )
+        )
+        try:
+            await session.commit()
+        except IntegrityError:
+            # параллельная отправка уже сохранила свой file_id — он тоже валиден
+            await session.rollback()
+
+
+async def _forget_file_id(video_id: str, fmt: str) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            delete(TelegramFile).where(
+                TelegramFile.video_id == video_id,
+                TelegramFile.format == fmt,
+            )
+        )
+        await session.commit()
+
+
+def _sent_file(message: Message) -> Optional[Tuple[str, str]]:
+    """
+    file_id отправленного файла. Telegram может превратить видео (или
+    аудио) в документ, поэтому смотрим все поля.
+    """
+    media = message.video or message.audio or message.document
+    if media is None:
+        return None
+    return media.file_id, media.file_unique_id
+
+
+# ------------------------------------------------------------
+# Доставка результата в чат
+# ------------------------------------------------------------
+# Telegram: в альбоме от 2 до 10 элементов
+MEDIA_GROUP_SIZE = 10
+# Сколько секунд отправка пакета принадлежит взявшему её вызову; если
+# итог за это время не ушёл (процесс упал, ошибка Telegram), пакет
+# отправляется заново
+BATCH_DELIVERY_TIMEOUT = float(os.getenv("BATCH_DELIVERY_TIMEOUT", "600"))
+
+
+async def _resolve_chat(chat_id: Optional[int], user_id: int) -> int:
+    if chat_id is not None:
+        return chat_id
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(select(User.telegram_id).where(User.id == user_id))
+        return q.scalar_one()
+
+
+async def deliver(download_id: int) -> None:
+    """
+    Отправляет результат загрузки пользователю (через outbox, полоса уведомлений).
+    Первый раз файл заливается в Telegram, полученный file_id сохраняется;
+    все повторные запросы того же видео уходят по file_id без upload.
+    Задачи пакета отправляются вместе, см. deliver_batch.
+    """
+    async with AsyncSessionLocal() as session:
+        d: Optional[Download] = await session.get(Download, download_id)
+    if d is None:
+        return
+    if d.batch_id is not None:
+        await deliver_batch(d.batch_id)
+        return
+
+    chat_id = await _resolve_chat(d.chat_id, d.user_id)
+
+    if d.status == DownloadStatus.failed:
+        await outbox.send_message(
+            chat_id,
+            f"❌ Не вдалося завантажити відео (ID {d.id}).",
+            reply_markup=main_menu(),
+            priority=PRIORITY_STATUS,
+        )
+        return
+    if d.status != DownloadStatus.done:
+        return
+
+    await _send_one(d, chat_id)
+
+
+def _send_media(d: Download, chat_id: int, media: Any, caption: str) -> asyncio.Future:
+    # аудио — как трек (плеер в клиенте), видео — со стримингом
+    if d.kind == MediaKind.audio:
+        return outbox.send_audio(chat_id, media, caption=caption)
+    return outbox.send_video(chat_id, media, caption=caption, supports_streaming=True)
+
+
+async def _send_one(d: Download, chat_id: int) -> bool:
+    """
+    Одно видео (или аудио): по file_id или upload. Об ошибке сообщает в чат сама.
+    """
+    caption = f"✅ Готово (ID {d.id})"
+    fmt = format_for(d.kind)
+
+    # 1) Быстрый путь: уже есть file_id — отправка без передачи файла
+    if d.video_id:
+        file_id = await get_file_id(d.video_id, fmt)
+        if file_id:
+            try:
+                await _send_media(d, chat_id, file_id, caption)
+                return True
+            except TelegramBadRequest as e:
+                # file_id больше не принимается — зальём файл заново
+                logger.warning("stale file_id for %s: %s", d.video_id, e)
+                await _forget_file_id(d.video_id, fmt)
+
+    # 2) Первая отправка: upload из хранилища
+    source = await _upload_source(d)
+    if source is None:
+        await outbox.send_message(
+            chat_id,
+            f"❌ Файл для завантаження {d.id} більше недоступний.",
+            reply_markup=main_menu(),
+            priority=PRIORITY_STATUS,
+        )
+        return False
+
+    try:
+        message = await _send_media(d, chat_id, source, caption)
+    except TelegramEntityTooLarge:
+        await outbox.send_message(
+            chat_id,
+            f"⚠️ Файл завантаження {d.id} завеликий для відправки в Telegram.",
+            reply_markup=main_menu(),
+            priority=PRIORITY_STATUS,
+        )
+        return False
+
+    sent = _sent_file(message)
+    if sent and d.video_id:
+        await _remember_file_id(d.video_id, fmt, *sent)
+    return True
+
+
+async def _upload_source(d: Download) -> Optional[Any]:
+    # InputFile из хранилища; None — файла больше нет
+    storage = storage_for(d.file_path or "")
+    if not d.file_path or not await asyncio.to_thread(storage.exists, d.file_path):
+        return None
+    return await asyncio.to_thread(storage.input_file, d.file_path)
+
+
+# ------------------------------------------------------------
+# Доставка пакета (альбомами)
+# ------------------------------------------------------------
+def _batch_finished() -> Any:
+    # все задачи пакета завершены (условие на строку batches)
+    unfinished = (
+        select(Download.id)
+        .where(
+            Download.batch_id == Batch.id,
+            Download.status.not_in((DownloadStatus.done, DownloadStatus.failed)),
+        )
+        .exists()
+    )
+    return ~unfinished
+
+
+def _batch_undelivered() -> Any:
+    # развёрнут, не отправлен и его отправку никто не держит
+    # (или держатель не уложился в BATCH_DELIVERY_TIMEOUT)
+    expired = datetime.utcnow() - timedelta(seconds=BATCH_DELIVERY_TIMEOUT)
+    return (
+        Batch.total.is_not(None),
+        Batch.delivered_at.is_(None),
+        or_(Batch.delivering_at.is_(None), Batch.delivering_at < expired),
+    )
+
+
+async def _claim_batch(batch_id: int) -> Optional[Any]:
+    """
+    Забирает отправку пакета: он развёрнут (total известен), все его задачи
+    завершены и он ещё не отправлен. Одно условное UPDATE — строку получит
+    ровно один вызов, в каком бы процессе ни завершилась последняя задача.
+    Это lease, а не отметка об отправке: delivered_at ставится только
+    после итогового сообщения, иначе пакет досылается по истечении
+    BATCH_DELIVERY_TIMEOUT (deliver_pending_batches).
+    """
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            update(Batch)
+            .where(Batch.id == batch_id, *_batch_undelivered(), _batch_finished())
+            .values(delivering_at=datetime.utcnow())
+            .returning(Batch.user_id, Batch.chat_id, Batch.total)
+        )
+        row = q.first()
+        await session.commit()
+    return row
+
+
+async def _mark_delivered(batch_id: int) -> None:
+    async with AsyncSessionLocal() as session:
+        await session.execute(
+            update(Batch).where(Batch.id == batch_id).values(delivered_at=datetime.utcnow(), delivering_at=None)
+        )
+        await session.commit()
+
+
+async def deliver_batch(batch_id: int) -> None:
+    """
+    Вызывается после каждой задачи пакета; когда завершена последняя —
+    готовые видео уходят альбомами по MEDIA_GROUP_SIZE, затем итог.
+    Видео и аудио в одном альбоме Telegram не смешивает — альбомы по видам.
+    """
+    batch = await _claim_batch(batch_id)
+    if batch is None:
+        return
+    if not batch.total:
+        await _mark_delivered(batch_id)
+        return
+    chat_id = await _resolve_chat(batch.chat_id, batch.user_id)
+
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(select(Download).where(Download.batch_id == batch_id).order_by(Download.id))
+        items = q.scalars().all()
+    ready = [d for d in items if d.status == DownloadStatus.done]
+    failed = [d.id for d in items if d.status != DownloadStatus.done]
+
+    sent = 0
+    for kind in MediaKind:
+        same = [d for d in ready if d.kind == kind]
+        for i in range(0, len(same), MEDIA_GROUP_SIZE):
+            delivered, missing = await _send_group(chat_id, same[i:i + MEDIA_GROUP_SIZE])
+            sent += delivered
+            failed.extend(missing)
+
+    text = f"📦 Пакет {batch_id}: надіслано {sent} з {len(items)}."
+    if failed:
+        text += "\n❌ Не вдалося: " + ", ".join(f"ID {i}" for i in sorted(failed))
+    await outbox.send_message(chat_id, text, reply_markup=main_menu(), priority=PRIORITY_STATUS)
+    await _mark_delivered(batch_id)
+
+
+async def deliver_pending_batches() -> int:
+    """
+    Досылает пакеты, отправка которых не завершилась: процесс упал между
+    захватом и итогом или отправка упала с ошибкой. Возвращает число
+    пакетов, которые удалось отправить.
+    """
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(select(Batch.id).where(*_batch_undelivered(), _batch_finished()))
+        ids = q.scalars().all()
+    done = 0
+    for batch_id in ids:
+        try:
+            await deliver_batch(batch_id)
+        except Exception:
+            logger.exception("delivery of batch %s failed", batch_id)
+        else:
+            done += 1
+    return done
+
+
+async def _send_group(chat_id: int, group: Sequence[Download]) -> Tuple[int, List[int]]:
+    """
+    Один альбом (все элементы одного вида). Возвращает (сколько отправлено, ID файлов, которых нет).
+    Если альбом не принят (устаревший file_id, слишком большой файл),
+    видео уходят по одному — с обычной обработкой ошибок и сообщениями.
+    """
+    members: List[Tuple[Download, Optional[str]]] = []
+    media: List[Any] = []
+    missing: List[int] = []
+    for d in group:
+        file_id = await get_file_id(d.video_id, format_for(d.kind)) if d.video_id else None
+        source = file_id or await _upload_source(d)
+        if source is None:
+            missing.append(d.id)
+            continue
+        members.append((d, file_id))
+        if d.kind == MediaKind.audio:
+            media.append(InputMediaAudio(media=source, caption=f"✅ ID {d.id}"))
+        else:
+            media.append(InputMediaVideo(media=source, caption=f"✅ ID {d.id}", supports_streaming=True))
+
+    if len(media) < 2:
+        # альбом из одного элемента Telegram не принимает
+        sent = [await _send_one(d, chat_id) for d, _ in members]
+        return sum(sent), missing
+
+    try:
+        messages = await outbox.send_media_group(chat_id, media)
+    except (TelegramBadRequest, TelegramEntityTooLarge) as e:
+        logger.warning("media group to %s rejected, sending one by one: %s", chat_id, e)
+        sent = [await _send_one(d, chat_id) for d, _ in members]
+        return sum(sent), missing
+
+    for (d, file_id), message in zip(members, messages):
+        uploaded = _sent_file(message)
+        if file_id is None and uploaded and d.video_id:
+            await _remember_file_id(d.video_id, format_for(d.kind), *uploaded)
+    return len(members), missing
@@ -0,0 +1,209 @@
+# bot_app/diskbudget.py
+import os
+import time
+import shutil
+import asyncio
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import delete, func, update
+from sqlalchemy.future import select
+
+from .cache import download_cache
+from .db import AsyncSessionLocal
+from .downloader import YTDLP_FORMAT, format_for
+from .models import Download, DownloadStatus, StoredFile
+from .staging import FINAL_DIR
+from .storage import is_remote, storage_for
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Сколько байт могут занимать готовые файлы (0 — без лимита)
+MAX_BYTES = int(os.getenv("DOWNLOADS_MAX_BYTES", "0"))
+# Сколько места должно оставаться свободным на ФС DOWNLOADS_DIR (0 — не следить)
+MIN_FREE_BYTES = int(os.getenv("DOWNLOADS_MIN_FREE_BYTES", "0"))
+# last_access одного файла пишем в БД не чаще раза в столько секунд
+TOUCH_INTERVAL = float(os.getenv("DISK_TOUCH_INTERVAL", "60"))
+# Периодическая проверка водяного знака (место могут занять и не мы)
+CHECK_INTERVAL = float(os.getenv("DISK_BUDGET_INTERVAL", "60"))
+# Сколько кандидатов на вытеснение читать из индекса за раз
+EVICT_BATCH = 32
+
+
+# ------------------------------------------------------------
+# Менеджер дискового бюджета
+# ------------------------------------------------------------
+class DiskBudget:
+    """
+    Следит за размером DOWNLOADS_DIR по индексу StoredFile, а не по
+    обходу директории: счётчик used меняется при register/вытеснении.
+    Когда превышен MAX_BYTES или свободного места меньше MIN_FREE_BYTES,
+    удаляет давно не использованные файлы (LRU по last_access), очищает
+    Download.file_path и ставит evicted_at. Повторный запрос такого видео
+    уйдёт по Telegram file_id или скачается заново.
+    """
+
+    def __init__(
+        self,
+        root: Path = FINAL_DIR,
+        max_bytes: int = MAX_BYTES,
+        min_free_bytes: int = MIN_FREE_BYTES,
+    ) -> None:
+        self.root = root
+        self.max_bytes = max(0, max_bytes)
+        self.min_free_bytes = max(0, min_free_bytes)
+        self.used = 0
+        self._touched: Dict[str, float] = {}
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0 or self.min_free_bytes > 0
+
+    def over_budget(self) -> bool:
+        if self.max_bytes and self.used > self.max_bytes:
+            return True
+        if self.min_free_bytes:
+            try:
+                return shutil.disk_usage(self.root).free < self.min_free_bytes
+            except OSError:
+                return False
+        return False
+
+    # ---------------- учёт ----------------
+    async def _indexed_bytes(self) -> int:
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(select(func.coalesce(func.sum(StoredFile.size), 0)))
+            return int(q.scalar_one())
+
+    async def load(self) -> int:
+        """
+        Читает занятый объём из индекса. При первом запуске индекс пуст —
+        заполняем его из готовых загрузок (один раз, дальше только инкрементно).
+        """
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(select(func.count(StoredFile.id)))
+            if q.scalar_one() == 0:
+                # формат — по виду загрузки: с ним файл лежит в download_cache,
+                # и по нему же _evict убирает запись из кеша
+                q = await session.execute(
+                    select(Download.file_path, Download.video_id, Download.kind).where(
+                        Download.status == DownloadStatus.done,
+                        Download.file_path.is_not(None),
+                    )
+                )
+                files = {path: (video_id, kind) for path, video_id, kind in q.all()}
+                for path, (video_id, kind) in files.items():
+                    if is_remote(path):
+                        continue
+                    try:
+                        size = Path(path).stat().st_size
+                    except OSError:
+                        continue
+                    session.add(StoredFile(path=path, size=size, video_id=video_id, format=format_for(kind)))
+                await session.commit()
+        self.used = await self._indexed_bytes()
+        return self.used
+
+    async def register(self, path: str, size: int, video_id: Optional[str], fmt: str = YTDLP_FORMAT) -> None:
+        """
+        Новый файл в хранилище (path — location). Сразу проверяет бюджет;
+        сам этот файл не вытесняется.
+        """
+        key = str(path)
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(select(StoredFile).where(StoredFile.path == key))
+            row = q.scalar_one_or_none()
+            if row is None:
+                delta = size
+                session.add(StoredFile(path=key, size=size, video_id=video_id, format=fmt))
+            else:
+                delta = size - row.size
+                row.size = size
+                row.last_access = datetime.utcnow()
+            await session.commit()
+        self.used += delta
+        self._touched[key] = time.monotonic()
+        await self.enforce(keep=(key,))
+
+    async def touch(self, path: str) -> None:
+        """
+        Файл снова понадобился (попадание в кеш). Запись в БД — не чаще
+        раза в TOUCH_INTERVAL: для LRU точность до минуты достаточна.
+        """
+        key = str(path)
+        now = time.monotonic()
+        if now - self._touched.get(key, float("-inf")) < TOUCH_INTERVAL:
+            return
+        self._touched[key] = now
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(StoredFile).where(StoredFile.path == key).values(last_access=datetime.utcnow())
+            )
+            await session.commit()
+
+    # ---------------- вытеснение ----------------
+    async def enforce(self, keep: Iterable[str] = ()) -> int:
+        """
+        Вытесняет LRU-файлы, пока бюджет превышен. Возвращает число удалённых.
+        """
+        if not self.enabled or not self.over_budget():
+            return 0
+        keep = set(keep)
+        evicted = 0
+        async with self._lock:
+            # другие процессы тоже пишут в индекс — перед удалением сверяемся с ним
+            self.used = await self._indexed_bytes()
+            while self.over_budget():
+                stmt = select(StoredFile).order_by(StoredFile.last_access, StoredFile.id).limit(EVICT_BATCH)
+                if keep:
+                    stmt = stmt.where(StoredFile.path.not_in(keep))
+                async with AsyncSessionLocal() as session:
+                    victims = (await session.execute(stmt)).scalars().all()
+                if not victims:
+                    logger.warning("disk budget exceeded, but nothing left to evict")
+                    break
+                for victim in victims:
+                    if not self.over_budget():
+                        break
+                    await self._evict(victim)
+                    evicted += 1
+        if evicted:
+            logger.info("evicted %s file(s), %s bytes in use", evicted, self.used)
+        return evicted
+
+    async def _evict(self, victim: StoredFile) -> None:
+        # сначала убираем все ссылки на файл, потом сам файл
+        if victim.video_id:
+            download_cache.discard(victim.video_id, victim.format or YTDLP_FORMAT)
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(StoredFile).where(StoredFile.id == victim.id))
+            await session.execute(
+                update(Download)
+                .where(Download.file_path == victim.path)
+                .values(file_path=None, evicted_at=datetime.utcnow())
+            )
+            await session.commit()
+        self.used -= victim.size
+        self._touched.pop(victim.path, None)
+        try:
+            await asyncio.to_thread(storage_for(victim.path).delete, victim.path)
+        except Exception:
+            logger.warning("cannot remove evicted file %s", victim.path, exc_info=True)
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(CHECK_INTERVAL)
+            try:
+                await self.enforce()
+            except Exception:
+                logger.exception("disk budget check failed")
+
+
+disk_budget = DiskBudget()
@@ -1,28 +1,202 @@
 # bot_app/downloader.py
+import os
+import sys
+import json
+import time
+import uuid
+import queue
+import signal
 import asyncio
-import tempfile
-import shutil
+import threading
+import logging
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import Optional
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 
-import yt_dlp
+from . import metrics
+from .rangefetch import JOURNAL_SUFFIX, download_ranges, journal_bytes
+from .staging import STAGING_DIR
+from .storage import get_storage
+from .utils import extract_video_id
 
+logger = logging.getLogger(__name__)
+
+
+# Формат по умолчанию; входит в ключ кеша готовых файлов
+YTDLP_FORMAT = "mp4/bestvideo+bestaudio/best"
+# Формат для задач «лише аудіо»: дорожка m4a (AAC) перепаковывается
+# без перекодирования, см. postprocess.py
+YTDLP_AUDIO_FORMAT = "bestaudio[ext=m4a]/bestaudio/best"
+# Куда yt-dlp пишет файлы до переноса в итоговую директорию
+# (на той же ФС, что и DOWNLOADS_DIR — см. staging.py)
+DOWNLOAD_TMP_DIR = STAGING_DIR
+
+# Бюджет соединений на одну задачу: параллельные фрагменты DASH/HLS
+# и параллельные Range-запросы для цельных (progressive) форматов.
+# По умолчанию 1 — одно соединение; несколько включаются явно
+DOWNLOAD_CONNECTIONS = int(os.getenv("DOWNLOAD_CONNECTIONS", "1"))
+# Цельные файлы меньше порога качаем одним соединением
+RANGE_SPLIT_MIN_BYTES = int(os.getenv("RANGE_SPLIT_MIN_BYTES", str(8 * 1024 * 1024)))
+# Какие экстракторы yt-dlp подключать (имена/regex через запятую, как
+# --use-extractors). Бот принимает только ссылки YouTube, а YoutubeDL
+# с полным списком (~1800 экстракторов) создаётся в десятки раз дольше.
+# "default" — все, как в CLI
+YTDLP_EXTRACTORS = [e.strip() for e in os.getenv("YTDLP_EXTRACTORS", "youtube,youtube:.*,end").split(",") if e.strip()]
 
 # ------------------------------------------------------------
-# yt-dlp utility
+# Где выполнять yt-dlp
+# ------------------------------------------------------------
+# DOWNLOAD_EXECUTOR:
+#   thread     — asyncio.to_thread в процессе бота (как раньше)
+#   process    — ProcessPoolExecutor: парсинг/дешифровка не делят GIL с event loop
+#   subprocess — отдельный процесс `python -m yt_dlp` на каждую задачу
+DOWNLOAD_EXECUTOR = os.getenv("DOWNLOAD_EXECUTOR", "thread").lower()
+# Размер пула (по умолчанию — как число воркеров очереди)
+DOWNLOAD_POOL_SIZE = int(os.getenv("DOWNLOAD_POOL_SIZE", os.getenv("WORKER_CONCURRENCY", "2")))
+# Процесс пула перезапускается после N задач, чтобы не копить память
+DOWNLOAD_MAX_TASKS_PER_CHILD = int(os.getenv("DOWNLOAD_MAX_TASKS_PER_CHILD", "20"))
+# Команда запуска yt-dlp для режима subprocess
+YTDLP_CMD = os.getenv("YTDLP_CMD", f"{sys.executable} -m yt_dlp").split()
+# Сколько ждать, пока прерванная загрузка (остановка бота) допишет .part
+DOWNLOAD_STOP_TIMEOUT = float(os.getenv("DOWNLOAD_STOP_TIMEOUT", "10"))
+
+
+# Сколько видео максимум берём из одного плейлиста/канала
+PLAYLIST_MAX_ITEMS = int(os.getenv("PLAYLIST_MAX_ITEMS", "50"))
+# Глубина вложенности при развороте (канал -> вкладка -> плейлист)
+PLAYLIST_MAX_DEPTH = 2
+
+
+# Прогресс: не чаще раза в PROGRESS_INTERVAL сек и при изменении
+# не меньше PROGRESS_MIN_DELTA процентов
+PROGRESS_INTERVAL = float(os.getenv("PROGRESS_INTERVAL", "5"))
+PROGRESS_MIN_DELTA = float(os.getenv("PROGRESS_MIN_DELTA", "5"))
+
+# Снимок прогресса: downloaded, total, speed, eta
+Progress = Dict[str, Any]
+ProgressCallback = Callable[[Progress], None]
+
+
+class DownloadError(RuntimeError):
+    """
+    Ошибка скачивания; текст уходит в Download.error.
+    """
+
+
+# ------------------------------------------------------------
+# Прогресс загрузки
 # ------------------------------------------------------------
-async def run_ytdlp(url: str, out_filename: str) -> Optional[Path]:
+class ProgressGate:
+    """
+    Дешёвый фильтр на стороне загрузки (поток/процесс yt-dlp): пропускает
+    снимок, только если прошло достаточно времени И процент заметно изменился.
+    Всё остальное отбрасывается, не доходя до event loop.
+    """
+
+    def __init__(self, interval: float = PROGRESS_INTERVAL, min_delta: float = PROGRESS_MIN_DELTA) -> None:
+        self.interval = interval
+        self.min_delta = min_delta
+        self._last_time = float("-inf")
+        self._last_pct: Optional[float] = None
+
+    def allow(self, downloaded: int, total: Optional[int]) -> bool:
+        now = time.monotonic()
+        if now - self._last_time < self.interval:
+            return False
+        if total:
+            pct = downloaded * 100 / total
+            # при переходе к следующему потоку (аудио после видео) процент падает
+            if self._last_pct is not None and abs(pct - self._last_pct) < self.min_delta:
+                return False
+            self._last_pct = pct
+        self._last_time = now
+        return True
+
+
+def _progress_hook(progress: ProgressCallback) -> Callable[[Dict[str, Any]], None]:
+    gate = ProgressGate()
+
+    def hook(d: Dict[str, Any]) -> None:
+        if d.get("status") != "downloading":
+            return
+        downloaded = d.get("downloaded_bytes") or 0
+        total = d.get("total_bytes") or d.get("total_bytes_estimate")
+        if gate.allow(downloaded, total):
+            progress({
+                "downloaded": downloaded,
+                "total": total,
+                "speed": d.get("speed"),
+                "eta": d.get("eta"),
+            })
+
+    return hook
+
+
+class _StopCheck:
+    """
+    Флаг остановки загрузки для кода в потоке/процессе пула. event —
+    threading.Event или прокси Manager().Event(): у прокси каждая проверка —
+    обращение к процессу Manager'а, поэтому не чаще interval.
+    """
+
+    def __init__(self, event: Any, interval: float = 0.25) -> None:
+        self.event = event
+        self.interval = interval
+        self._last = float("-inf")
+        self._set = False
+
+    def __call__(self) -> bool:
+        if not self._set:
+            now = time.monotonic()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._set = self.event.is_set()
+        return self._set
+
+
+def _stop_hook(stopped: _StopCheck) -> Callable[[Dict[str, Any]], None]:
+    # yt-dlp прерывает загрузку на исключении из хука; .part остаётся (continuedl)
+    def hook(d: Dict[str, Any]) -> None:
+        if stopped():
+            from yt_dlp.utils import DownloadCancelled
+
+            raise DownloadCancelled("download stopped")
+
+    return hook
+
+
+class _QueueProgress:
+    """
+    Передаёт прогресс из процесса пула в родителя через очередь Manager'а.
+    Должен пиклиться, поэтому — класс модуля, а не замыкание.
+    """
+
+    def __init__(self, queue: Any, key: str) -> None:
+        self.queue = queue
+        self.key = key
+
+    def __call__(self, snapshot: Progress) -> None:
+        self.queue.put((self.key, snapshot))
+
+
+def format_for(kind: str) -> str:
     """
-    Асинхронно запускает yt-dlp для скачивания видео.
-    Возвращает путь к готовому файлу или None, если не удалось.
+    Формат yt-dlp для вида задачи (Download.kind); он же — ключ кеша
+    готовых файлов и file_id.
     """
-    tmpdir = Path(tempfile.gettempdir()) / "multitoolex_downloads"
-    tmpdir.mkdir(parents=True, exist_ok=True)
-    output_path = tmpdir / f"{out_filename}.%(ext)s"
+    return YTDLP_AUDIO_FORMAT if kind == "audio" else YTDLP_FORMAT
+
 
-    ydl_opts = {
-        "format": "mp4/bestvideo+bestaudio/best",
-        "outtmpl": str(output_path),
+def _ydl_opts(outtmpl: Optional[str] = None, fmt: str = YTDLP_FORMAT) -> dict:
+    """
+    Общие опции yt-dlp для скачивания и для предварительного extract_info:
+    формат один и тот же, чтобы оценка размера совпадала с тем, что скачаем.
+    """
+    opts = {
+        "format": fmt,
         "quiet": True,
         "noprogress": True,
         "merge_output_format": "mp4",
@@ -30,38 +204,719 @@ async def run_ytdlp(url: str, out_filename: str) -> Optional[Path]:
         "nocheckcertificate": True,
         "geo_bypass": True,
         "continuedl": True,
-        "ignoreerrors": True,
+        # задача — всегда одно видео (watch?v=…&list=… тоже);
+        # плейлисты разворачиваются в пакет задач, см. iter_playlist
+        "noplaylist": True,
+        "concurrent_fragment_downloads": max(1, DOWNLOAD_CONNECTIONS),
+        "allowed_extractors": YTDLP_EXTRACTORS,
     }
+    if outtmpl is not None:
+        opts["outtmpl"] = outtmpl
+    return opts
 
-    def _download_sync() -> Optional[Path]:
-        try:
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+
+# ------------------------------------------------------------
+# Ленивый yt-dlp и переиспользуемые экземпляры YoutubeDL
+# ------------------------------------------------------------
+# yt_dlp импортируется при первом вызове (или в prewarm), а не при импорте
+# модуля: polling стартует, не дожидаясь загрузки экстракторов.
+# Для extract_info экземпляры YoutubeDL не создаются заново на каждый
+# вызов, а берутся из пула (по одному на одновременный вызов: YoutubeDL
+# не потокобезопасен). Для скачивания — новый экземпляр: у каждой задачи
+# свои outtmpl и хуки.
+_ydl_pools: Dict[str, "queue.SimpleQueue"] = {}
+_ydl_pools_lock = threading.Lock()
+
+
+def _new_ydl(ydl_opts: dict) -> Any:
+    import yt_dlp
+
+    return yt_dlp.YoutubeDL(ydl_opts)
+
+
+@contextmanager
+def _pooled_ydl(ydl_opts: dict) -> Iterator[Any]:
+    key = repr(sorted(ydl_opts.items()))
+    with _ydl_pools_lock:
+        pool = _ydl_pools.setdefault(key, queue.SimpleQueue())
+    try:
+        ydl = pool.get_nowait()
+    except queue.Empty:
+        ydl = _new_ydl(ydl_opts)
+    try:
+        yield ydl
+    finally:
+        pool.put(ydl)
+
+
+def _close_ydl_pools() -> None:
+    with _ydl_pools_lock:
+        pools = list(_ydl_pools.values())
+        _ydl_pools.clear()
+    for pool in pools:
+        while True:
+            try:
+                pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def _warm_sync() -> None:
+    """
+    Импортирует yt_dlp, кладёт в пул готовый YoutubeDL и загружает модуль
+    экстрактора YouTube — первая ссылка не платит за холодный старт.
+    Также initializer процессов пула (DOWNLOAD_EXECUTOR=process).
+    """
+    with _pooled_ydl(_ydl_opts()) as ydl:
+        ydl.get_info_extractor("Youtube")
+
+
+# ------------------------------------------------------------
+# Синхронные вызовы yt-dlp (поток или процесс пула)
+# ------------------------------------------------------------
+# Выполняются вне event loop. Должны оставаться функциями модуля,
+# чтобы их можно было передать в ProcessPoolExecutor.
+def _as_download_error(e: Exception) -> DownloadError:
+    # исключения yt-dlp не всегда переживают pickle — передаём текст
+    return DownloadError(str(e) or e.__class__.__name__)
+
+
+def _extract_sync(url: str, ydl_opts: dict) -> Dict[str, Any]:
+    try:
+        with _pooled_ydl(ydl_opts) as ydl:
+            info = ydl.extract_info(url, download=False)
+            if not info:
+                raise DownloadError("yt-dlp returned no result")
+            return ydl.sanitize_info(info)
+    except DownloadError:
+        raise
+    except Exception as e:
+        raise _as_download_error(e) from None
+
+
+def _walk_flat(ydl: Any, result: Dict[str, Any], depth: int) -> Iterator[str]:
+    """
+    Ссылки на видео из результата extract_info(process=False). Записи
+    плейлиста — «плоские» url-результаты; генератор entries yt-dlp читает
+    страницы плейлиста по мере обхода.
+    """
+    kind = result.get("_type", "video")
+    if kind == "playlist":
+        for entry in result.get("entries") or ():
+            if entry:
+                yield from _walk_flat(ydl, entry, depth)
+    elif kind in ("url", "url_transparent"):
+        url = result.get("url")
+        if not url:
+            return
+        if result.get("ie_key") == "Youtube" or extract_video_id(url):
+            yield url
+        elif depth < PLAYLIST_MAX_DEPTH:
+            # вкладка канала или вложенный плейлист
+            nested = ydl.extract_info(url, download=False, process=False)
+            if nested:
+                yield from _walk_flat(ydl, nested, depth + 1)
+    elif result.get("webpage_url"):
+        yield result["webpage_url"]
+
+
+def _flat_entries_sync(
+    url: str,
+    ydl_opts: dict,
+    limit: int,
+    emit: Callable[[str], None],
+    stopped: threading.Event,
+) -> None:
+    try:
+        with _pooled_ydl(ydl_opts) as ydl:
+            result = ydl.extract_info(url, download=False, process=False)
+            if not result:
+                raise DownloadError("yt-dlp returned no result")
+            count = 0
+            for video_url in _walk_flat(ydl, result, 0):
+                if stopped.is_set():
+                    return
+                emit(video_url)
+                count += 1
+                if count >= limit:
+                    return
+    except DownloadError:
+        raise
+    except Exception as e:
+        raise _as_download_error(e) from None
+
+
+def _range_split_target(info: Dict[str, Any]) -> Optional[int]:
+    """
+    Размер файла, если выбранный формат — один цельный HTTP-файл,
+    который стоит качать несколькими соединениями; иначе None.
+    """
+    if DOWNLOAD_CONNECTIONS < 2 or info.get("requested_formats"):
+        return None
+    if info.get("protocol") not in ("http", "https") or not info.get("url"):
+        return None
+    size = info.get("filesize") or info.get("filesize_approx")
+    if not size or size < RANGE_SPLIT_MIN_BYTES:
+        return None
+    return int(size)
+
+
+def _merge_timer() -> Callable[[Dict[str, Any]], None]:
+    """
+    postprocessor hook: время склейки дорожек (Merger) -> bot_job_stage_seconds{stage="merge"}.
+    Видно только для DOWNLOAD_EXECUTOR=thread: у процессов пула свой реестр,
+    а в subprocess склейка входит в этап download.
+    """
+    started: Dict[str, float] = {}
+
+    def hook(d: Dict[str, Any]) -> None:
+        if d.get("postprocessor") != "Merger":
+            return
+        if d.get("status") == "started":
+            started["merge"] = time.perf_counter()
+        elif d.get("status") == "finished" and "merge" in started:
+            metrics.JOB_STAGE_SECONDS.labels("merge").observe(time.perf_counter() - started.pop("merge"))
+
+    return hook
+
+
+def _download_sync(
+    url: str,
+    ydl_opts: dict,
+    info: Optional[Dict[str, Any]] = None,
+    progress: Optional[ProgressCallback] = None,
+    stop: Any = None,
+) -> str:
+    """
+    info — результат extract_info(download=False): если есть,
+    повторного извлечения страницы не будет.
+    progress вызывается в этом же потоке/процессе, уже после ProgressGate.
+    stop — Event: если выставлен, загрузка прерывается на ближайшем блоке
+    (DownloadError), недокачанный файл остаётся в staging для докачки.
+    """
+    hook = _progress_hook(progress) if progress is not None else None
+    stopped = _StopCheck(stop) if stop is not None else None
+    hooks = []
+    if hook is not None:
+        hooks.append(hook)
+    if stopped is not None:
+        hooks.append(_stop_hook(stopped))
+    if hooks:
+        ydl_opts = {**ydl_opts, "progress_hooks": hooks}
+    if metrics.METRICS_ENABLED:
+        ydl_opts = {**ydl_opts, "postprocessor_hooks": [_merge_timer()]}
+    try:
+        with _new_ydl(ydl_opts) as ydl:
+            if info is None and DOWNLOAD_CONNECTIONS > 1:
+                # сначала выбираем формат, чтобы решить, как его качать
+                info = ydl.extract_info(url, download=False)
+            if info is not None and _range_split_target(info):
+                path = Path(ydl.prepare_filename(info))
+                if not (ydl_opts.get("continuedl") and path.exists()):
+                    try:
+                        download_ranges(
+                            info["url"],
+                            path,
+                            headers=info.get("http_headers"),
+                            connections=DOWNLOAD_CONNECTIONS,
+                            should_stop=stopped,
+                            progress=(
+                                (lambda done, total: hook({
+                                    "status": "downloading",
+                                    "downloaded_bytes": done,
+                                    "total_bytes": total,
+                                }))
+                                if hook is not None else None
+                            ),
+                        )
+                    except OSError:
+                        # сервер не отдаёт Range и т.п. — пусть качает yt-dlp
+                        info = ydl.process_ie_result(info, download=True)
+                        return ydl.prepare_filename(info)
+                return str(path)
+            if info is not None:
+                info = ydl.process_ie_result(info, download=True)
+            else:
                 info = ydl.extract_info(url, download=True)
-                if not info:
-                    return None
-                filename = ydl.prepare_filename(info)
-                return Path(filename)
-        except Exception:
+            if not info:
+                raise DownloadError("yt-dlp returned no result")
+            return ydl.prepare_filename(info)
+    except DownloadError:
+        raise
+    except Exception as e:
+        raise _as_download_error(e) from None
+
+
+# Строки прогресса в stdout yt-dlp (режим subprocess)
+_CLI_PROGRESS_PREFIX = "[progress] "
+_CLI_PROGRESS_TEMPLATE = (
+    "download:" + _CLI_PROGRESS_PREFIX
+    + "%(progress.downloaded_bytes)s %(progress.total_bytes)s "
+    "%(progress.total_bytes_estimate)s %(progress.speed)s %(progress.eta)s"
+)
+
+
+def _parse_cli_progress(line: str) -> Dict[str, Any]:
+    def _num(v: str) -> Optional[float]:
+        try:
+            return float(v)
+        except ValueError:  # "NA"
             return None
 
-    file_path = await asyncio.to_thread(_download_sync)
-    if file_path and file_path.exists():
-        return file_path
-    return None
+    downloaded, total, estimate, speed, eta = (line[len(_CLI_PROGRESS_PREFIX):].split() + ["NA"] * 5)[:5]
+    return {
+        "status": "downloading",
+        "downloaded_bytes": int(_num(downloaded) or 0),
+        "total_bytes": _num(total),
+        "total_bytes_estimate": _num(estimate),
+        "speed": _num(speed),
+        "eta": _num(eta),
+    }
+
+
+def _ytdlp_cli_args(url: str, ydl_opts: dict, info_json: Optional[Path] = None) -> List[str]:
+    """
+    Те же опции, что в ydl_opts, но для командной строки yt-dlp.
+    """
+    args = [
+        "-f", ydl_opts["format"],
+        "-o", ydl_opts["outtmpl"],
+        "--merge-output-format", ydl_opts["merge_output_format"],
+        "--retries", str(ydl_opts["retries"]),
+        "--concurrent-fragments", str(ydl_opts.get("concurrent_fragment_downloads", 1)),
+        "--newline",
+        "--progress",
+        "--progress-template", _CLI_PROGRESS_TEMPLATE,
+        "--no-simulate",
+        "--print", "after_move:filepath",
+        "--use-extractors", ",".join(ydl_opts.get("allowed_extractors") or ["default"]),
+    ]
+    if ydl_opts.get("nocheckcertificate"):
+        args.append("--no-check-certificates")
+    if ydl_opts.get("geo_bypass"):
+        args.append("--geo-bypass")
+    if ydl_opts.get("continuedl"):
+        args.append("--continue")
+    if ydl_opts.get("noplaylist"):
+        args.append("--no-playlist")
+    if info_json is not None:
+        return [*YTDLP_CMD, *args, "--load-info-json", str(info_json)]
+    return [*YTDLP_CMD, *args, "--", url]
+
+
+# ------------------------------------------------------------
+# Исполнители
+# ------------------------------------------------------------
+async def _stoppable(fut: asyncio.Future, stop: Any) -> Any:
+    """
+    Ждёт загрузку в потоке/процессе пула. Поток не отменить, поэтому
+    отмена задачи (остановка бота) выставляет stop: yt-dlp/rangefetch
+    прерываются на ближайшем блоке и оставляют .part, с которого задача
+    продолжится. Ждём этого не дольше DOWNLOAD_STOP_TIMEOUT.
+    """
+    try:
+        return await asyncio.shield(fut)
+    except asyncio.CancelledError:
+        stop.set()
+        # результат прерванной загрузки (DownloadError) уже не нужен
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        await asyncio.wait({fut}, timeout=DOWNLOAD_STOP_TIMEOUT)
+        raise
+
+
+class ThreadExecutor:
+    async def extract(self, url: str, ydl_opts: dict) -> Dict[str, Any]:
+        return await asyncio.to_thread(_extract_sync, url, ydl_opts)
+
+    async def download(
+        self,
+        url: str,
+        ydl_opts: dict,
+        info: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> str:
+        sink = None
+        if progress is not None:
+            loop = asyncio.get_running_loop()
+
+            def sink(snapshot: Progress) -> None:
+                # из потока загрузки — только передать в loop, без ожидания
+                loop.call_soon_threadsafe(progress, snapshot)
+
+        stop = threading.Event()
+        fut = asyncio.get_running_loop().run_in_executor(None, _download_sync, url, ydl_opts, info, sink, stop)
+        return await _stoppable(fut, stop)
+
+    async def warm(self) -> None:
+        await asyncio.to_thread(_warm_sync)
+
+    def shutdown(self) -> None:
+        _close_ydl_pools()
+
+
+class ProcessExecutor:
+    """
+    Ограниченный пул процессов; каждый процесс перезапускается после
+    max_tasks_per_child задач.
+    """
+
+    def __init__(self, max_workers: int, max_tasks_per_child: int) -> None:
+        self.max_workers = max(1, max_workers)
+        self.max_tasks_per_child = max(1, max_tasks_per_child)
+        self._pool: Optional[ProcessPoolExecutor] = None
+        # прогресс из процессов пула: очередь Manager'а + поток-читатель
+        self._manager: Any = None
+        self._progress_queue: Any = None
+        self._listeners: Dict[str, Any] = {}
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                max_tasks_per_child=self.max_tasks_per_child,
+                mp_context=multiprocessing.get_context("spawn"),
+                # каждый (пере)запущенный процесс сразу грузит yt-dlp
+                initializer=_warm_sync,
+            )
+        return self._pool
+
+    async def _run(self, fn, *args, stop: Any = None):
+        loop = asyncio.get_running_loop()
+        try:
+            fut = loop.run_in_executor(self._get_pool(), fn, *args)
+            if stop is not None:
+                return await _stoppable(fut, stop)
+            return await fut
+        except BrokenProcessPool:
+            # процесс пула убит (OOM и т.п.) — следующий вызов создаст новый пул
+            self.shutdown()
+            raise DownloadError("download process crashed")
+
+    async def extract(self, url: str, ydl_opts: dict) -> Dict[str, Any]:
+        return await self._run(_extract_sync, url, ydl_opts)
+
+    async def warm(self) -> None:
+        # первая задача поднимает процессы пула, их initializer грузит yt-dlp
+        await self._run(_warm_sync)
+
+    def _get_manager(self) -> Any:
+        # Manager — отдельный процесс: очередь прогресса и флаги остановки
+        if self._manager is None:
+            self._manager = multiprocessing.get_context("spawn").Manager()
+        return self._manager
+
+    def _progress_sink(self) -> Any:
+        if self._progress_queue is None:
+            self._progress_queue = self._get_manager().Queue()
+            threading.Thread(
+                target=self._read_progress,
+                args=(self._progress_queue,),
+                name="progress-reader",
+                daemon=True,
+            ).start()
+        return self._progress_queue
+
+    def _read_progress(self, queue: Any) -> None:
+        while True:
+            try:
+                key, snapshot = queue.get()
+            except (EOFError, OSError):
+                return
+            if key is None:
+                return
+            listener = self._listeners.get(key)
+            if listener is not None:
+                loop, callback = listener
+                loop.call_soon_threadsafe(callback, snapshot)
+
+    async def download(
+        self,
+        url: str,
+        ydl_opts: dict,
+        info: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> str:
+        stop = self._get_manager().Event()
+        if progress is None:
+            return await self._run(_download_sync, url, ydl_opts, info, None, stop, stop=stop)
+
+        key = uuid.uuid4().hex
+        self._listeners[key] = (asyncio.get_running_loop(), progress)
+        try:
+            sink = _QueueProgress(self._progress_sink(), key)
+            return await self._run(_download_sync, url, ydl_opts, info, sink, stop, stop=stop)
+        finally:
+            self._listeners.pop(key, None)
+
+    def shutdown(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+        if self._manager is not None:
+            if self._progress_queue is not None:
+                try:
+                    self._progress_queue.put((None, None))
+                except (EOFError, OSError):
+                    pass
+            self._manager.shutdown()
+            self._manager = None
+            self._progress_queue = None
+
+
+class SubprocessExecutor:
+    """
+    Каждая задача — отдельный процесс yt-dlp; одновременно не больше max_workers.
+    """
+
+    def __init__(self, max_workers: int) -> None:
+        self._slots = asyncio.Semaphore(max(1, max_workers))
+
+    async def _exec(self, args: List[str]) -> str:
+        async with self._slots:
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            try:
+                stdout, stderr = await proc.communicate()
+            except asyncio.CancelledError:
+                proc.kill()
+                await proc.wait()
+                raise
+
+        if proc.returncode != 0:
+            lines = stderr.decode(errors="replace").strip().splitlines()
+            raise DownloadError(lines[-1] if lines else f"yt-dlp exited with {proc.returncode}")
+        return stdout.decode(errors="replace")
+
+    async def extract(self, url: str, ydl_opts: dict) -> Dict[str, Any]:
+        out = await self._exec([
+            *YTDLP_CMD, "-J", "-f", ydl_opts["format"], "--no-playlist",
+            "--use-extractors", ",".join(ydl_opts.get("allowed_extractors") or ["default"]),
+            "--", url,
+        ])
+        return json.loads(out)
+
+    async def _exec_download(self, args: List[str], progress: Optional[ProgressCallback]) -> List[str]:
+        """
+        Как _exec, но читает stdout построчно: строки прогресса уходят
+        в progress (через ProgressGate), остальные возвращаются.
+        """
+        hook = _progress_hook(progress) if progress is not None else None
+        lines: List[str] = []
+        async with self._slots:
+            proc = await asyncio.create_subprocess_exec(
+                *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stderr_task = asyncio.create_task(proc.stderr.read())
+            try:
+                async for raw in proc.stdout:
+                    line = raw.decode(errors="replace").rstrip()
+                    if line.startswith(_CLI_PROGRESS_PREFIX):
+                        if hook is not None:
+                            hook(_parse_cli_progress(line))
+                    elif line:
+                        lines.append(line)
+                stderr = await stderr_task
+                await proc.wait()
+            except asyncio.CancelledError:
+                # как Ctrl+C: yt-dlp закрывает .part, с него задача продолжится
+                proc.send_signal(signal.SIGINT)
+                try:
+                    await asyncio.wait_for(proc.wait(), DOWNLOAD_STOP_TIMEOUT)
+                except asyncio.TimeoutError:
+                    proc.kill()
+                    await proc.wait()
+                stderr_task.cancel()
+                raise
+
+        if proc.returncode != 0:
+            err = stderr.decode(errors="replace").strip().splitlines()
+            raise DownloadError(err[-1] if err else f"yt-dlp exited with {proc.returncode}")
+        return lines
+
+    async def download(
+        self,
+        url: str,
+        ydl_opts: dict,
+        info: Optional[Dict[str, Any]] = None,
+        progress: Optional[ProgressCallback] = None,
+    ) -> str:
+        info_json: Optional[Path] = None
+        if info is not None:
+            info_json = Path(ydl_opts["outtmpl"]).with_name(f"{os.getpid()}-{id(info)}.info.json")
+            info_json.write_text(json.dumps(info), encoding="utf-8")
+        try:
+            lines = await self._exec_download(_ytdlp_cli_args(url, ydl_opts, info_json), progress)
+        finally:
+            if info_json is not None:
+                info_json.unlink(missing_ok=True)
+        if not lines:
+            raise DownloadError("yt-dlp returned no result")
+        return lines[-1]
+
+    async def warm(self) -> None:
+        # каждая задача — новый процесс, прогревать нечего
+        pass
+
+    def shutdown(self) -> None:
+        pass
+
+
+def _create_executor(kind: str):
+    if kind == "thread":
+        return ThreadExecutor()
+    if kind == "process":
+        return ProcessExecutor(DOWNLOAD_POOL_SIZE, DOWNLOAD_MAX_TASKS_PER_CHILD)
+    if kind == "subprocess":
+        return SubprocessExecutor(DOWNLOAD_POOL_SIZE)
+    raise ValueError(f"unknown DOWNLOAD_EXECUTOR: {kind}")
+
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = _create_executor(DOWNLOAD_EXECUTOR)
+    return _executor
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+
+async def prewarm() -> None:
+    """
+    Фоновый прогрев yt-dlp после старта бота (см. main.py).
+    Ошибка прогрева не критична: всё загрузится при первой задаче.
+    """
+    began = time.monotonic()
+    try:
+        await get_executor().warm()
+    except Exception:
+        logger.warning("yt-dlp prewarm failed", exc_info=True)
+        return
+    logger.info("yt-dlp warmed up in %.2f s", time.monotonic() - began)
+
+
+# ------------------------------------------------------------
+# yt-dlp utility
+# ------------------------------------------------------------
+async def extract_metadata(url: str) -> Dict[str, Any]:
+    """
+    extract_info(download=False) выбранным исполнителем.
+    Возвращает info dict (JSON-совместимый); при неудаче бросает DownloadError.
+    """
+    return await get_executor().extract(url, _ydl_opts())
+
+
+async def iter_playlist(url: str, limit: int = PLAYLIST_MAX_ITEMS) -> AsyncIterator[str]:
+    """
+    Ссылки на видео плейлиста/канала — по мере того, как yt-dlp читает
+    страницы, без сбора всего списка. Обход «плоский» (без форматов и
+    метаданных роликов), поэтому идёт в потоке при любом DOWNLOAD_EXECUTOR.
+    Если перестать итерировать, обход остановится на следующей записи.
+    """
+    loop = asyncio.get_running_loop()
+    entries: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+    done = object()
+
+    def emit(item: Any) -> None:
+        if not stopped.is_set():
+            loop.call_soon_threadsafe(entries.put_nowait, item)
+
+    def walk() -> None:
+        try:
+            _flat_entries_sync(url, {**_ydl_opts(), "noplaylist": False}, limit, emit, stopped)
+        except DownloadError as e:
+            emit(e)
+        finally:
+            emit(done)
+
+    loop.run_in_executor(None, walk)
+    try:
+        while True:
+            item = await entries.get()
+            if item is done:
+                return
+            if isinstance(item, DownloadError):
+                raise item
+            yield item
+    finally:
+        stopped.set()
+
+
+@metrics.timed(metrics.JOB_STAGE_SECONDS.labels("download"))
+async def run_ytdlp(
+    url: str,
+    out_filename: str,
+    info: Optional[Dict[str, Any]] = None,
+    progress: Optional[ProgressCallback] = None,
+    fmt: str = YTDLP_FORMAT,
+) -> Path:
+    """
+    Асинхронно запускает yt-dlp для скачивания видео выбранным исполнителем.
+    info — заранее полученные метаданные (см. metadata.py), чтобы не извлекать их повторно;
+    они должны быть получены с тем же fmt.
+    progress — вызывается в event loop с уже прореженными снимками прогресса.
+    Возвращает путь к готовому файлу; при неудаче бросает DownloadError.
+    """
+    DOWNLOAD_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    output_path = DOWNLOAD_TMP_DIR / f"{out_filename}.%(ext)s"
+
+    ydl_opts = _ydl_opts(str(output_path), fmt)
+
+    file_path = Path(await get_executor().download(url, ydl_opts, info, progress))
+    if not file_path.exists():
+        raise DownloadError(f"downloaded file is missing: {file_path.name}")
+    return file_path
+
+
+def partial_download(out_filename: str) -> Optional[Tuple[Path, int]]:
+    """
+    Что осталось в staging от прерванной загрузки out_filename: файл,
+    который дописывался последним, и сколько байт уже скачано (все
+    .part, фрагменты и готовые дорожки). .part от rangefetch размечен
+    под весь файл заранее — у него считаются только готовые чанки.
+    None — ничего не осталось.
+    """
+    latest, latest_mtime, done = None, float("-inf"), 0
+    for path in DOWNLOAD_TMP_DIR.glob(f"{out_filename}.*"):
+        # служебные файлы: журнал rangefetch, состояние фрагментов yt-dlp
+        if path.name.endswith((JOURNAL_SUFFIX, ".ytdl")):
+            continue
+        try:
+            st = path.stat()
+        except FileNotFoundError:
+            continue
+        ranged = journal_bytes(path)
+        done += ranged if ranged is not None else st.st_size
+        if st.st_mtime > latest_mtime:
+            latest, latest_mtime = path, st.st_mtime
+    return (latest, done) if latest is not None else None
 
 
 # ------------------------------------------------------------
 # move_file_to_final
 # ------------------------------------------------------------
-def move_file_to_final(file_path: Path, dest_dir: Path) -> Optional[Path]:
+@metrics.timed(metrics.JOB_STAGE_SECONDS.labels("move"))
+def move_file_to_final(file_path: Path) -> Optional[str]:
     """
-    Перемещает скачанный файл из временной папки в итоговую директорию.
-    Возвращает новый путь.
+    Публикует скачанный файл из временной папки в хранилище (STORAGE_BACKEND):
+    локально — атомарный перенос в DOWNLOADS_DIR, в S3 — multipart upload.
+    Возвращает location для Download.file_path.
     """
-    dest_dir.mkdir(parents=True, exist_ok=True)
     try:
-        new_path = dest_dir / file_path.name
-        shutil.move(str(file_path), str(new_path))
-        return new_path
+        return get_storage().publish(file_path)
     except Exception:
+        logger.exception("failed to publish %s", file_path)
         return None
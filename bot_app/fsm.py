@@ -0,0 +1,259 @@
+# bot_app/fsm.py
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Any, Dict, Mapping, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from sqlalchemy import delete
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal, dialect_insert
+from .models import FsmState
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# FSM_STORAGE: memory — в памяти процесса (как раньше); db — общая таблица fsm_states
+FSM_STORAGE = os.getenv("FSM_STORAGE", "memory").lower()
+# Сколько секунд прочитанное состояние считается свежим. Это и есть окно,
+# в которое реплика может не увидеть запись, сделанную другой репликой
+FSM_CACHE_TTL = float(os.getenv("FSM_CACHE_TTL", "2"))
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", "10000"))
+# Write-behind: изменения пишутся пачкой раз в FSM_FLUSH_INTERVAL секунд
+# или сразу, как только накопилось FSM_FLUSH_BATCH ключей
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", "0.5"))
+FSM_FLUSH_BATCH = int(os.getenv("FSM_FLUSH_BATCH", "200"))
+# Состояния, которые не менялись дольше, считаются брошенными (0 — хранить вечно)
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", str(7 * 24 * 3600)))
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "3600"))
+
+
+@dataclass
+class _Entry:
+    state: Optional[str] = None
+    data: Dict[str, Any] = field(default_factory=dict)
+    loaded_at: float = 0.0
+    # номер изменения; flush снимает dirty, только если запись не менялась во время записи
+    version: int = 0
+    dirty: bool = False
+
+
+# ------------------------------------------------------------
+# FSM storage на SQLAlchemy
+# ------------------------------------------------------------
+class SQLAlchemyStorage(BaseStorage):
+    """
+    BaseStorage поверх общего engine (таблица fsm_states).
+
+    - чтение: из кеша процесса, пока запись моложе cache_ttl, иначе SELECT;
+    - запись: сразу в кеш, в БД — фоновой пачкой (write-behind), одним
+      INSERT … ON CONFLICT на все изменённые ключи;
+    - состояния старше state_ttl не читаются и периодически удаляются.
+
+    Незаписанные изменения теряются только при аварийном завершении
+    (не дольше flush_interval); close() дописывает всё.
+    """
+
+    def __init__(
+        self,
+        key_builder: Optional[KeyBuilder] = None,
+        cache_ttl: float = FSM_CACHE_TTL,
+        cache_size: int = FSM_CACHE_SIZE,
+        flush_interval: float = FSM_FLUSH_INTERVAL,
+        flush_batch: int = FSM_FLUSH_BATCH,
+        state_ttl: float = FSM_STATE_TTL,
+    ) -> None:
+        self.key_builder = key_builder or DefaultKeyBuilder(
+            with_bot_id=True,
+            with_business_connection_id=True,
+            with_destiny=True,
+        )
+        self.cache_ttl = cache_ttl
+        self.cache_size = max(1, cache_size)
+        self.flush_interval = flush_interval
+        self.flush_batch = max(1, flush_batch)
+        self.state_ttl = state_ttl
+        self._cache: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._dirty: set = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_purge = time.monotonic()
+
+    # ---------------- чтение ----------------
+    async def _entry(self, key: StorageKey) -> _Entry:
+        k = self.key_builder.build(key)
+        entry = self._cache.get(k)
+        if entry is not None and (entry.dirty or time.monotonic() - entry.loaded_at < self.cache_ttl):
+            self._cache.move_to_end(k)
+            return entry
+
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(select(FsmState.state, FsmState.data, FsmState.updated_at).where(FsmState.key == k))
+            row = q.first()
+
+        # пока шёл SELECT, локальная запись могла изменить ключ — она новее
+        entry = self._cache.get(k)
+        if entry is not None and entry.dirty:
+            return entry
+        if entry is None:
+            entry = _Entry()
+            self._cache[k] = entry
+        if row is not None and not self._expired(row.updated_at):
+            entry.state, entry.data = row.state, dict(row.data or {})
+        else:
+            entry.state, entry.data = None, {}
+        entry.loaded_at = time.monotonic()
+        self._cache.move_to_end(k)
+        self._shrink()
+        return entry
+
+    def _expired(self, updated_at: Optional[datetime]) -> bool:
+        if not self.state_ttl or updated_at is None:
+            return False
+        return datetime.utcnow() - updated_at.replace(tzinfo=None) > timedelta(seconds=self.state_ttl)
+
+    def _shrink(self) -> None:
+        # выбрасываем самые старые чистые записи; грязные ждут flush
+        while len(self._cache) > self.cache_size:
+            for k, entry in self._cache.items():
+                if not entry.dirty:
+                    del self._cache[k]
+                    break
+            else:
+                return
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._entry(key)).state
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._entry(key)).data)
+
+    # ---------------- запись ----------------
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        entry = await self._entry(key)
+        entry.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, entry)
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        entry = await self._entry(key)
+        entry.data = dict(data)
+        self._mark_dirty(key, entry)
+
+    def _mark_dirty(self, key: StorageKey, entry: _Entry) -> None:
+        entry.version += 1
+        entry.dirty = True
+        entry.loaded_at = time.monotonic()
+        self._dirty.add(self.key_builder.build(key))
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop(), name="fsm-flush")
+        if len(self._dirty) >= self.flush_batch:
+            self._wakeup.set()
+
+    # ---------------- write-behind ----------------
+    async def _flush_loop(self) -> None:
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+                if self.state_ttl and time.monotonic() - self._last_purge > FSM_PURGE_INTERVAL:
+                    await self.purge_expired()
+            except Exception:
+                # ключи остаются dirty и уйдут следующей пачкой
+                logger.exception("FSM flush failed")
+
+    async def flush(self) -> int:
+        """
+        Записывает все изменённые ключи одной транзакцией. Возвращает их число.
+        """
+        if not self._dirty:
+            return 0
+        keys, self._dirty = self._dirty, set()
+        snapshot = {}
+        for k in keys:
+            entry = self._cache.get(k)
+            if entry is not None and entry.dirty:
+                snapshot[k] = (entry.version, entry.state, dict(entry.data))
+
+        now = datetime.utcnow()
+        try:
+            async with AsyncSessionLocal() as session:
+                # пустое состояние — строка не нужна
+                empty = [k for k, (_, state, data) in snapshot.items() if state is None and not data]
+                rows = [
+                    {"key": k, "state": state, "data": data, "updated_at": now}
+                    for k, (_, state, data) in snapshot.items()
+                    if state is not None or data
+                ]
+                if empty:
+                    await session.execute(delete(FsmState).where(FsmState.key.in_(empty)))
+                if rows:
+                    await self._upsert(session, rows)
+                await session.commit()
+        except BaseException:
+            self._dirty |= keys
+            raise
+
+        for k, (version, _, _) in snapshot.items():
+            entry = self._cache.get(k)
+            if entry is not None and entry.version == version:
+                entry.dirty = False
+        self._shrink()
+        return len(snapshot)
+
+    async def _upsert(self, session, rows) -> None:
+        stmt = dialect_insert(FsmState)
+        if stmt is None:
+            for row in rows:
+                await session.merge(FsmState(**row))
+            return
+        stmt = stmt.values(rows)
+        await session.execute(
+            stmt.on_conflict_do_update(
+                index_elements=[FsmState.key],
+                set_={
+                    "state": stmt.excluded.state,
+                    "data": stmt.excluded.data,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+            )
+        )
+
+    async def purge_expired(self) -> int:
+        self._last_purge = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.state_ttl)
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(delete(FsmState).where(FsmState.updated_at < cutoff))
+            await session.commit()
+        if result.rowcount:
+            logger.info("purged %s stale FSM state(s)", result.rowcount)
+        return result.rowcount
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await self.flush()
+
+
+def create_storage() -> BaseStorage:
+    if FSM_STORAGE == "db":
+        return SQLAlchemyStorage()
+    if FSM_STORAGE == "memory":
+        return MemoryStorage()
+    raise ValueError(f"unknown FSM_STORAGE: {FSM_STORAGE}")
@@ -1,14 +1,24 @@
 # bot_app/handlers.py
 import re
+import html
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Set, Tuple
+
 from aiogram import F, Router
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import Message, CallbackQuery
-from sqlalchemy.future import select
 
 from .bot import dp
-from .keyboard import main_menu, back_menu, confirm_download
-from .models import User, Download
-from .db import AsyncSessionLocal
-from .worker import enqueue_download
+from .keyboard import main_menu, back_menu, confirm_batch, confirm_download, history_nav
+from .models import Download, MediaKind
+from .users import get_or_create_user_id
+from .worker import enqueue_batch, enqueue_download
+from .outbox import outbox, PRIORITY_USER
+from . import batches, history, metadata
+from .utils import extract_urls, format_duration, format_size, is_playlist_url
+
+logger = logging.getLogger(__name__)
 
 
 # ------------------------------------------------------------
@@ -19,37 +29,139 @@ async def cmd_start(message: Message):
     """
     Приветствие нового пользователя и добавление в БД при первом входе.
     """
-    async with AsyncSessionLocal() as session:
-        q = await session.execute(select(User).where(User.telegram_id == message.from_user.id))
-        user = q.scalar_one_or_none()
-        if user is None:
-            session.add(User(telegram_id=message.from_user.id))
-            await session.commit()
-
-    await message.answer(
+    await get_or_create_user_id(message.from_user.id)
+
+    outbox.send_message(
+        message.chat.id,
         "👋 Привіт! Надішли мені посилання на відео з YouTube, і я його скачаю 🎬",
         reply_markup=main_menu(),
     )
 
 
+# ------------------------------------------------------------
+# История загрузок (регистрируется до общего F.text)
+# ------------------------------------------------------------
+@dp.message(F.text == "📜 Історія")
+async def cmd_history(message: Message):
+    user_id = await get_or_create_user_id(message.from_user.id)
+    page = await history.fetch_page(user_id)
+    outbox.send_message(
+        message.chat.id,
+        history.page_text(page),
+        reply_markup=history_nav(page.older, page.newer),
+    )
+
+
+@dp.callback_query(F.data.startswith("history:"))
+async def cb_history(call: CallbackQuery):
+    """
+    Листание истории: в callback_data — курсор соседней страницы.
+    """
+    cursor = call.data.split("history:", 1)[1]
+    user_id = await get_or_create_user_id(call.from_user.id)
+    try:
+        page = await history.fetch_page(user_id, cursor)
+    except ValueError:
+        # испорченный курсор — просто гасим «часики» на кнопке
+        await call.answer()
+        return
+    outbox.edit_message_text(
+        call.message.chat.id,
+        call.message.message_id,
+        history.page_text(page),
+        priority=PRIORITY_USER,
+        reply_markup=history_nav(page.older, page.newer),
+    )
+    await call.answer()
+
+
 # ------------------------------------------------------------
 # Обработка текста — если это ссылка на видео
 # ------------------------------------------------------------
 YOUTUBE_REGEX = re.compile(r"(https?://)?(www\.)?(youtube\.com|youtu\.be)/")
 
+# Фоновые дорисовки подтверждения метаданными: (chat_id, message_id) -> task
+_detail_tasks: Dict[Tuple[int, int], asyncio.Task] = {}
+_background: Set[asyncio.Task] = set()
+
+
+def _confirm_text(url: str, info: Optional[Dict[str, Any]] = None) -> str:
+    text = f"🔗 Знайдено посилання:\n{html.escape(url)}\n\n"
+    if info:
+        text += (
+            f"🎬 {html.escape(info.get('title') or '—')}\n"
+            f"⏱ {format_duration(info.get('duration'))}\n"
+            f"💾 ≈ {format_size(metadata.estimate_size(info))}\n\n"
+        )
+    return text + "Почати завантаження?"
+
+
+async def _show_details(chat_id: int, url: str, link_id: int, sent: asyncio.Future, pending: asyncio.Future) -> None:
+    """
+    Дописывает в сообщение-подтверждение название, длительность и размер,
+    когда закончится prefetch.
+    """
+    message: Message = await sent
+    key = (chat_id, message.message_id)
+    _detail_tasks[key] = asyncio.current_task()
+    try:
+        info = await pending
+        if not info:
+            return
+        await outbox.edit_message_text(
+            chat_id,
+            message.message_id,
+            _confirm_text(url, info),
+            priority=PRIORITY_USER,
+            reply_markup=confirm_download(link_id),
+        )
+    except TelegramBadRequest:
+        # сообщение уже изменено/удалено — дописывать нечего
+        pass
+    finally:
+        if _detail_tasks.get(key) is asyncio.current_task():
+            del _detail_tasks[key]
+
+
+def _cancel_details(message: Message) -> None:
+    task = _detail_tasks.pop((message.chat.id, message.message_id), None)
+    if task is not None:
+        task.cancel()
+
+
+def _spawn(coro) -> None:
+    task = asyncio.create_task(coro)
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
 @dp.message(F.text)
 async def handle_url_or_command(message: Message):
     """
     Ловим любое сообщение: если это YouTube-ссылка — предлагаем подтвердить.
+    Метаданные начинаем извлекать сразу, не дожидаясь подтверждения.
+    Несколько ссылок или плейлист/канал — подтверждение пакета.
     """
     text = message.text.strip()
-    if YOUTUBE_REGEX.search(text):
-        await message.answer(
-            f"🔗 Знайдено посилання:\n{text}\n\nПочати завантаження?",
-            reply_markup=confirm_download(text),
+    urls = list(dict.fromkeys(u for u in extract_urls(text) if YOUTUBE_REGEX.match(u)))
+    if len(urls) > 1 or (urls and is_playlist_url(urls[0])):
+        await _offer_batch(message, urls)
+    elif YOUTUBE_REGEX.search(text):
+        url = urls[0] if urls else text
+        pending = metadata.prefetch(url)
+        # ссылка ждёт подтверждения в БД: в callback_data — только её ID
+        link_id = await batches.create_batch(message.from_user.id, message.chat.id, [url])
+        info = pending.result() if pending.done() else None
+        sent = outbox.send_message(
+            message.chat.id,
+            _confirm_text(url, info),
+            reply_markup=confirm_download(link_id),
         )
+        if info is None:
+            _spawn(_show_details(message.chat.id, url, link_id, sent, pending))
     else:
-        await message.answer(
+        outbox.send_message(
+            message.chat.id,
             "⚠️ Це не схоже на посилання YouTube.\nНадішліть коректну URL або натисніть кнопку нижче 👇",
             reply_markup=main_menu(),
         )
@@ -58,28 +170,119 @@ async def handle_url_or_command(message: Message):
 # ------------------------------------------------------------
 # Callback: подтверждение загрузки
 # ------------------------------------------------------------
-@dp.callback_query(F.data.startswith("download:"))
+@dp.callback_query(F.data.startswith("download:") | F.data.startswith("audio:"))
 async def cb_download(call: CallbackQuery):
     """
-    Пользователь подтвердил загрузку видео.
+    Пользователь подтвердил загрузку видео (или только аудио).
     """
-    url = call.data.split("download:", 1)[1]
-    await call.message.edit_text(f"📥 Завантаження розпочато…\n{url}")
+    action, link_id = call.data.split(":", 1)
+    kind = MediaKind.audio if action == "audio" else MediaKind.video
+    try:
+        urls = await batches.start_batch(int(link_id), call.from_user.id)
+    except ValueError:
+        urls = None
+    if not urls:
+        # уже подтверждено (повторное нажатие) или чужая ссылка
+        await call.answer()
+        return
+    url = urls[0]
+    chat_id = call.message.chat.id
+    _cancel_details(call.message)
+    outbox.edit_message_text(
+        chat_id,
+        call.message.message_id,
+        f"📥 Завантаження розпочато…\n{html.escape(url)}",
+        priority=PRIORITY_USER,
+    )
 
-    job_id = await enqueue_download(call.from_user.id, url)
-    await call.message.answer(
-        f"✅ Додано в чергу (ID {job_id}).\nБот повідомить, коли відео буде готове.",
+    job_id = await enqueue_download(
+        call.from_user.id,
+        url,
+        chat_id=chat_id,
+        status_message_id=call.message.message_id,
+        kind=kind.value,
+    )
+    what = "аудіо буде готове" if kind == MediaKind.audio else "відео буде готове"
+    outbox.send_message(
+        chat_id,
+        f"✅ Додано в чергу (ID {job_id}).\nБот повідомить, коли {what}.",
         reply_markup=main_menu(),
     )
     await call.answer()
 
 
+# ------------------------------------------------------------
+# Пакет: несколько ссылок, плейлист или канал
+# ------------------------------------------------------------
+async def _offer_batch(message: Message, urls: List[str]) -> None:
+    batch_id = await batches.create_batch(message.from_user.id, message.chat.id, urls)
+    playlists = sum(1 for u in urls if is_playlist_url(u))
+    text = f"🔗 Знайдено посилань: {len(urls)}"
+    if playlists:
+        text += f" (плейлистів і каналів: {playlists}, до {batches.BATCH_MAX_ITEMS} відео)"
+    outbox.send_message(
+        message.chat.id,
+        text + ".\n\nЗавантажити все? Відео прийдуть альбомами, коли пакет буде готовий.",
+        reply_markup=confirm_batch(batch_id),
+    )
+
+
+@dp.callback_query(F.data.startswith("batch:"))
+async def cb_batch(call: CallbackQuery):
+    """
+    Пользователь подтвердил пакет: разворачиваем плейлисты в фоне,
+    задачи уходят в очередь по мере разворота.
+    """
+    _, batch_id, *options = call.data.split(":")
+    kind = MediaKind.audio if "audio" in options else MediaKind.video
+    try:
+        batch_id = int(batch_id)
+    except ValueError:
+        await call.answer()
+        return
+    urls = await batches.start_batch(batch_id, call.from_user.id)
+    if urls is None:
+        # уже запущен (повторное нажатие) или чужой
+        await call.answer()
+        return
+    outbox.edit_message_text(
+        call.message.chat.id,
+        call.message.message_id,
+        f"📥 Пакет {batch_id}: збираю список відео…",
+        priority=PRIORITY_USER,
+    )
+    _spawn(_run_batch(call.message.chat.id, call.message.message_id, batch_id, urls, kind.value))
+    await call.answer()
+
+
+async def _run_batch(chat_id: int, message_id: int, batch_id: int, urls: List[str], kind: str) -> None:
+    try:
+        total, failed = await enqueue_batch(batch_id, urls, kind)
+    except Exception:
+        logger.exception("batch %s expansion failed", batch_id)
+        total, failed = 0, len(urls)
+    if total:
+        text = f"✅ Пакет {batch_id}: у черзі {total} відео.\nБот надішле їх, коли все буде готово."
+    else:
+        text = f"⚠️ Пакет {batch_id}: не знайдено жодного відео."
+    if failed:
+        text += f"\n⚠️ Не вдалося відкрити посилань: {failed}"
+    outbox.edit_message_text(chat_id, message_id, text, priority=PRIORITY_USER)
+
+
 # ------------------------------------------------------------
 # Callback: отмена
 # ------------------------------------------------------------
 @dp.callback_query(F.data == "cancel")
 async def cb_cancel(call: CallbackQuery):
-    await call.message.edit_text("❌ Скасовано.", reply_markup=main_menu())
+    _cancel_details(call.message)
+    outbox.edit_message_text(
+        call.message.chat.id,
+        call.message.message_id,
+        "❌ Скасовано.",
+        priority=PRIORITY_USER,
+        reply_markup=main_menu(),
+    )
     await call.answer()
 
 
@@ -88,7 +291,7 @@ async def cb_cancel(call: CallbackQuery):
 # ------------------------------------------------------------
 @dp.message(F.text == "↩️ Назад")
 async def cmd_back(message: Message):
-    await message.answer("Головне меню", reply_markup=main_menu())
+    outbox.send_message(message.chat.id, "Головне меню", reply_markup=main_menu())
 
 
 # ------------------------------------------------------------
@@ -96,10 +299,11 @@ async def cmd_back(message: Message):
 # ------------------------------------------------------------
 @dp.message(F.text == "ℹ️ Інструкція")
 async def cmd_help(message: Message):
-    await message.answer(
+    outbox.send_message(
+        message.chat.id,
         "📘 Як користуватись:\n"
         "1️⃣ Надішліть посилання на відео з YouTube\n"
-        "2️⃣ Підтвердіть завантаження\n"
+        "2️⃣ Підтвердіть завантаження (або виберіть «🎵 Лише аудіо»)\n"
         "3️⃣ Дочекайтесь повідомлення про готовий файл\n\n"
         "Бот сам виконає все інше 💪",
         reply_markup=back_menu(),
@@ -111,5 +315,5 @@ async def cmd_help(message: Message):
 # ------------------------------------------------------------
 @dp.message(F.text == "❌ Вийти")
 async def cmd_exit(message: Message):
-    await message.answer("До зустрічі 👋", reply_markup=back_menu())
+    outbox.send_message(message.chat.id, "До зустрічі 👋", reply_markup=back_menu())
     # Тут можна додати логіку для "виходу", якщо потрібно
\ No newline at end of file
@@ -0,0 +1,147 @@
+# bot_app/history.py
+import os
+import html
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import tuple_
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal
+from .models import Download, DownloadStatus
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+# направление курсора: страница старше / новее опорной загрузки
+OLDER = "o"
+NEWER = "n"
+
+_STATUS_ICONS = {
+    DownloadStatus.pending: "⏳",
+    DownloadStatus.processing: "🔄",
+    DownloadStatus.done: "✅",
+    DownloadStatus.failed: "❌",
+}
+
+
+# ------------------------------------------------------------
+# Курсор: направление + ID опорной загрузки в base36 ("o2bi")
+# ------------------------------------------------------------
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def encode_cursor(direction: str, download_id: int) -> str:
+    digits = ""
+    n = download_id
+    while True:
+        n, r = divmod(n, 36)
+        digits = _DIGITS[r] + digits
+        if n == 0:
+            break
+    return direction + digits
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    """
+    Разбирает курсор из callback_data. ValueError — курсор испорчен.
+    """
+    direction, digits = cursor[:1], cursor[1:]
+    if direction not in (OLDER, NEWER) or not digits:
+        raise ValueError(f"bad history cursor: {cursor!r}")
+    return direction, int(digits, 36)
+
+
+# ------------------------------------------------------------
+# Страница истории
+# ------------------------------------------------------------
+@dataclass
+class HistoryPage:
+    # от новых к старым
+    items: List[Any] = field(default_factory=list)
+    # курсоры соседних страниц (None — дальше ничего нет)
+    older: Optional[str] = None
+    newer: Optional[str] = None
+    # исходные ссылки загрузок без video_id (остальным хватает ID видео)
+    urls: Dict[int, str] = field(default_factory=dict)
+
+
+async def fetch_page(user_id: int, cursor: Optional[str] = None, page_size: int = HISTORY_PAGE_SIZE) -> HistoryPage:
+    """
+    Keyset-пагинация по индексу (user_id, created_at, id): страница — это
+    поиск в индексе от опорной строки и LIMIT, без OFFSET, поэтому её
+    стоимость не зависит ни от длины истории, ни от номера страницы.
+
+    Курсор хранит только ID опорной загрузки; её created_at берётся
+    подзапросом по первичному ключу — так сравнение идёт с точным
+    значением из БД, а курсор остаётся коротким для callback_data.
+
+    Страница читает только колонки индекса (на PostgreSQL — index-only
+    scan); url нужен лишь строкам без video_id и дочитывается по ним.
+    """
+    page_size = max(1, page_size)
+    key = tuple_(Download.created_at, Download.id)
+    stmt = select(
+        Download.id,
+        Download.created_at,
+        Download.status,
+        Download.video_id,
+    ).where(Download.user_id == user_id)
+
+    direction = OLDER
+    if cursor is not None:
+        direction, anchor = decode_cursor(cursor)
+        anchor_created = (
+            select(Download.created_at)
+            .where(Download.id == anchor, Download.user_id == user_id)
+            .scalar_subquery()
+        )
+        anchor_key = tuple_(anchor_created, anchor)
+        stmt = stmt.where(key < anchor_key if direction == OLDER else key > anchor_key)
+
+    if direction == OLDER:
+        stmt = stmt.order_by(Download.created_at.desc(), Download.id.desc())
+    else:
+        stmt = stmt.order_by(Download.created_at.asc(), Download.id.asc())
+
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(stmt.limit(page_size + 1))
+        rows = q.all()
+        more = len(rows) > page_size
+        rows = rows[:page_size]
+        without_id = [row.id for row in rows if not row.video_id]
+        urls: Dict[int, str] = {}
+        if without_id:
+            q = await session.execute(select(Download.id, Download.url).where(Download.id.in_(without_id)))
+            urls = dict(q.all())
+
+    if cursor is not None and not rows:
+        # опорной строки больше нет или страница опустела — с начала
+        return await fetch_page(user_id, None, page_size)
+
+    if direction == OLDER:
+        has_older, has_newer = more, cursor is not None
+    else:
+        rows.reverse()
+        has_older, has_newer = True, more
+
+    return HistoryPage(
+        items=rows,
+        older=encode_cursor(OLDER, rows[-1].id) if rows and has_older else None,
+        newer=encode_cursor(NEWER, rows[0].id) if rows and has_newer else None,
+        urls=urls,
+    )
+
+
+def page_text(page: HistoryPage) -> str:
+    if not page.items:
+        return "📭 Історія завантажень порожня."
+    lines = ["📜 Історія завантажень:\n"]
+    for row in page.items:
+        when = row.created_at.strftime("%d.%m.%Y %H:%M") if row.created_at else "—"
+        target = f"https://youtu.be/{row.video_id}" if row.video_id else page.urls.get(row.id, "—")
+        lines.append(f"{_STATUS_ICONS.get(row.status, '•')} <b>{row.id}</b> · {when}\n{html.escape(target)}")
+    return "\n".join(lines)
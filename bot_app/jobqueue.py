@@ -0,0 +1,516 @@
+# bot_app/jobqueue.py
+import os
+import heapq
+import socket
+import asyncio
+import itertools
+import logging
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, or_, text, update
+from sqlalchemy.future import select
+from sqlalchemy.orm import sessionmaker
+
+from .db import AsyncSessionLocal
+from .models import Download, DownloadStatus, MediaKind
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# QUEUE_BACKEND:
+#   db     — очередь на таблице downloads: переживает рестарт, несколько
+#            процессов/хостов делят работу через один DATABASE_URL
+#   memory — очередь внутри процесса (FairScheduler)
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "db").lower()
+# Сколько секунд задача принадлежит воркеру без heartbeat
+LEASE_SECONDS = float(os.getenv("QUEUE_LEASE_SECONDS", "60"))
+# Как часто опрашивать таблицу, если локальных уведомлений нет
+POLL_INTERVAL = float(os.getenv("QUEUE_POLL_INTERVAL", "1.0"))
+
+# Сколько задач одного пользователя может выполняться одновременно
+PER_USER_CONCURRENCY = int(os.getenv("PER_USER_CONCURRENCY", "2"))
+# Классы приоритета: ролики короче/меньше порога идут раньше (0 — выключено)
+PRIORITY_SHORT_SECONDS = float(os.getenv("PRIORITY_SHORT_SECONDS", "300"))
+PRIORITY_SMALL_BYTES = int(os.getenv("PRIORITY_SMALL_BYTES", str(20 * 1024 * 1024)))
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+# классы в порядке обслуживания
+PRIORITIES = (PRIORITY_HIGH, PRIORITY_NORMAL)
+
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+
+# условие частичного индекса ix_downloads_pending_head (models.py) —
+# литералом, а не параметром: иначе SQLite не применит частичный индекс
+_PENDING = text("downloads.status = 'pending'")
+
+
+def lease_deadline(seconds: float = LEASE_SECONDS) -> datetime:
+    return datetime.utcnow() + timedelta(seconds=seconds)
+
+
+@dataclass
+class Job:
+    download_id: int
+    video_id: Optional[str] = None
+    user_id: Optional[int] = None
+    priority: int = PRIORITY_NORMAL
+    # MediaKind: video | audio
+    kind: str = MediaKind.video.value
+
+
+def job_priority(info: Optional[Dict[str, Any]]) -> int:
+    """
+    Класс приоритета по метаданным (если они уже известны на момент постановки).
+    """
+    if not info:
+        return PRIORITY_NORMAL
+    duration = info.get("duration")
+    if PRIORITY_SHORT_SECONDS and duration and duration <= PRIORITY_SHORT_SECONDS:
+        return PRIORITY_HIGH
+    size = info.get("filesize") or info.get("filesize_approx")
+    if PRIORITY_SMALL_BYTES and size and size <= PRIORITY_SMALL_BYTES:
+        return PRIORITY_HIGH
+    return PRIORITY_NORMAL
+
+
+# ------------------------------------------------------------
+# Справедливый планировщик (round-robin по пользователям)
+# ------------------------------------------------------------
+class FairScheduler:
+    """
+    У каждого пользователя своя очередь (куча по приоритету и порядку
+    поступления). Пользователи, у которых есть задачи и не исчерпан лимит
+    одновременных загрузок, лежат в общей куче по ключу
+    (приоритет головной задачи, номер последнего обслуживания) — так
+    пользователи обслуживаются по кругу, а короткие ролики идут раньше.
+    put/pop — O(log n).
+    """
+
+    def __init__(self, per_user_limit: int = PER_USER_CONCURRENCY) -> None:
+        self.per_user_limit = max(1, per_user_limit)
+        self._lanes: Dict[Any, List[Tuple[int, int, Job]]] = {}
+        self._ready: List[Tuple[int, int, int, Any]] = []
+        # актуальная запись пользователя в _ready (устаревшие пропускаются при pop)
+        self._ready_entry: Dict[Any, Tuple[int, int, int, Any]] = {}
+        self._last_served: Dict[Any, int] = {}
+        self._inflight: Dict[Any, int] = {}
+        self._seq = itertools.count()
+        self._turn = 0
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _lane_key(self, job: Job) -> Any:
+        return job.user_id if job.user_id is not None else ("job", job.download_id)
+
+    def _schedule(self, user: Any) -> None:
+        lane = self._lanes.get(user)
+        if not lane or self._inflight.get(user, 0) >= self.per_user_limit:
+            self._ready_entry.pop(user, None)
+            return
+        head_priority = lane[0][0]
+        current = self._ready_entry.get(user)
+        if current is not None and current[0] <= head_priority:
+            return
+        entry = (head_priority, self._last_served.get(user, 0), next(self._seq), user)
+        self._ready_entry[user] = entry
+        heapq.heappush(self._ready, entry)
+
+    def push(self, job: Job) -> None:
+        user = self._lane_key(job)
+        heapq.heappush(self._lanes.setdefault(user, []), (job.priority, next(self._seq), job))
+        self._size += 1
+        self._schedule(user)
+
+    def pop(self) -> Optional[Job]:
+        while self._ready:
+            entry = heapq.heappop(self._ready)
+            user = entry[3]
+            if self._ready_entry.get(user) is not entry:
+                continue
+            del self._ready_entry[user]
+
+            lane = self._lanes[user]
+            _, _, job = heapq.heappop(lane)
+            if not lane:
+                del self._lanes[user]
+            self._size -= 1
+            self._turn += 1
+            self._last_served[user] = self._turn
+            self._inflight[user] = self._inflight.get(user, 0) + 1
+            self._schedule(user)
+            return job
+        return None
+
+    def release(self, job: Job) -> None:
+        user = self._lane_key(job)
+        left = self._inflight.get(user, 0) - 1
+        if left > 0:
+            self._inflight[user] = left
+        else:
+            self._inflight.pop(user, None)
+            if user not in self._lanes:
+                # пользователь ушёл — не держим его историю
+                self._last_served.pop(user, None)
+        self._schedule(user)
+
+
+# ------------------------------------------------------------
+# In-process очередь
+# ------------------------------------------------------------
+class MemoryQueue:
+    """
+    Очередь в памяти одного процесса поверх FairScheduler.
+    При рестарте восстанавливается из таблицы downloads в recover().
+    """
+
+    # строки не закрепляются за воркером — записи статуса безусловные
+    owner: Optional[str] = None
+
+    def __init__(self, per_user_limit: int = PER_USER_CONCURRENCY) -> None:
+        self._scheduler = FairScheduler(per_user_limit)
+        self._available = asyncio.Event()
+        # ID задач, лежащих в очереди: recover() и enqueue могут
+        # одновременно положить одну и ту же строку
+        self._queued: Set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._scheduler)
+
+    def _put_nowait(self, job: Job) -> None:
+        if job.download_id in self._queued:
+            return
+        self._queued.add(job.download_id)
+        self._scheduler.push(job)
+        self._available.set()
+
+    async def put(self, job: Job) -> None:
+        self._put_nowait(job)
+
+    async def get(self) -> Job:
+        while True:
+            job = self._scheduler.pop()
+            if job is not None:
+                self._queued.discard(job.download_id)
+                return job
+            # либо пусто, либо все пользователи упёрлись в лимит
+            self._available.clear()
+            await self._available.wait()
+
+    def task_done(self, job: Job) -> None:
+        self._scheduler.release(job)
+        self._available.set()
+
+    async def depth(self) -> int:
+        return len(self._scheduler)
+
+    @asynccontextmanager
+    async def lease(self, job: Job) -> AsyncIterator[None]:
+        yield
+
+    async def requeue_expired(self) -> int:
+        return 0
+
+    async def release(self) -> int:
+        # при рестарте recover() и так вернёт всё в pending
+        return 0
+
+    async def recover(self) -> int:
+        """
+        Процесс один, значит всё, что осталось в processing, — брошено.
+        Возвращаем такие задачи в pending и грузим все pending в очередь.
+        """
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(Download)
+                .where(Download.status == DownloadStatus.processing)
+                .values(status=DownloadStatus.pending, worker_id=None, lease_until=None, leader_id=None)
+            )
+            q = await session.execute(
+                select(Download.id, Download.video_id, Download.user_id, Download.priority, Download.kind)
+                .where(Download.status == DownloadStatus.pending)
+                .order_by(Download.id)
+            )
+            rows = q.all()
+            await session.commit()
+        for row in rows:
+            self._put_nowait(
+                Job(
+                    download_id=row.id,
+                    video_id=row.video_id,
+                    user_id=row.user_id,
+                    priority=row.priority,
+                    kind=row.kind.value,
+                )
+            )
+        return len(rows)
+
+
+# ------------------------------------------------------------
+# Очередь на таблице downloads
+# ------------------------------------------------------------
+class DbQueue:
+    """
+    Задачи — это строки downloads со статусом pending.
+    Воркер атомарно «захватывает» строку (status=processing, worker_id,
+    lease_until) одним UPDATE ... RETURNING; на Postgres подзапрос берёт
+    строку через FOR UPDATE SKIP LOCKED, чтобы конкурирующие процессы
+    не ждали друг друга. Пока задача в работе, lease продлевается
+    heartbeat'ом; просроченные lease возвращаются в pending.
+
+    Порядок захвата справедливый, как у FairScheduler: сначала класс
+    приоритета, внутри него пользователи по кругу (см. _claim), и
+    пользователи, у которых уже PER_USER_CONCURRENCY задач в работе,
+    пропускаются.
+    """
+
+    # записи статуса задачи применяются, только пока её держит этот процесс
+    owner: Optional[str] = WORKER_ID
+
+    def __init__(
+        self,
+        lease_seconds: float = LEASE_SECONDS,
+        poll_interval: float = POLL_INTERVAL,
+        per_user_limit: int = PER_USER_CONCURRENCY,
+        session_factory: sessionmaker = AsyncSessionLocal,
+    ) -> None:
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self.per_user_limit = max(1, per_user_limit)
+        self.session_factory = session_factory
+        self._wakeup = asyncio.Event()
+        self._skip_locked = session_factory.kw["bind"].dialect.name == "postgresql"
+        # последний обслуженный пользователь (у каждого процесса свой)
+        self._cursor: Optional[int] = None
+
+    def _lease_deadline(self) -> datetime:
+        return lease_deadline(self.lease_seconds)
+
+    async def put(self, job: Job) -> None:
+        # строка уже в БД; просто будим локальных воркеров
+        self._wakeup.set()
+
+    async def get(self) -> Job:
+        while True:
+            job = await self._claim()
+            if job is not None:
+                return job
+            self._wakeup.clear()
+            with suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+
+    def task_done(self, job: Job) -> None:
+        # слот пользователя освободился — может, его следующая задача уже ждёт
+        self._wakeup.set()
+
+    async def depth(self) -> int:
+        """
+        Число задач в pending (для метрик; индекс по status).
+        """
+        async with self.session_factory() as session:
+            q = await session.execute(
+                select(func.count()).select_from(Download).where(Download.status == DownloadStatus.pending)
+            )
+            return q.scalar_one()
+
+    async def _busy_users(self, session: Any) -> Set[int]:
+        # пользователи, упёршиеся в лимит (ведомые задачи слот не занимают);
+        # читаются только строки processing — их не больше, чем задач в работе
+        q = await session.execute(
+            select(Download.user_id)
+            .where(
+                Download.status == DownloadStatus.processing,
+                Download.leader_id.is_(None),
+            )
+            .group_by(Download.user_id)
+            .having(func.count() >= self.per_user_limit)
+        )
+        return set(q.scalars().all())
+
+    async def _next_user(self, session: Any, priority: int, after: Optional[int]) -> Optional[int]:
+        # первый пользователь после after с pending-задачей этого класса
+        stmt = select(Download.user_id).where(_PENDING, Download.priority == priority)
+        if after is not None:
+            stmt = stmt.where(Download.user_id > after)
+        q = await session.execute(stmt.order_by(Download.user_id).limit(1))
+        return q.scalar_one_or_none()
+
+    async def _take_head(self, session: Any, priority: int, user_id: int) -> Optional[Any]:
+        # самая старая задача пользователя в классе — атомарно в processing
+        head = (
+            select(Download.id)
+            .where(_PENDING, Download.priority == priority, Download.user_id == user_id)
+            .order_by(Download.id)
+            .limit(1)
+        )
+        if self._skip_locked:
+            head = head.with_for_update(skip_locked=True)
+        stmt = (
+            update(Download)
+            .where(
+                Download.id == head.scalar_subquery(),
+                # строку мог забрать другой процесс между подзапросом и UPDATE
+                Download.status == DownloadStatus.pending,
+            )
+            .values(
+                status=DownloadStatus.processing,
+                worker_id=WORKER_ID,
+                lease_until=self._lease_deadline(),
+            )
+            .returning(Download.id, Download.video_id, Download.user_id, Download.priority, Download.kind)
+            .execution_options(synchronize_session=False)
+        )
+        row = (await session.execute(stmt)).first()
+        # и при промахе: UPDATE открыл пишущую транзакцию
+        await session.commit()
+        return row
+
+    async def _claim(self) -> Optional[Job]:
+        """
+        Round-robin по пользователям: в каждом классе приоритета (по
+        порядку PRIORITIES) берётся первый после курсора пользователь с
+        pending-задачей и свободным слотом, у него — самая старая задача.
+        Каждый шаг — поиск по частичному индексу ix_downloads_pending_head,
+        O(log n) от числа pending-строк; сверх этого просматриваются только
+        пользователи, упёршиеся в лимит, и строки в работе.
+        """
+        async with self.session_factory() as session:
+            skip = await self._busy_users(session)
+            for priority in PRIORITIES:
+                after, wrapped = self._cursor, self._cursor is None
+                while True:
+                    user_id = await self._next_user(session, priority, after)
+                    if user_id is None or (wrapped and self._cursor is not None and user_id > self._cursor):
+                        if wrapped:
+                            # круг пройден — в этом классе брать нечего
+                            break
+                        after, wrapped = None, True
+                        continue
+                    after = user_id
+                    if user_id in skip:
+                        continue
+                    row = await self._take_head(session, priority, user_id)
+                    if row is None:
+                        # задачи пользователя разобрали другие процессы
+                        skip.add(user_id)
+                        continue
+                    self._cursor = user_id
+                    return Job(
+                        download_id=row.id,
+                        video_id=row.video_id,
+                        user_id=row.user_id,
+                        priority=row.priority,
+                        kind=row.kind.value,
+                    )
+        return None
+
+    async def _heartbeat(self, job: Job) -> bool:
+        async with self.session_factory() as session:
+            res = await session.execute(
+                update(Download)
+                .where(
+                    Download.id == job.download_id,
+                    Download.status == DownloadStatus.processing,
+                    Download.worker_id == WORKER_ID,
+                )
+                .values(lease_until=self._lease_deadline())
+            )
+            await session.commit()
+        return res.rowcount > 0
+
+    @asynccontextmanager
+    async def lease(self, job: Job) -> AsyncIterator[None]:
+        """
+        Держит lease задачи, пока выполняется тело контекста.
+        Если lease потерян (reaper уже вернул строку в pending, её может
+        забрать другой воркер), таск, вошедший в контекст, отменяется —
+        две копии одной задачи не качают параллельно.
+        """
+        owner = asyncio.current_task()
+
+        async def _keep_alive() -> None:
+            while True:
+                await asyncio.sleep(self.lease_seconds / 3)
+                try:
+                    if not await self._heartbeat(job):
+                        logger.warning("lost lease on download %s, cancelling it", job.download_id)
+                        owner.cancel()
+                        return
+                except Exception:
+                    logger.exception("heartbeat failed for download %s", job.download_id)
+
+        keeper = asyncio.create_task(_keep_alive(), name=f"lease-{job.download_id}")
+        try:
+            yield
+        finally:
+            keeper.cancel()
+            with suppress(asyncio.CancelledError):
+                await keeper
+
+    async def requeue_expired(self) -> int:
+        """
+        Возвращает в pending задачи, чей воркер перестал продлевать lease
+        (процесс упал, хост пропал). Строки без lease — наследие старой
+        in-memory очереди, их тоже подбираем.
+        """
+        async with self.session_factory() as session:
+            res = await session.execute(
+                update(Download)
+                .where(
+                    Download.status == DownloadStatus.processing,
+                    or_(
+                        Download.lease_until.is_(None),
+                        Download.lease_until < datetime.utcnow(),
+                    ),
+                )
+                .values(status=DownloadStatus.pending, worker_id=None, lease_until=None, leader_id=None)
+            )
+            await session.commit()
+        if res.rowcount:
+            logger.warning("requeued %s abandoned download(s)", res.rowcount)
+            self._wakeup.set()
+        return res.rowcount
+
+    async def release(self) -> int:
+        """
+        Задачи, которые держит этот процесс, — снова в pending. При
+        остановке (worker.drain) их сразу подберут другие процессы, не
+        дожидаясь истечения lease.
+        """
+        async with self.session_factory() as session:
+            res = await session.execute(
+                update(Download)
+                .where(
+                    Download.status == DownloadStatus.processing,
+                    Download.worker_id == WORKER_ID,
+                )
+                .values(status=DownloadStatus.pending, worker_id=None, lease_until=None, leader_id=None)
+            )
+            await session.commit()
+        if res.rowcount:
+            self._wakeup.set()
+        return res.rowcount
+
+    async def recover(self) -> int:
+        """
+        Старт процесса: задачи, которые держал прошлый экземпляр с тем же
+        WORKER_ID, и все просроченные — снова в pending.
+        """
+        await self.release()
+        return await self.requeue_expired()
+
+
+def create_queue(backend: str = QUEUE_BACKEND):
+    if backend == "memory":
+        return MemoryQueue()
+    if backend == "db":
+        return DbQueue()
+    raise ValueError(f"unknown QUEUE_BACKEND: {backend}")
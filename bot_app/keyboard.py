@@ -1,4 +1,6 @@
 # bot_app/keyboard.py
+from typing import Optional
+
 from aiogram.types import (
     ReplyKeyboardMarkup,
     KeyboardButton,
@@ -43,18 +45,35 @@ def back_menu() -> ReplyKeyboardMarkup:
 # ------------------------------------------------------------
 # Inline-клавиатуры (контекстные)
 # ------------------------------------------------------------
-def confirm_download(token: str) -> InlineKeyboardMarkup:
+def confirm_download(link_id: int) -> InlineKeyboardMarkup:
     """
-    ВАЖНО: В callback_data нельзя класть длинные строки (лимит Telegram ~64 байта).
-    Поэтому сюда передаём короткий токен (например, 'abc123'), а сам URL
-    храним во временном кеше в handlers.py.
+    ВАЖНО: В callback_data нельзя класть длинные строки (лимит Telegram ~64 байта),
+    а ссылка с &t=/&list=/&si= в него не помещается. Поэтому сам URL хранится
+    в БД (batches.create_batch — пакет из одной ссылки), а сюда передаём его ID.
     """
     return InlineKeyboardMarkup(
         inline_keyboard=[
             [
-                InlineKeyboardButton(text="✅ Підтвердити", callback_data=f"download:{token}"),
-                InlineKeyboardButton(text="❌ Відмінити", callback_data="cancel"),
-            ]
+                InlineKeyboardButton(text="✅ Підтвердити", callback_data=f"download:{link_id}"),
+                InlineKeyboardButton(text="🎵 Лише аудіо", callback_data=f"audio:{link_id}"),
+            ],
+            [InlineKeyboardButton(text="❌ Відмінити", callback_data="cancel")],
+        ]
+    )
+
+
+def confirm_batch(batch_id: int) -> InlineKeyboardMarkup:
+    """
+    Подтверждение пакета: ссылки лежат в БД (batches), в callback_data — ID
+    (и ":audio", если нужен только звук).
+    """
+    return InlineKeyboardMarkup(
+        inline_keyboard=[
+            [
+                InlineKeyboardButton(text="✅ Завантажити все", callback_data=f"batch:{batch_id}"),
+                InlineKeyboardButton(text="🎵 Все як аудіо", callback_data=f"batch:{batch_id}:audio"),
+            ],
+            [InlineKeyboardButton(text="❌ Відмінити", callback_data="cancel")],
         ]
     )
 
@@ -68,3 +87,15 @@ def download_finished(file_id: str) -> InlineKeyboardMarkup:
             ]
         ]
     )
+
+
+def history_nav(older: Optional[str], newer: Optional[str]) -> Optional[InlineKeyboardMarkup]:
+    """
+    Листание истории. В callback_data — курсор из history.py (несколько байт).
+    """
+    row = []
+    if newer:
+        row.append(InlineKeyboardButton(text="⬅️ Новіші", callback_data=f"history:{newer}"))
+    if older:
+        row.append(InlineKeyboardButton(text="Старіші ➡️", callback_data=f"history:{older}"))
+    return InlineKeyboardMarkup(inline_keyboard=[row]) if row else None
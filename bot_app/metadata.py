@@ -0,0 +1,132 @@
+# bot_app/metadata.py
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .downloader import DownloadError, extract_metadata
+from .utils import extract_video_id
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Ссылки на форматы в info dict живут несколько часов, поэтому TTL меньше
+METADATA_TTL = float(os.getenv("METADATA_CACHE_TTL", "1800"))
+METADATA_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_SIZE", "128"))
+# Сколько extract_info может идти одновременно
+METADATA_CONCURRENCY = int(os.getenv("METADATA_CONCURRENCY", "4"))
+
+# Тяжёлые поля, которые не нужны ни для подтверждения, ни для скачивания
+_DROP_KEYS = ("thumbnails", "subtitles", "automatic_captions", "heatmap", "chapters", "description")
+
+
+# ------------------------------------------------------------
+# TTL + LRU кеш info dict
+# ------------------------------------------------------------
+class MetadataCache:
+    def __init__(self, ttl: float = METADATA_TTL, max_entries: int = METADATA_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max(0, max_entries)
+        self._entries: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, info = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return info
+
+    def put(self, key: str, info: Dict[str, Any]) -> None:
+        if self.max_entries == 0:
+            return
+        self._entries[key] = (time.monotonic() + self.ttl, info)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+
+metadata_cache = MetadataCache()
+
+_pending: Dict[str, asyncio.Task] = {}
+_slots = asyncio.Semaphore(METADATA_CONCURRENCY)
+
+
+def cache_key(url: str) -> str:
+    return extract_video_id(url) or url
+
+
+async def _fetch(key: str, url: str) -> Optional[Dict[str, Any]]:
+    async with _slots:
+        try:
+            info = await extract_metadata(url)
+        except DownloadError as e:
+            logger.info("metadata prefetch failed for %s: %s", url, e)
+            return None
+    for k in _DROP_KEYS:
+        info.pop(k, None)
+    metadata_cache.put(key, info)
+    return info
+
+
+# ------------------------------------------------------------
+# Публичное API
+# ------------------------------------------------------------
+def prefetch(url: str) -> "asyncio.Future[Optional[Dict[str, Any]]]":
+    """
+    Запускает фоновое извлечение метаданных (без скачивания).
+    Повторный вызов для того же видео не создаёт новый запрос.
+    """
+    key = cache_key(url)
+    info = metadata_cache.get(key)
+    if info is not None:
+        fut: asyncio.Future = asyncio.get_running_loop().create_future()
+        fut.set_result(info)
+        return fut
+
+    task = _pending.get(key)
+    if task is None:
+        task = asyncio.create_task(_fetch(key, url), name=f"metadata-{key}")
+        _pending[key] = task
+        task.add_done_callback(lambda _t: _pending.pop(key, None))
+    return task
+
+
+async def lookup(url: str) -> Optional[Dict[str, Any]]:
+    """
+    Метаданные для воркера: из кеша или из уже идущего prefetch.
+    Новый запрос не запускает — тогда yt-dlp извлечёт всё сам при скачивании.
+    """
+    key = cache_key(url)
+    info = metadata_cache.get(key)
+    if info is not None:
+        return info
+    task = _pending.get(key)
+    if task is None:
+        return None
+    return await asyncio.shield(task)
+
+
+def estimate_size(info: Dict[str, Any]) -> Optional[int]:
+    """
+    Оценка размера выбранного формата (видео + аудио при раздельных потоках).
+    """
+    formats = info.get("requested_formats") or [info]
+    total = 0
+    for f in formats:
+        size = f.get("filesize") or f.get("filesize_approx")
+        if not size:
+            return None
+        total += size
+    return int(total)
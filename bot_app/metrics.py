@@ -0,0 +1,350 @@
+# bot_app/metrics.py
+import os
+import time
+import inspect
+import logging
+import threading
+from contextlib import nullcontext
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Выключено по умолчанию: метрики — no-op объекты, декораторы @timed
+# возвращают функцию как есть, middleware не регистрируется
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+# Порт /metrics в режиме polling (в webhook-режиме — на сервере webhook)
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9100"))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# короткие операции (хендлеры, БД) и этапы задачи (секунды — десятки минут)
+FAST_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+JOB_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800, 3600)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+# ------------------------------------------------------------
+# Значения (по одному на набор меток)
+# ------------------------------------------------------------
+class _Value:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = float(value)
+
+
+class _Timer:
+    __slots__ = ("_observe", "_began")
+
+    def __init__(self, observe: Callable[[float], None]) -> None:
+        self._observe = observe
+
+    def __enter__(self) -> "_Timer":
+        self._began = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self._observe(time.perf_counter() - self._began)
+
+
+class _HistogramValue:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self._lock = threading.Lock()
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        with self._lock:
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    self.counts[i] += 1
+                    break
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer:
+        return _Timer(self.observe)
+
+
+# ------------------------------------------------------------
+# Метрики
+# ------------------------------------------------------------
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        if not self.labelnames:
+            self._default = self.labels()
+
+    def _new_value(self) -> Any:
+        return _Value()
+
+    def labels(self, *values: Any) -> Any:
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name}: expected labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_value())
+        return child
+
+    def _label_str(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{n}="{_escape(v)}"' for n, v in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            lines.append(f"{self.name}{self._label_str(key)} {_fmt(child.value)}")
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default.inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default.dec(amount)
+
+    def set(self, value: float) -> None:
+        self._default.set(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = FAST_BUCKETS,
+    ) -> None:
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames)
+
+    def _new_value(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default.observe(value)
+
+    def time(self) -> _Timer:
+        return self._default.time()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in list(self._children.items()):
+            with child._lock:
+                counts, total, count = list(child.counts), child.sum, child.count
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                le = 'le="%s"' % _fmt(bound)
+                lines.append(f"{self.name}_bucket{self._label_str(key, le)} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{self._label_str(key, inf)} {count}")
+            lines.append(f"{self.name}_sum{self._label_str(key)} {_fmt(total)}")
+            lines.append(f"{self.name}_count{self._label_str(key)} {count}")
+        return lines
+
+
+# ------------------------------------------------------------
+# No-op (METRICS_ENABLED=0)
+# ------------------------------------------------------------
+class _Noop:
+    """
+    Заглушка вместо любой метрики: все вызовы — пустые.
+    """
+
+    _timer = nullcontext()
+
+    def labels(self, *values: Any) -> "_Noop":
+        return self
+
+    def inc(self, amount: float = 1.0) -> None:
+        pass
+
+    def dec(self, amount: float = 1.0) -> None:
+        pass
+
+    def set(self, value: float) -> None:
+        pass
+
+    def observe(self, value: float) -> None:
+        pass
+
+    def time(self) -> Any:
+        return self._timer
+
+
+_NOOP = _Noop()
+
+
+# ------------------------------------------------------------
+# Реестр и экспорт в формате Prometheus
+# ------------------------------------------------------------
+class Registry:
+    def __init__(self) -> None:
+        self._metrics: List[_Metric] = []
+        # вызываются перед каждым экспортом: обновляют gauges,
+        # которые дешевле снять по запросу, чем поддерживать постоянно
+        self._collectors: List[Callable[[], Awaitable[None]]] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector: Callable[[], Awaitable[None]]) -> None:
+        if METRICS_ENABLED and collector not in self._collectors:
+            self._collectors.append(collector)
+
+    async def collect(self) -> str:
+        for collector in self._collectors:
+            try:
+                await collector()
+            except Exception:
+                logger.exception("metrics collector %r failed", collector)
+        lines: List[str] = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Any:
+    return REGISTRY.register(Counter(name, documentation, labelnames)) if METRICS_ENABLED else _NOOP
+
+
+def gauge(name: str, documentation: str, labelnames: Sequence[str] = ()) -> Any:
+    return REGISTRY.register(Gauge(name, documentation, labelnames)) if METRICS_ENABLED else _NOOP
+
+
+def histogram(
+    name: str,
+    documentation: str,
+    labelnames: Sequence[str] = (),
+    buckets: Sequence[float] = FAST_BUCKETS,
+) -> Any:
+    if not METRICS_ENABLED:
+        return _NOOP
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def timed(metric: Any) -> Callable[[Callable], Callable]:
+    """
+    Декоратор: длительность вызова (sync или async) -> metric.observe().
+    При выключенных метриках функция возвращается без обёртки.
+    """
+    def decorator(fn: Callable) -> Callable:
+        if metric is _NOOP:
+            return fn
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                with metric.time():
+                    return await fn(*args, **kwargs)
+            return async_wrapper
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with metric.time():
+                return fn(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+# ------------------------------------------------------------
+# Метрики бота
+# ------------------------------------------------------------
+ENQUEUE_SECONDS = histogram("bot_enqueue_seconds", "Time to create a download and put it in the queue")
+JOBS_ENQUEUED = counter("bot_jobs_enqueued_total", "Downloads enqueued", ["mode"])
+JOBS_FINISHED = counter("bot_jobs_finished_total", "Jobs finished by the worker", ["result"])
+JOB_CHECKPOINTS = counter(
+    "bot_job_checkpoints_total",
+    "Interrupted downloads: saved on shutdown, resumed after restart",
+    ["event"],
+)
+JOB_QUEUE_WAIT = histogram(
+    "bot_job_queue_wait_seconds",
+    "Time from enqueue until the worker starts the download (queue and slot wait)",
+    buckets=JOB_BUCKETS,
+)
+JOB_SECONDS = histogram("bot_job_seconds", "Whole _process_job duration", buckets=JOB_BUCKETS)
+JOB_STAGE_SECONDS = histogram(
+    "bot_job_stage_seconds",
+    "Job stage duration: extract, download, merge, remux, transcode, move",
+    ["stage"],
+    buckets=JOB_BUCKETS,
+)
+QUEUE_DEPTH = gauge("bot_queue_depth", "Jobs waiting in the queue")
+WORKER_SLOTS = gauge("bot_worker_slots", "Download slots: active, limit, waiting", ["state"])
+UPDATE_SECONDS = histogram("bot_update_seconds", "Telegram update handling time", ["event"])
+
+
+# ------------------------------------------------------------
+# Время обработки обновлений (aiogram middleware)
+# ------------------------------------------------------------
+class UpdateTimingMiddleware(BaseMiddleware):
+    """
+    Outer-middleware на dp.update: время от получения обновления до конца
+    хендлеров, по типу события (message, callback_query, …).
+    """
+
+    async def __call__(
+        self,
+        handler: Callable[[Update, Dict[str, Any]], Awaitable[Any]],
+        event: Update,
+        data: Dict[str, Any],
+    ) -> Any:
+        with UPDATE_SECONDS.labels(event.event_type).time():
+            return await handler(event, data)
@@ -12,8 +12,13 @@ from sqlalchemy import (
     String,
     Text,
     Integer,
+    SmallInteger,
     DateTime,
+    Index,
+    JSON,
+    UniqueConstraint,
     func,
+    text,
 )
 from sqlalchemy.orm import (
     Mapped,
@@ -34,6 +39,12 @@ class DownloadStatus(str, enum.Enum):
     failed = "failed"
 
 
+class MediaKind(str, enum.Enum):
+    # что пользователь хочет получить: ролик целиком или только звук
+    video = "video"
+    audio = "audio"
+
+
 # ------------------------------------------------------------
 # Models
 # ------------------------------------------------------------
@@ -50,29 +61,98 @@ class User(Base):
     )
 
     # relationships
+    # история может быть большой: грузится только явно (selectinload и т.п.)
     downloads: Mapped[List["Download"]] = relationship(
         back_populates="user",
         cascade="all, delete-orphan",
         passive_deletes=True,
-        lazy="selectin",
+        lazy="raise",
     )
 
     def __repr__(self) -> str:
         return f"<User id={self.id} tg={self.telegram_id}>"
 
 
+class Batch(Base):
+    """
+    Пакет загрузок: сообщение с несколькими ссылками и/или плейлистами.
+    Строка создаётся при показе подтверждения (ID уходит в callback_data),
+    задачи — после подтверждения; результат отправляется альбомами,
+    когда готовы все задачи пакета. Одиночная ссылка ждёт подтверждения
+    так же — пакетом из одной ссылки; её задача ставится без batch_id,
+    а total у такой строки не заполняется.
+    """
+    __tablename__ = "batches"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    user_id: Mapped[int] = mapped_column(
+        ForeignKey("users.id", ondelete="CASCADE"),
+        index=True,
+        nullable=False,
+    )
+    chat_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    # исходные ссылки из сообщения, по одной на строку
+    urls: Mapped[str] = mapped_column(Text, nullable=False)
+    # число задач; None — плейлисты ещё разворачиваются
+    total: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    # подтверждён пользователем (повторное нажатие кнопки ничего не делает)
+    started_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # отправку взял процесс (lease: просроченную берёт другой вызов)
+    delivering_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+    # результат отправлен в чат (итоговое сообщение ушло); индекс — для
+    # поиска недоставленных пакетов (delivery.deliver_pending_batches)
+    delivered_at: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), index=True, nullable=True)
+
+    def __repr__(self) -> str:
+        return f"<Batch id={self.id} total={self.total}>"
+
+
 class Download(Base):
     __tablename__ = "downloads"
+    __table_args__ = (
+        # история пользователя (keyset-пагинация, см. history.py); заодно
+        # служит индексом по user_id. На PostgreSQL страница читается
+        # index-only scan: status и video_id лежат в самом индексе
+        Index(
+            "ix_downloads_user_created",
+            "user_id",
+            "created_at",
+            "id",
+            postgresql_include=["status", "video_id"],
+        ),
+        # очередь на БД (jobqueue.DbQueue): следующий пользователь с
+        # pending-задачей и его самая старая задача — поиском по индексу,
+        # без просмотра всех pending-строк
+        Index(
+            "ix_downloads_pending_head",
+            "priority",
+            "user_id",
+            "id",
+            sqlite_where=text("status = 'pending'"),
+            postgresql_where=text("status = 'pending'"),
+        ),
+    )
 
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
 
     user_id: Mapped[int] = mapped_column(
         ForeignKey("users.id", ondelete="CASCADE"),
-        index=True,
         nullable=False,
     )
 
+    # чат, куда отдаём готовый файл (None — личка пользователя)
+    chat_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    # сообщение «Завантаження…», которое правится прогрессом
+    status_message_id: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
     url: Mapped[str] = mapped_column(String(1024), nullable=False)
+    # канонический ID видео (ключ кеша готовых файлов)
+    video_id: Mapped[Optional[str]] = mapped_column(String(32), index=True, nullable=True)
     status: Mapped[DownloadStatus] = mapped_column(
         Enum(DownloadStatus, name="download_status"),
         default=DownloadStatus.pending,
@@ -80,8 +160,41 @@ class Download(Base):
         index=True,
     )
 
-    file_path: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)
+    # видео или только аудио (формат yt-dlp и обработка, см. postprocess.py)
+    kind: Mapped[MediaKind] = mapped_column(
+        Enum(MediaKind, name="media_kind"),
+        default=MediaKind.video,
+        server_default=MediaKind.video.value,
+        nullable=False,
+    )
+
+    # класс приоритета в очереди: 0 — короткие/маленькие ролики, 1 — обычные
+    priority: Mapped[int] = mapped_column(SmallInteger, default=1, server_default="1", nullable=False)
+
+    # пакет, в составе которого задача (результат отправляется альбомом)
+    batch_id: Mapped[Optional[int]] = mapped_column(
+        ForeignKey("batches.id", ondelete="SET NULL"),
+        index=True,
+        nullable=True,
+    )
+
+    # задача-«лидер», результат которой получит эта загрузка (single-flight)
+    leader_id: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+
+    # владелец задачи в очереди на БД и срок его lease
+    worker_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+    lease_until: Mapped[Optional[datetime]] = mapped_column(DateTime(timezone=True), nullable=True)
+
+    # индекс: вытеснение файла (diskbudget) очищает все загрузки, которые
+    # на него ссылаются (попадания в кеш и ведомые делят файл лидера)
+    file_path: Mapped[Optional[str]] = mapped_column(String(1024), index=True, nullable=True)
     file_size: Mapped[Optional[int]] = mapped_column(Integer, nullable=True)
+    # точка продолжения загрузки, прерванной остановкой бота (worker.drain):
+    # недокачанный файл в staging и сколько байт уже скачано
+    partial_path: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)
+    bytes_done: Mapped[Optional[int]] = mapped_column(BigInteger, nullable=True)
+    # уже скачанный файл в staging, обработку которого прервала остановка
+    ready_path: Mapped[Optional[str]] = mapped_column(String(1024), nullable=True)
     error: Mapped[Optional[str]] = mapped_column(Text, nullable=True)
 
     created_at: Mapped[datetime] = mapped_column(
@@ -93,9 +206,90 @@ class Download(Base):
         DateTime(timezone=True),
         nullable=True,
     )
+    # файл удалён менеджером дискового бюджета (file_path при этом очищен)
+    evicted_at: Mapped[Optional[datetime]] = mapped_column(
+        DateTime(timezone=True),
+        nullable=True,
+    )
 
     # relationships
-    user: Mapped["User"] = relationship(back_populates="downloads", lazy="joined")
+    # нужен редко (telegram_id для доставки) — без JOIN на каждый get(Download)
+    user: Mapped["User"] = relationship(back_populates="downloads", lazy="raise")
 
     def __repr__(self) -> str:
         return f"<Download id={self.id} status={self.status} url={self.url[:30]}...>"
+
+
+class TelegramFile(Base):
+    """
+    file_id, полученный от Telegram после первой отправки видео.
+    Повторные запросы того же видео отправляются по file_id без upload.
+    """
+    __tablename__ = "telegram_files"
+    __table_args__ = (UniqueConstraint("video_id", "format", name="uq_telegram_files_video_format"),)
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    video_id: Mapped[str] = mapped_column(String(32), nullable=False)
+    format: Mapped[str] = mapped_column(String(128), nullable=False)
+    file_id: Mapped[str] = mapped_column(String(256), nullable=False)
+    file_unique_id: Mapped[Optional[str]] = mapped_column(String(64), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return f"<TelegramFile video={self.video_id} file_id={self.file_id[:16]}...>"
+
+
+class StoredFile(Base):
+    """
+    Индекс файлов в DOWNLOADS_DIR: размер и время последнего использования.
+    По нему считается занятое место и выбираются файлы для вытеснения.
+    """
+    __tablename__ = "stored_files"
+
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    path: Mapped[str] = mapped_column(String(1024), unique=True, nullable=False)
+    size: Mapped[int] = mapped_column(BigInteger, nullable=False)
+    video_id: Mapped[Optional[str]] = mapped_column(String(32), nullable=True)
+    format: Mapped[Optional[str]] = mapped_column(String(128), nullable=True)
+
+    created_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        nullable=False,
+    )
+    last_access: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        index=True,
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return f"<StoredFile path={self.path} size={self.size}>"
+
+
+class FsmState(Base):
+    """
+    Состояние FSM aiogram (см. fsm.py): общее для всех реплик бота.
+    """
+    __tablename__ = "fsm_states"
+
+    # ключ DefaultKeyBuilder: fsm:<bot>:<chat>:<user>:…
+    key: Mapped[str] = mapped_column(String(255), primary_key=True)
+    state: Mapped[Optional[str]] = mapped_column(String(255), nullable=True)
+    data: Mapped[dict] = mapped_column(JSON, nullable=False, default=dict)
+
+    updated_at: Mapped[datetime] = mapped_column(
+        DateTime(timezone=True),
+        server_default=func.now(),
+        index=True,
+        nullable=False,
+    )
+
+    def __repr__(self) -> str:
+        return f"<FsmState key={self.key} state={self.state}>"
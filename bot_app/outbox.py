@@ -0,0 +1,311 @@
+# bot_app/outbox.py
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры (лимиты Telegram Bot API)
+# ------------------------------------------------------------
+GLOBAL_RATE = float(os.getenv("OUTBOX_GLOBAL_RATE", "30"))       # сообщений/с на бота
+CHAT_RATE = float(os.getenv("OUTBOX_CHAT_RATE", "1"))            # сообщений/с в личку
+GROUP_RATE = float(os.getenv("OUTBOX_GROUP_RATE", str(20 / 60)))  # сообщений/с в группу
+CHAT_BURST = float(os.getenv("OUTBOX_CHAT_BURST", "3"))
+MAX_RETRIES = int(os.getenv("OUTBOX_MAX_RETRIES", "3"))
+
+# Полосы приоритета: ответы на действия пользователя идут раньше уведомлений
+PRIORITY_USER = 0
+PRIORITY_STATUS = 1
+
+Call = Callable[[Bot], Awaitable[Any]]
+
+
+# ------------------------------------------------------------
+# Token bucket
+# ------------------------------------------------------------
+class TokenBucket:
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        # принудительная пауза (retry_after от Telegram)
+        self.paused_until = 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now: Optional[float] = None) -> float:
+        """
+        Через сколько секунд будет доступен токен (0 — прямо сейчас).
+        """
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        wait = max(0.0, self.paused_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def consume(self) -> None:
+        self.tokens -= 1
+
+    def pause(self, seconds: float) -> None:
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and self.tokens >= self.burst
+
+
+# ------------------------------------------------------------
+# Очередь исходящих вызовов
+# ------------------------------------------------------------
+@dataclass
+class _Item:
+    priority: int
+    seq: int
+    chat_id: int
+    call: Call
+    futures: List[asyncio.Future] = field(default_factory=list)
+    coalesce_key: Optional[Tuple[int, int]] = None
+    attempts: int = 0
+
+
+class Outbox:
+    """
+    Единая точка отправки сообщений в Telegram.
+
+    - token bucket на каждый чат и общий на бота;
+    - две полосы приоритета (PRIORITY_USER раньше PRIORITY_STATUS);
+    - повторные edit одного и того же сообщения, ещё не ушедшие в API,
+      склеиваются: отправится только последнее состояние;
+    - TelegramRetryAfter ставит чат на паузу и возвращает вызов в очередь.
+
+    Методы не блокируют вызывающего: возвращают future с результатом API,
+    которое можно ждать, а можно игнорировать.
+    """
+
+    def __init__(
+        self,
+        global_rate: float = GLOBAL_RATE,
+        chat_rate: float = CHAT_RATE,
+        group_rate: float = GROUP_RATE,
+        chat_burst: float = CHAT_BURST,
+    ) -> None:
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[int, TokenBucket] = {}
+        self._lanes: Dict[int, List[Tuple[int, int, _Item]]] = {}
+        self._edits: Dict[Tuple[int, int], _Item] = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._inflight: set = set()
+        self._bot: Optional[Bot] = None
+        self._task: Optional[asyncio.Task] = None
+
+    # ---------------- жизненный цикл ----------------
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start(self, bot: Bot) -> None:
+        self._bot = bot
+        if not self.running:
+            self._task = asyncio.create_task(self._run(), name="outbox")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        if self._inflight:
+            await asyncio.gather(*self._inflight, return_exceptions=True)
+
+    def pending(self) -> int:
+        return sum(len(lane) for lane in self._lanes.values())
+
+    # ---------------- постановка ----------------
+    def submit(
+        self,
+        chat_id: int,
+        call: Call,
+        priority: int = PRIORITY_USER,
+        coalesce_key: Optional[Tuple[int, int]] = None,
+    ) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        fut.add_done_callback(_consume_result)
+
+        if coalesce_key is not None:
+            queued = self._edits.get(coalesce_key)
+            if queued is not None:
+                # предыдущий edit ещё не отправлен — заменяем его содержимое
+                queued.call = call
+                queued.futures.append(fut)
+                if priority < queued.priority:
+                    # повысить приоритет: старая запись в куче останется и будет пропущена
+                    queued.priority = priority
+                    self._push(queued)
+                return fut
+
+        item = _Item(priority, next(self._seq), chat_id, call, [fut], coalesce_key)
+        if coalesce_key is not None:
+            self._edits[coalesce_key] = item
+        self._push(item)
+        return fut
+
+    def _push(self, item: _Item) -> None:
+        heapq.heappush(self._lanes.setdefault(item.chat_id, []), (item.priority, item.seq, item))
+        self._wakeup.set()
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_USER, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda bot: bot.send_message(chat_id, text, **kwargs), priority)
+
+    def send_video(self, chat_id: int, video: Any, priority: int = PRIORITY_STATUS, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda bot: bot.send_video(chat_id, video, **kwargs), priority)
+
+    def send_audio(self, chat_id: int, audio: Any, priority: int = PRIORITY_STATUS, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda bot: bot.send_audio(chat_id, audio, **kwargs), priority)
+
+    def send_media_group(self, chat_id: int, media: List[Any], priority: int = PRIORITY_STATUS, **kwargs) -> asyncio.Future:
+        return self.submit(chat_id, lambda bot: bot.send_media_group(chat_id, media, **kwargs), priority)
+
+    def edit_message_text(
+        self,
+        chat_id: int,
+        message_id: int,
+        text: str,
+        priority: int = PRIORITY_STATUS,
+        **kwargs,
+    ) -> asyncio.Future:
+        return self.submit(
+            chat_id,
+            lambda bot: bot.edit_message_text(text=text, chat_id=chat_id, message_id=message_id, **kwargs),
+            priority,
+            coalesce_key=(chat_id, message_id),
+        )
+
+    # ---------------- диспетчер ----------------
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            rate = self.group_rate if chat_id < 0 else self.chat_rate
+            bucket = TokenBucket(rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def _next_item(self) -> Tuple[Optional[_Item], float]:
+        """
+        Лучший по приоритету вызов среди чатов, у которых есть токен.
+        Иначе — через сколько секунд появится первый токен.
+        """
+        best: Optional[Tuple[int, int, int]] = None
+        wait = float("inf")
+        now = time.monotonic()
+        for chat_id, lane in list(self._lanes.items()):
+            # пропускаем записи, вытесненные склейкой/повышением приоритета
+            while lane and (lane[0][2].priority, lane[0][2].seq) != lane[0][:2]:
+                heapq.heappop(lane)
+            if not lane:
+                del self._lanes[chat_id]
+                continue
+            delay = self._bucket(chat_id).delay(now)
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+            head = (lane[0][0], lane[0][1], chat_id)
+            if best is None or head < best:
+                best = head
+        if best is None:
+            return None, wait
+        item = heapq.heappop(self._lanes[best[2]])[2]
+        if not self._lanes[best[2]]:
+            del self._lanes[best[2]]
+        return item, 0.0
+
+    async def _run(self) -> None:
+        while True:
+            self._wakeup.clear()
+            item, wait = self._next_item()
+            if item is None:
+                self._prune_buckets()
+                timeout = None if wait == float("inf") else wait
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            delay = self._global.delay()
+            if delay > 0:
+                # вернём на место и подождём общий токен
+                self._push(item)
+                await asyncio.sleep(delay)
+                continue
+
+            self._global.consume()
+            self._bucket(item.chat_id).consume()
+            if item.coalesce_key is not None and self._edits.get(item.coalesce_key) is item:
+                del self._edits[item.coalesce_key]
+            task = asyncio.create_task(self._execute(item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, item: _Item) -> None:
+        try:
+            result = await item.call(self._bot)
+        except TelegramRetryAfter as e:
+            item.attempts += 1
+            if item.attempts > MAX_RETRIES:
+                _resolve(item, exc=e)
+                return
+            logger.warning("flood control in chat %s, retry in %ss", item.chat_id, e.retry_after)
+            self._bucket(item.chat_id).pause(e.retry_after)
+            if item.coalesce_key is not None:
+                newer = self._edits.get(item.coalesce_key)
+                if newer is not None:
+                    # за время ожидания пришёл более свежий edit — этот не нужен
+                    newer.futures.extend(item.futures)
+                    return
+                self._edits[item.coalesce_key] = item
+            item.seq = next(self._seq)
+            self._push(item)
+        except Exception as e:
+            _resolve(item, exc=e)
+        else:
+            _resolve(item, result=result)
+
+    def _prune_buckets(self) -> None:
+        for chat_id in [c for c, b in self._buckets.items() if c not in self._lanes and b.idle]:
+            del self._buckets[chat_id]
+
+
+def _resolve(item: _Item, result: Any = None, exc: Optional[BaseException] = None) -> None:
+    for fut in item.futures:
+        if fut.done():
+            continue
+        if exc is not None:
+            fut.set_exception(exc)
+        else:
+            fut.set_result(result)
+
+
+def _consume_result(fut: asyncio.Future) -> None:
+    # fire-and-forget вызовы не должны сыпать "exception was never retrieved"
+    if not fut.cancelled() and fut.exception() is not None:
+        logger.debug("outbox call failed: %s", fut.exception())
+
+
+outbox = Outbox()
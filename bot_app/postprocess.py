@@ -0,0 +1,385 @@
+# bot_app/postprocess.py
+import os
+import json
+import shutil
+import asyncio
+import functools
+import logging
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from . import metrics
+from .downloader import ProgressCallback
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+FFMPEG_CMD = os.getenv("FFMPEG_CMD", "ffmpeg")
+FFPROBE_CMD = os.getenv("FFPROBE_CMD", "ffprobe")
+# Сколько ffmpeg работает одновременно. Пул отдельный от слотов загрузки:
+# кодирование грузит CPU и не должно занимать сетевые слоты (и наоборот)
+ENCODE_CONCURRENCY = int(os.getenv("ENCODE_CONCURRENCY", "1"))
+ENCODE_PRESET = os.getenv("ENCODE_PRESET", "veryfast")
+# Потоков на один ffmpeg (0 — по числу ядер)
+ENCODE_THREADS = int(os.getenv("ENCODE_THREADS", "0"))
+
+# Предел файла для отправки ботом: 50 МБ в Bot API, до 2000 МБ у своего
+# сервера Bot API. 0 — без предела (ради размера не перекодируем)
+TELEGRAM_UPLOAD_LIMIT = int(os.getenv("TELEGRAM_UPLOAD_LIMIT", str(50 * 1024 * 1024)))
+# Какую долю предела занимать при кодировании под размер (запас на
+# контейнер и неточность битрейта)
+SIZE_HEADROOM = 0.95
+
+# Кодеки, которые кладутся в mp4/m4a как есть и играются в клиентах Telegram
+REMUX_VIDEO_CODECS = set(os.getenv("REMUX_VIDEO_CODECS", "h264,hevc").split(","))
+REMUX_AUDIO_CODECS = set(os.getenv("REMUX_AUDIO_CODECS", "aac,mp3").split(","))
+
+# Битрейт аудио при перекодировании, бит/с
+AUDIO_BITRATE = int(os.getenv("AUDIO_BITRATE", "128000"))
+MIN_AUDIO_BITRATE = 32000
+# Ниже этого видео под предел не кодируем — смотреть будет нечего
+MIN_VIDEO_BITRATE = int(os.getenv("MIN_VIDEO_BITRATE", "150000"))
+# Видео с низким целевым битрейтом заодно уменьшаем: (битрейт ниже, высота)
+_SCALE_STEPS = ((500_000, 480), (1_200_000, 720))
+
+
+class PostprocessError(RuntimeError):
+    """
+    Ошибка ffmpeg/ffprobe; текст уходит в Download.error.
+    """
+
+
+# ------------------------------------------------------------
+# Что лежит в файле (ffprobe)
+# ------------------------------------------------------------
+@dataclass
+class MediaInfo:
+    # format_name ffprobe: "mov,mp4,m4a,3gp,3g2,mj2", "matroska,webm", …
+    container: str
+    size: int
+    duration: Optional[float] = None
+    vcodec: Optional[str] = None
+    acodec: Optional[str] = None
+    height: Optional[int] = None
+    # битрейты потоков, бит/с (если контейнер их знает)
+    video_bitrate: Optional[int] = None
+    audio_bitrate: Optional[int] = None
+
+
+def _int(value: Any) -> Optional[int]:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def media_info(probe: Dict[str, Any], size: int) -> MediaInfo:
+    fmt = probe.get("format") or {}
+    info = MediaInfo(container=fmt.get("format_name") or "", size=size)
+    duration = fmt.get("duration")
+    info.duration = float(duration) if duration else None
+    for stream in probe.get("streams") or ():
+        kind = stream.get("codec_type")
+        if kind == "video" and info.vcodec is None and not (stream.get("disposition") or {}).get("attached_pic"):
+            info.vcodec = stream.get("codec_name")
+            info.height = _int(stream.get("height"))
+            info.video_bitrate = _int(stream.get("bit_rate"))
+        elif kind == "audio" and info.acodec is None:
+            info.acodec = stream.get("codec_name")
+            info.audio_bitrate = _int(stream.get("bit_rate"))
+    return info
+
+
+# ------------------------------------------------------------
+# План: оставить, перепаковать (stream copy) или перекодировать
+# ------------------------------------------------------------
+@dataclass
+class Plan:
+    # keep | remux | transcode
+    action: str
+    ext: str
+    # для каждого потока: "copy", "encode" или None (поток не нужен)
+    video: Optional[str] = None
+    audio: Optional[str] = None
+    video_bitrate: Optional[int] = None
+    audio_bitrate: Optional[int] = None
+    # уменьшить до этой высоты (только при encode)
+    height: Optional[int] = None
+
+
+def _fit_bitrate(duration: Optional[float], limit: int) -> Optional[int]:
+    # общий битрейт, при котором файл займёт долю SIZE_HEADROOM от limit
+    if not limit or not duration:
+        return None
+    return int(limit * 8 * SIZE_HEADROOM / duration)
+
+
+def _is_mp4(container: str) -> bool:
+    return "mp4" in container.split(",")
+
+
+def plan_audio(info: MediaInfo, limit: int = TELEGRAM_UPLOAD_LIMIT) -> Plan:
+    if info.acodec is None:
+        raise PostprocessError("no audio stream")
+    fit = _fit_bitrate(info.duration, limit)
+    if info.acodec in REMUX_AUDIO_CODECS:
+        ext = "mp3" if info.acodec == "mp3" else "m4a"
+        # размер одной аудиодорожки, если её вынуть из файла
+        copy_size = info.size
+        if info.vcodec is not None and info.audio_bitrate and info.duration:
+            copy_size = int(info.audio_bitrate * info.duration / 8)
+        if not limit or copy_size <= limit or (fit or 0) < MIN_AUDIO_BITRATE:
+            container_ok = _is_mp4(info.container) if ext == "m4a" else info.container == "mp3"
+            if info.vcodec is None and container_ok:
+                return Plan("keep", ext)
+            return Plan("remux", ext, audio="copy")
+    bitrate = AUDIO_BITRATE
+    if fit is not None and fit >= MIN_AUDIO_BITRATE:
+        bitrate = min(bitrate, fit)
+    return Plan("transcode", "m4a", audio="encode", audio_bitrate=bitrate)
+
+
+def plan_video(info: MediaInfo, limit: int = TELEGRAM_UPLOAD_LIMIT) -> Plan:
+    if info.vcodec is None:
+        # видео без картинки (или её не нашли) — отдаём как есть
+        return Plan("keep", "mp4")
+    video_ok = info.vcodec in REMUX_VIDEO_CODECS
+    audio = None
+    if info.acodec is not None:
+        audio = "copy" if info.acodec in REMUX_AUDIO_CODECS else "encode"
+    fits = not limit or info.size <= limit
+    fit = _fit_bitrate(info.duration, limit)
+
+    if video_ok and (fits or fit is None or fit < MIN_VIDEO_BITRATE + AUDIO_BITRATE):
+        # кодеки подходят, а размер либо в пределе, либо его не достичь
+        # разумным битрейтом — только перепаковка (доставка скажет, если велик)
+        if audio != "encode" and _is_mp4(info.container):
+            return Plan("keep", "mp4")
+        return Plan("remux", "mp4", video="copy", audio=audio, audio_bitrate=AUDIO_BITRATE)
+
+    # кодирование видео: кодек не подходит или файл больше предела
+    audio_bitrate = 0
+    if audio == "copy":
+        audio_bitrate = info.audio_bitrate or AUDIO_BITRATE
+    elif audio == "encode":
+        audio_bitrate = AUDIO_BITRATE
+    source = info.video_bitrate
+    if source is None and info.duration:
+        source = int(info.size * 8 / info.duration) - audio_bitrate
+    candidates = [b for b in (source, fit - audio_bitrate if fit else None) if b]
+    video_bitrate = max(MIN_VIDEO_BITRATE, min(candidates)) if candidates else None
+    height = None
+    if video_bitrate and info.height:
+        for below, h in _SCALE_STEPS:
+            if video_bitrate < below and info.height > h:
+                height = h
+                break
+    return Plan(
+        "transcode",
+        "mp4",
+        video="encode",
+        audio=audio,
+        video_bitrate=video_bitrate,
+        audio_bitrate=audio_bitrate or None,
+        height=height,
+    )
+
+
+# ------------------------------------------------------------
+# Командные строки ffmpeg (ffmpeg-python импортируется лениво)
+# ------------------------------------------------------------
+def _audio_kwargs(plan: Plan) -> Dict[str, Any]:
+    if plan.audio == "copy":
+        return {"acodec": "copy"}
+    return {"acodec": "aac", "b:a": plan.audio_bitrate or AUDIO_BITRATE}
+
+
+def _remux_args(src: Path, dst: Path, plan: Plan) -> List[str]:
+    import ffmpeg
+
+    inp = ffmpeg.input(str(src))
+    streams, kwargs = [], {}
+    if plan.video:
+        streams.append(inp["v:0"])
+        kwargs["vcodec"] = "copy"
+    if plan.audio:
+        streams.append(inp["a:0"])
+        kwargs.update(_audio_kwargs(plan))
+    if plan.ext in ("mp4", "m4a"):
+        kwargs["movflags"] = "+faststart"
+    return ffmpeg.output(*streams, str(dst), **kwargs).get_args()
+
+
+def _pass_args(src: Path, dst: Path, plan: Plan, n: int, passlog: Path) -> List[str]:
+    """
+    Проход n двухпроходного libx264 с целевым битрейтом: первый только
+    собирает статистику (без звука, в /dev/null), второй пишет файл.
+    """
+    import ffmpeg
+
+    inp = ffmpeg.input(str(src))
+    video = inp["v:0"]
+    if plan.height:
+        video = video.filter("scale", -2, plan.height)
+    kwargs: Dict[str, Any] = {
+        "vcodec": "libx264",
+        "preset": ENCODE_PRESET,
+        "pix_fmt": "yuv420p",
+        "b:v": plan.video_bitrate,
+        "pass": n,
+        "passlogfile": str(passlog),
+    }
+    if ENCODE_THREADS:
+        kwargs["threads"] = ENCODE_THREADS
+    if n == 1:
+        return ffmpeg.output(video, os.devnull, an=None, f="mp4", **kwargs).get_args()
+    streams = [video]
+    if plan.audio:
+        streams.append(inp["a:0"])
+        kwargs.update(_audio_kwargs(plan))
+    kwargs["movflags"] = "+faststart"
+    return ffmpeg.output(*streams, str(dst), **kwargs).get_args()
+
+
+def _audio_args(src: Path, dst: Path, plan: Plan) -> List[str]:
+    import ffmpeg
+
+    inp = ffmpeg.input(str(src))
+    kwargs = _audio_kwargs(plan)
+    if plan.ext == "m4a":
+        kwargs["movflags"] = "+faststart"
+    return ffmpeg.output(inp["a:0"], str(dst), **kwargs).get_args()
+
+
+# ------------------------------------------------------------
+# Запуск ffmpeg/ffprobe
+# ------------------------------------------------------------
+_slots = asyncio.Semaphore(max(1, ENCODE_CONCURRENCY))
+
+
+@functools.lru_cache(maxsize=None)
+def available() -> bool:
+    """
+    Есть ли ffmpeg и ffprobe. Без них обработка пропускается (один
+    раз пишем предупреждение): файл уходит как скачан.
+    """
+    missing = [cmd for cmd in (FFMPEG_CMD, FFPROBE_CMD) if shutil.which(cmd) is None]
+    if missing:
+        logger.warning("%s not found, post-processing is disabled", ", ".join(missing))
+    return not missing
+
+
+async def _exec(args: List[str], on_line: Optional[Callable[[str], None]] = None) -> bytes:
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+    except FileNotFoundError:
+        raise PostprocessError(f"{args[0]} not found") from None
+    stderr = asyncio.create_task(proc.stderr.read())
+    out = bytearray()
+    try:
+        async for raw in proc.stdout:
+            if on_line is not None:
+                on_line(raw.decode(errors="replace").strip())
+            else:
+                out += raw
+        await proc.wait()
+    finally:
+        if proc.returncode is None:
+            # отмена задачи — ffmpeg не должен остаться работать
+            proc.kill()
+            await proc.wait()
+        err = await stderr
+    if proc.returncode != 0:
+        lines = err.decode(errors="replace").strip().splitlines()
+        raise PostprocessError(lines[-1] if lines else f"{args[0]} exited with {proc.returncode}")
+    return bytes(out)
+
+
+async def probe(path: Path) -> MediaInfo:
+    out = await _exec([
+        FFPROBE_CMD, "-v", "error", "-show_format", "-show_streams", "-of", "json", str(path),
+    ])
+    return media_info(json.loads(out), path.stat().st_size)
+
+
+async def _ffmpeg(
+    args: List[str],
+    duration: Optional[float] = None,
+    progress: Optional[ProgressCallback] = None,
+    share: tuple = (0.0, 1.0),
+) -> None:
+    """
+    ffmpeg с прогрессом (-progress pipe:1): доля обработанного времени
+    отдаётся в progress как этап "encode". share — какую часть общей шкалы
+    занимает этот запуск (у двухпроходного кодирования их два).
+    """
+    cmd = [FFMPEG_CMD, "-hide_banner", "-nostdin", "-y", "-loglevel", "error"]
+    on_line = None
+    if progress is not None and duration:
+        cmd += ["-progress", "pipe:1", "-nostats"]
+        start, part = share
+
+        def on_line(line: str) -> None:
+            key, _, value = line.partition("=")
+            if key == "out_time_us" and value.isdigit():
+                done = min(1.0, int(value) / 1e6 / duration)
+                progress({"stage": "encode", "downloaded": start + part * done, "total": 1.0})
+
+    await _exec(cmd + args, on_line)
+
+
+# ------------------------------------------------------------
+# Публичное API
+# ------------------------------------------------------------
+async def process(src: Path, kind: str, progress: Optional[ProgressCallback] = None) -> Path:
+    """
+    Доводит скачанный файл до отправляемого в Telegram:
+    - kind="audio": только звук — перепаковка в m4a/mp3 без перекодирования,
+      если кодек подходит, иначе AAC;
+    - kind="video": подходящие кодеки (REMUX_*_CODECS) перепаковываются
+      в mp4 как есть; двухпроходное кодирование под TELEGRAM_UPLOAD_LIMIT —
+      только если кодек не подходит или файл больше предела.
+    Не больше ENCODE_CONCURRENCY ffmpeg одновременно. Возвращает путь
+    итогового файла (src удаляется); без ffprobe/ffmpeg файл остаётся как есть.
+    """
+    if not available():
+        return src
+    info = await probe(src)
+    plan = plan_audio(info) if kind == "audio" else plan_video(info)
+    if plan.action == "keep":
+        return src
+
+    base = src.name.split(".", 1)[0]
+    dst = src.with_name(f"{base}.pp.{plan.ext}")
+    passlog = src.with_name(f"{base}.pass")
+    logger.info("%s: %s -> %s %s", src.name, info.container, plan.action, plan)
+    try:
+        async with _slots:
+            with metrics.JOB_STAGE_SECONDS.labels(plan.action).time():
+                if plan.action == "transcode" and plan.video == "encode":
+                    await _ffmpeg(_pass_args(src, dst, plan, 1, passlog), info.duration, progress, (0.0, 0.5))
+                    await _ffmpeg(_pass_args(src, dst, plan, 2, passlog), info.duration, progress, (0.5, 0.5))
+                elif plan.video:
+                    await _ffmpeg(_remux_args(src, dst, plan), info.duration, progress)
+                else:
+                    await _ffmpeg(_audio_args(src, dst, plan), info.duration, progress)
+    except BaseException:
+        dst.unlink(missing_ok=True)
+        raise
+    finally:
+        for log in src.parent.glob(f"{base}.pass*"):
+            log.unlink(missing_ok=True)
+
+    final = src.with_name(f"{base}.{plan.ext}")
+    src.unlink(missing_ok=True)
+    dst.replace(final)
+    return final
@@ -0,0 +1,74 @@
+# bot_app/progress.py
+import time
+from typing import Iterable, Optional
+
+from .downloader import PROGRESS_INTERVAL, Progress
+from .outbox import outbox, PRIORITY_STATUS
+from .utils import format_duration, format_size
+
+
+# ------------------------------------------------------------
+# Текст статуса
+# ------------------------------------------------------------
+def progress_text(snapshot: Progress) -> str:
+    if snapshot.get("stage") == "encode":
+        # обработка ffmpeg (postprocess.py): доля от 0 до 1
+        pct = min(100, int((snapshot.get("downloaded") or 0) * 100 / (snapshot.get("total") or 1)))
+        return f"🎞 Обробка… {pct}%"
+    downloaded = snapshot.get("downloaded") or 0
+    total = snapshot.get("total")
+    text = "📥 Завантаження…"
+    if total:
+        pct = min(100, int(downloaded * 100 / total))
+        text += f" {pct}% ({format_size(downloaded)} / {format_size(total)})"
+    elif downloaded:
+        text += f" {format_size(downloaded)}"
+    if snapshot.get("speed"):
+        text += f"\n⚡ {format_size(snapshot['speed'])}/s"
+    if snapshot.get("eta"):
+        text += f", ETA {format_duration(snapshot['eta'])}"
+    return text
+
+
+# ------------------------------------------------------------
+# Редактирование статусного сообщения задачи
+# ------------------------------------------------------------
+class ProgressReporter:
+    """
+    Правит одно статусное сообщение задачи. Вызывается в event loop.
+
+    Основное прореживание делает ProgressGate на стороне загрузки; здесь —
+    страховка: не больше одного edit за interval секунд на задачу, что бы
+    ни пришло (например, снимки от нескольких потоков одного видео).
+    Сам edit идёт через outbox, так что ещё не отправленные правки
+    одного сообщения склеиваются.
+    """
+
+    def __init__(self, chat_id: int, message_id: int, interval: float = PROGRESS_INTERVAL) -> None:
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._last_time = float("-inf")
+        self._last_text: Optional[str] = None
+
+    def __call__(self, snapshot: Progress) -> None:
+        now = time.monotonic()
+        if now - self._last_time < self.interval:
+            return
+        text = progress_text(snapshot)
+        if text == self._last_text:
+            return
+        self._last_time = now
+        self._last_text = text
+        outbox.edit_message_text(self.chat_id, self.message_id, text, priority=PRIORITY_STATUS)
+
+
+def fan_out(reporters: Iterable[ProgressReporter]):
+    """
+    Один колбэк прогресса для нескольких сообщений (лидер + ведомые).
+    """
+    def report(snapshot: Progress) -> None:
+        for reporter in list(reporters):
+            reporter(snapshot)
+
+    return report
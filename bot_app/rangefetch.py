@@ -0,0 +1,205 @@
+# bot_app/rangefetch.py
+import os
+import threading
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional, Set, Tuple
+
+# ------------------------------------------------------------
+# Параллельное скачивание одного файла по HTTP Range
+# ------------------------------------------------------------
+# CDN часто ограничивают скорость одного соединения; несколько
+# соединений, каждое со своим диапазоном, упираются уже в канал.
+# Синхронный код без зависимостей: работает и в потоке, и в процессе пула.
+DEFAULT_CHUNK_SIZE = int(os.getenv("RANGE_CHUNK_SIZE", str(4 * 1024 * 1024)))
+_READ_SIZE = 256 * 1024
+_ATTEMPTS = 3
+# Журнал докачки рядом с .part: "<размер> <chunk_size>", затем начала
+# готовых чанков по одному на строку
+JOURNAL_SUFFIX = ".ranges"
+
+
+class Interrupted(Exception):
+    """
+    Загрузку остановили (should_stop): .part и журнал остаются для докачки.
+    """
+
+
+def _request(url: str, headers: Optional[Dict[str, str]], start: int, end: int) -> urllib.request.Request:
+    req = urllib.request.Request(url, headers=dict(headers or {}))
+    req.add_header("Range", f"bytes={start}-{end}")
+    return req
+
+
+def probe_size(url: str, headers: Optional[Dict[str, str]] = None, timeout: float = 30) -> Optional[int]:
+    """
+    Полный размер файла, если сервер поддерживает Range; иначе None.
+    """
+    with urllib.request.urlopen(_request(url, headers, 0, 0), timeout=timeout) as resp:
+        if resp.status != 206:
+            return None
+        content_range = resp.headers.get("Content-Range", "")
+    # "bytes 0-0/12345"
+    total = content_range.rpartition("/")[2]
+    return int(total) if total.isdigit() else None
+
+
+def _fetch_chunk(
+    url: str,
+    headers: Optional[Dict[str, str]],
+    dest: Path,
+    start: int,
+    end: int,
+    timeout: float,
+    on_bytes: Callable[[int], None],
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> int:
+    last_error: Optional[Exception] = None
+    for _ in range(_ATTEMPTS):
+        pos = start
+        try:
+            with urllib.request.urlopen(_request(url, headers, pos, end), timeout=timeout) as resp:
+                if resp.status != 206:
+                    raise OSError(f"range request returned HTTP {resp.status}")
+                # отдельный дескриптор на чанк: потоки не делят позицию файла
+                with open(dest, "r+b") as f:
+                    f.seek(pos)
+                    while pos <= end:
+                        if should_stop is not None and should_stop():
+                            raise Interrupted(f"stopped at byte {pos} of chunk {start}-{end}")
+                        block = resp.read(min(_READ_SIZE, end - pos + 1))
+                        if not block:
+                            break
+                        f.write(block)
+                        pos += len(block)
+                        on_bytes(len(block))
+            if pos > end:
+                return end - start + 1
+            raise OSError(f"short read at byte {pos} of chunk {start}-{end}")
+        except OSError as e:
+            last_error = e
+    raise last_error  # type: ignore[misc]
+
+
+def _journal(part: Path) -> Path:
+    return part.with_name(part.name + JOURNAL_SUFFIX)
+
+
+def _read_journal(part: Path) -> Optional[Tuple[int, int, Set[int]]]:
+    # (размер, chunk_size, начала готовых чанков); None — журнала нет или он битый
+    try:
+        lines = _journal(part).read_text().split()
+        total_size, chunk_size = int(lines[0]), int(lines[1])
+        return total_size, chunk_size, {int(x) for x in lines[2:]}
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def journal_bytes(part: Path) -> Optional[int]:
+    """
+    Сколько байт недокачанного .part уже на месте (по журналу докачки).
+    None — это не .part от download_ranges: его размер и есть прогресс.
+    """
+    journal = _read_journal(part)
+    if journal is None:
+        return None
+    total_size, chunk_size, done = journal
+    return sum(min(start + chunk_size, total_size) - start for start in done)
+
+
+def download_ranges(
+    url: str,
+    dest: Path,
+    headers: Optional[Dict[str, str]] = None,
+    connections: int = 4,
+    total_size: Optional[int] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    timeout: float = 30,
+    progress: Optional[Callable[[int, int], None]] = None,
+    should_stop: Optional[Callable[[], bool]] = None,
+) -> int:
+    """
+    Скачивает url в dest, разбивая файл на чанки по chunk_size, которые
+    забирают connections потоков (быстрое соединение возьмёт больше чанков).
+    Пишет в dest.part и переименовывает по завершении. Возвращает размер.
+    progress(скачано, всего) вызывается из потоков загрузки.
+
+    Готовые чанки отмечаются в журнале рядом с .part. Если should_stop()
+    вернул True, бросается Interrupted, а .part с журналом остаются:
+    следующий вызов с тем же dest докачает только недостающие чанки.
+    При любой другой ошибке оба файла удаляются.
+    """
+    if total_size is None:
+        total_size = probe_size(url, headers, timeout=timeout)
+        if total_size is None:
+            raise OSError("server does not support range requests")
+
+    chunk_size = max(1, chunk_size)
+    part = dest.with_name(dest.name + ".part")
+    journal = _read_journal(part)
+    finished: Set[int] = set()
+    if journal is not None and journal[:2] == (total_size, chunk_size) and part.exists():
+        finished = journal[2]
+    else:
+        with open(part, "wb") as f:
+            f.truncate(total_size)
+        _journal(part).write_text(f"{total_size} {chunk_size}\n")
+
+    ranges = [
+        (start, min(start + chunk_size, total_size) - 1)
+        for start in range(0, total_size, chunk_size)
+        if start not in finished
+    ]
+    done = total_size - sum(end - start + 1 for start, end in ranges)
+    received = done
+    lock = threading.Lock()
+    log = open(_journal(part), "a")
+    # ошибка в одном чанке останавливает остальные на ближайшем блоке
+    failed = threading.Event()
+
+    def _stopped() -> bool:
+        return failed.is_set() or (should_stop is not None and should_stop())
+
+    def _on_bytes(n: int) -> None:
+        nonlocal received
+        with lock:
+            # повторные попытки чанка считаются заново — это лишь индикатор
+            received = min(total_size, received + n)
+            if progress is not None:
+                # под замком: колбэк (и его фильтр) не вызываются параллельно
+                progress(received, total_size)
+
+    def _worker(r):
+        nonlocal done
+        n = _fetch_chunk(url, headers, part, r[0], r[1], timeout, _on_bytes, _stopped)
+        with lock:
+            done += n
+            log.write(f"{r[0]}\n")
+            log.flush()
+
+    pool = ThreadPoolExecutor(max_workers=max(1, min(connections, len(ranges))))
+    try:
+        for fut in [pool.submit(_worker, r) for r in ranges]:
+            fut.result()
+    except Interrupted:
+        # остановка: дописанные чанки уже в журнале, остальные докачаем
+        pool.shutdown(wait=True, cancel_futures=True)
+        log.close()
+        raise
+    except BaseException:
+        # файл всё равно битый: невзятые чанки отменяем, идущие прерываются
+        # на следующем блоке; их дожидаемся, чтобы никто не писал в .part
+        # после удаления (или в новый .part повторной попытки)
+        failed.set()
+        pool.shutdown(wait=True, cancel_futures=True)
+        log.close()
+        part.unlink(missing_ok=True)
+        _journal(part).unlink(missing_ok=True)
+        raise
+    pool.shutdown()
+    log.close()
+
+    os.replace(part, dest)
+    _journal(part).unlink(missing_ok=True)
+    return done
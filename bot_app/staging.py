@@ -0,0 +1,171 @@
+# bot_app/staging.py
+import os
+import time
+import errno
+import shutil
+import logging
+from pathlib import Path
+from typing import Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Итоговая директория готовых файлов
+FINAL_DIR = Path(os.getenv("DOWNLOADS_DIR", "./data/downloads")).resolve()
+# Куда yt-dlp пишет файлы до публикации. По умолчанию — внутри FINAL_DIR,
+# т.е. на той же ФС: публикация — это один os.replace без копирования
+STAGING_DIR = Path(os.getenv("DOWNLOAD_STAGING_DIR", str(FINAL_DIR / ".staging"))).resolve()
+# Файлы без ID загрузки в имени (служебные файлы yt-dlp) считаются
+# брошенными, если не менялись столько секунд
+ORPHAN_MAX_AGE = float(os.getenv("STAGING_ORPHAN_MAX_AGE", "3600"))
+
+# Ошибки copy_file_range, после которых пробуем sendfile
+_NO_COPY_RANGE = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.EPERM}
+
+# Определяется в prepare(): None — ещё не проверяли
+_cross_device: Optional[bool] = None
+
+
+# ------------------------------------------------------------
+# Проверка при старте
+# ------------------------------------------------------------
+def prepare() -> bool:
+    """
+    Создаёт директории и проверяет, лежат ли STAGING_DIR и FINAL_DIR
+    на одной ФС. Возвращает True, если публикация пойдёт через копирование.
+    """
+    global _cross_device
+    FINAL_DIR.mkdir(parents=True, exist_ok=True)
+    STAGING_DIR.mkdir(parents=True, exist_ok=True)
+    _cross_device = STAGING_DIR.stat().st_dev != FINAL_DIR.stat().st_dev
+    if _cross_device:
+        logger.warning(
+            "staging dir %s is on another filesystem than %s: "
+            "finished files will be copied (copy_file_range/sendfile)",
+            STAGING_DIR,
+            FINAL_DIR,
+        )
+    return _cross_device
+
+
+# ------------------------------------------------------------
+# Публикация готового файла
+# ------------------------------------------------------------
+def publish(src: Path, dest_dir: Path = FINAL_DIR) -> Path:
+    """
+    Переносит файл из staging в dest_dir атомарно: читатели видят либо
+    старое состояние, либо полный файл. На одной ФС — os.replace;
+    между ФС — копия ядром во временный .part и os.replace.
+    """
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    dest = dest_dir / src.name
+    if not _cross_device:
+        try:
+            os.replace(src, dest)
+            return dest
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+
+    part = dest.with_name(dest.name + ".part")
+    try:
+        zero_copy(src, part)
+        os.replace(part, dest)
+    except BaseException:
+        part.unlink(missing_ok=True)
+        raise
+    src.unlink()
+    return dest
+
+
+def zero_copy(src: Path, dst: Path) -> int:
+    """
+    Копирует файл без прохода данных через user space:
+    copy_file_range (Linux 4.5+, между ФС — 5.3+), иначе sendfile,
+    иначе обычное копирование. Возвращает число байт.
+    """
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        size = os.fstat(fsrc.fileno()).st_size
+        try:
+            return _copy_fd(fsrc.fileno(), fdst.fileno(), size)
+        except OSError as e:
+            if e.errno not in _NO_COPY_RANGE:
+                raise
+        # ни один системный вызов не подошёл
+        fsrc.seek(0)
+        fdst.seek(0)
+        fdst.truncate()
+        shutil.copyfileobj(fsrc, fdst, 1024 * 1024)
+        return size
+
+
+def _copy_fd(src_fd: int, dst_fd: int, size: int) -> int:
+    copy_range = getattr(os, "copy_file_range", None)
+    sendfile = getattr(os, "sendfile", None)
+    if copy_range is None and sendfile is None:
+        raise OSError(errno.ENOSYS, "no zero-copy syscall available")
+
+    offset = 0
+    while offset < size:
+        if copy_range is not None:
+            try:
+                # без явных offset: сдвигаются позиции обоих дескрипторов
+                n = copy_range(src_fd, dst_fd, size - offset)
+            except OSError as e:
+                if e.errno not in _NO_COPY_RANGE or sendfile is None:
+                    raise
+                copy_range = None
+                continue
+        else:
+            # позиция dst сдвигается, src читается с явного offset
+            n = sendfile(dst_fd, src_fd, offset, size - offset)
+        if n == 0:
+            raise OSError(errno.EIO, f"source truncated at byte {offset} of {size}")
+        offset += n
+    return offset
+
+
+# ------------------------------------------------------------
+# Уборка брошенных файлов
+# ------------------------------------------------------------
+def _download_id(name: str) -> Optional[int]:
+    # yt-dlp пишет "<id>.mp4", "<id>.f137.mp4", "<id>.mp4.part", "<id>.temp.mp4"…
+    head = name.split(".", 1)[0]
+    return int(head) if head.isdigit() else None
+
+
+def cleanup_orphans(active_ids: Iterable[int], max_age: float = ORPHAN_MAX_AGE) -> int:
+    """
+    Удаляет из STAGING_DIR файлы загрузок, которых нет среди active_ids
+    (pending/processing — их ещё докачают), служебные файлы старше max_age
+    и недокопированные .part в FINAL_DIR. Возвращает число удалённых файлов.
+    """
+    active = set(active_ids)
+    now = time.time()
+    removed = 0
+
+    candidates = []
+    if STAGING_DIR.is_dir():
+        candidates.extend(p for p in STAGING_DIR.iterdir() if p.is_file())
+    if FINAL_DIR.is_dir():
+        candidates.extend(p for p in FINAL_DIR.glob("*.part") if p.is_file())
+
+    for path in candidates:
+        download_id = _download_id(path.name)
+        try:
+            if download_id is not None:
+                if download_id in active:
+                    continue
+            elif now - path.stat().st_mtime < max_age:
+                # может принадлежать живому процессу-соседу
+                continue
+            path.unlink()
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError:
+            logger.warning("cannot remove orphaned file %s", path, exc_info=True)
+    return removed
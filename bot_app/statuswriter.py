@@ -0,0 +1,181 @@
+# bot_app/statuswriter.py
+import os
+import asyncio
+import logging
+from contextlib import suppress
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import update
+from sqlalchemy.orm import sessionmaker
+
+from .db import AsyncSessionLocal
+from .models import Download
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# Сколько секунд копим переходы статусов перед записью (group commit)
+STATUS_FLUSH_INTERVAL = float(os.getenv("STATUS_FLUSH_INTERVAL", "0.005"))
+# Пачка уходит сразу, как только в ней столько переходов
+STATUS_FLUSH_BATCH = int(os.getenv("STATUS_FLUSH_BATCH", "64"))
+
+
+# (download_id, owner): изменения строки склеиваются только с такими же условиями
+_Key = Tuple[int, Optional[str]]
+_Pending = Tuple[_Key, Dict[str, Any], asyncio.Future]
+
+
+def _update(owner: Optional[str]) -> Any:
+    stmt = update(Download)
+    if owner is None:
+        return stmt
+    # доп. условие к UPDATE по первичному ключу: объекты в сессии не
+    # синхронизируем (их там нет — сессия живёт одну пачку)
+    return stmt.where(Download.worker_id == owner).execution_options(synchronize_session=None)
+
+
+# ------------------------------------------------------------
+# Group commit переходов статуса downloads
+# ------------------------------------------------------------
+class StatusWriter:
+    """
+    Собирает изменения строк downloads от всех воркеров и пишет их пачками:
+    одна транзакция (и один commit/fsync) на пачку вместо отдельной
+    транзакции на каждый переход processing -> done/failed.
+
+    write() возвращается, когда пачка с его изменением зафиксирована, —
+    вызывающий может сразу читать строку (например, для доставки).
+    Несколько изменений одной строки в пачке склеиваются по порядку.
+    Запись с owner применяется, только если строку всё ещё держит этот
+    воркер (worker_id == owner): задачу, lease которой истёк и которую
+    уже забрал другой воркер, старый владелец не перезапишет.
+    Если пачка не записалась, её строки пишутся по одной: исключение
+    получают только writer'ы строки, которая не записывается и одна.
+    """
+
+    def __init__(
+        self,
+        interval: float = STATUS_FLUSH_INTERVAL,
+        batch: int = STATUS_FLUSH_BATCH,
+        session_factory: sessionmaker = AsyncSessionLocal,
+    ) -> None:
+        self.interval = interval
+        self.batch = max(1, batch)
+        self.session_factory = session_factory
+        self._pending: List[_Pending] = []
+        self._wakeup: Optional[asyncio.Event] = None
+        self._full: Optional[asyncio.Event] = None
+        self._flusher: Optional[asyncio.Task] = None
+        # статистика (для бенчмарка и логов)
+        self.writes = 0
+        self.batches = 0
+
+    async def write(self, download_id: int, *, owner: Optional[str] = None, **values: Any) -> None:
+        """
+        UPDATE downloads SET **values WHERE id = download_id
+        [AND worker_id = owner] — в ближайшей пачке.
+        """
+        fut = asyncio.get_running_loop().create_future()
+        self._pending.append(((download_id, owner), values, fut))
+        if self._flusher is None or self._flusher.done():
+            self._wakeup = asyncio.Event()
+            self._full = asyncio.Event()
+            self._flusher = asyncio.create_task(self._flush_loop(), name="status-writer")
+        self._wakeup.set()
+        if len(self._pending) >= self.batch:
+            self._full.set()
+        await fut
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if len(self._pending) < self.batch and self.interval > 0:
+                # ждём попутчиков, но не дольше interval
+                self._full.clear()
+                with suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._full.wait(), timeout=self.interval)
+            while self._pending:
+                await self._flush()
+
+    async def _flush(self) -> None:
+        items, self._pending = self._pending[: self.batch], self._pending[self.batch:]
+        rows: Dict[_Key, Dict[str, Any]] = {}
+        for key, values, _ in items:
+            rows.setdefault(key, {"id": key[0]}).update(values)
+        by_owner: Dict[Optional[str], List[Dict[str, Any]]] = {}
+        for (_, owner), values in rows.items():
+            by_owner.setdefault(owner, []).append(values)
+
+        try:
+            async with self.session_factory() as session:
+                # ORM bulk UPDATE по первичному ключу: executemany по группам
+                # одинаковых наборов колонок
+                for owner, params in by_owner.items():
+                    await session.execute(_update(owner), params)
+                await session.commit()
+        except asyncio.CancelledError:
+            # остановка посреди записи: UPDATE идемпотентен, close() повторит пачку
+            self._pending[:0] = items
+            raise
+        except Exception as e:
+            if len(rows) == 1:
+                logger.exception("status update of download %s failed", next(iter(rows))[0])
+                self._resolve(items, {key: e for key in rows})
+                return
+            logger.warning("status batch of %s update(s) failed, retrying one by one: %r", len(items), e)
+            await self._flush_each(items, rows)
+            return
+
+        self.writes += len(items)
+        self.batches += 1
+        self._resolve(items, {})
+
+    async def _flush_each(self, items: List[_Pending], rows: Dict[_Key, Dict[str, Any]]) -> None:
+        # каждая строка — своя транзакция: ошибка одной не задевает остальные
+        errors: Dict[_Key, Exception] = {}
+        try:
+            for key, values in rows.items():
+                try:
+                    async with self.session_factory() as session:
+                        await session.execute(_update(key[1]), [values])
+                        await session.commit()
+                except Exception as e:
+                    logger.exception("status update of download %s failed", key[0])
+                    errors[key] = e
+                else:
+                    self.batches += 1
+        except asyncio.CancelledError:
+            # как и для пачки: UPDATE идемпотентен, close() повторит всё
+            self._pending[:0] = items
+            raise
+        self.writes += sum(1 for key, _, _ in items if key not in errors)
+        self._resolve(items, errors)
+
+    @staticmethod
+    def _resolve(items: List[_Pending], errors: Dict[_Key, Exception]) -> None:
+        for key, _, fut in items:
+            if fut.done():
+                continue
+            if key in errors:
+                fut.set_exception(errors[key])
+            else:
+                fut.set_result(None)
+
+    async def close(self) -> None:
+        """
+        Дописывает накопленное и останавливает фоновую задачу.
+        """
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        while self._pending:
+            await self._flush()
+
+
+# Общий экземпляр процесса
+status_writer = StatusWriter()
@@ -0,0 +1,264 @@
+# bot_app/storage.py
+import os
+import logging
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor, Future
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram.types import FSInputFile, InputFile, URLInputFile
+
+from .staging import FINAL_DIR, publish
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры
+# ------------------------------------------------------------
+# STORAGE_BACKEND:
+#   local — файлы в DOWNLOADS_DIR, отдаёт только этот хост (как раньше)
+#   s3    — S3-совместимое хранилище (AWS, MinIO…), общее для всех узлов
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "downloads/")
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+S3_REGION = os.getenv("S3_REGION") or None
+# Размер части multipart (S3 требует не меньше 5 MiB, кроме последней)
+S3_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("S3_PART_SIZE", str(8 * 1024 * 1024))))
+# Сколько частей одного файла грузится одновременно; в памяти держим
+# не больше S3_UPLOAD_CONCURRENCY буферов по S3_PART_SIZE
+S3_UPLOAD_CONCURRENCY = int(os.getenv("S3_UPLOAD_CONCURRENCY", "4"))
+# Срок жизни presigned URL, по которому Telegram-клиент бота забирает файл
+S3_PRESIGN_TTL = int(os.getenv("S3_PRESIGN_TTL", "3600"))
+
+
+def is_remote(location: str) -> bool:
+    return "://" in location
+
+
+# ------------------------------------------------------------
+# Интерфейс хранилища
+# ------------------------------------------------------------
+class Storage(ABC):
+    """
+    Куда публикуются готовые файлы. Download.file_path хранит location,
+    который вернул publish(): локальный путь или URI объекта.
+    Методы синхронные (файловые/сетевые операции) — из event loop
+    их вызывают через asyncio.to_thread.
+    """
+
+    @abstractmethod
+    def publish(self, src: Path) -> str:
+        """
+        Переносит готовый файл из staging в хранилище, возвращает location.
+        """
+
+    @abstractmethod
+    def exists(self, location: str) -> bool:
+        ...
+
+    @abstractmethod
+    def delete(self, location: str) -> None:
+        ...
+
+    @abstractmethod
+    def input_file(self, location: str) -> InputFile:
+        """
+        Файл для send_video.
+        """
+
+
+class LocalStorage(Storage):
+    def __init__(self, root: Path = FINAL_DIR) -> None:
+        self.root = root
+
+    def publish(self, src: Path) -> str:
+        return str(publish(src, self.root))
+
+    def exists(self, location: str) -> bool:
+        return Path(location).exists()
+
+    def delete(self, location: str) -> None:
+        Path(location).unlink(missing_ok=True)
+
+    def input_file(self, location: str) -> InputFile:
+        return FSInputFile(location)
+
+
+# ------------------------------------------------------------
+# S3-совместимое хранилище
+# ------------------------------------------------------------
+class S3Storage(Storage):
+    """
+    client — boto3 S3 client или любой объект с теми же методами
+    (put_object, create_multipart_upload, upload_part,
+    complete_multipart_upload, abort_multipart_upload, head_object,
+    delete_object, generate_presigned_url), например in-process fake.
+    """
+
+    def __init__(
+        self,
+        bucket: str = S3_BUCKET,
+        prefix: str = S3_PREFIX,
+        client: Any = None,
+        part_size: int = S3_PART_SIZE,
+        concurrency: int = S3_UPLOAD_CONCURRENCY,
+        presign_ttl: int = S3_PRESIGN_TTL,
+    ) -> None:
+        if not bucket:
+            raise RuntimeError("S3_BUCKET is not set")
+        if client is None:
+            # boto3 нужен только для STORAGE_BACKEND=s3 и не грузится при импорте
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("STORAGE_BACKEND=s3 requires boto3 (pip install boto3)") from None
+            client = boto3.client("s3", endpoint_url=S3_ENDPOINT_URL, region_name=S3_REGION)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = client
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.presign_ttl = presign_ttl
+        # общий пул для частей всех загрузок; лимит памяти — на каждый файл
+        self._pool = ThreadPoolExecutor(max_workers=self.concurrency * 2, thread_name_prefix="s3-part")
+
+    # ---------------- location ----------------
+    def _location(self, key: str) -> str:
+        return f"s3://{self.bucket}/{key}"
+
+    def _split(self, location: str) -> Tuple[str, str]:
+        bucket, _, key = location[len("s3://"):].partition("/")
+        return bucket, key
+
+    # ---------------- публикация ----------------
+    def publish(self, src: Path) -> str:
+        key = self.prefix + src.name
+        size = src.stat().st_size
+        if size <= self.part_size:
+            with open(src, "rb") as f:
+                self.client.put_object(Bucket=self.bucket, Key=key, Body=f.read())
+        else:
+            self._multipart(src, key)
+        src.unlink()
+        return self._location(key)
+
+    def _multipart(self, src: Path, key: str) -> None:
+        """
+        Читает файл частями и грузит до concurrency частей параллельно.
+        Следующая часть читается только когда освободился слот, поэтому
+        в памяти не больше concurrency буферов.
+        """
+        upload_id = self.client.create_multipart_upload(Bucket=self.bucket, Key=key)["UploadId"]
+        slots = threading.BoundedSemaphore(self.concurrency)
+        futures: List[Future] = []
+        try:
+            with open(src, "rb") as f:
+                number = 0
+                while True:
+                    slots.acquire()
+                    if any(fut.done() and fut.exception() for fut in futures):
+                        slots.release()
+                        break
+                    body = f.read(self.part_size)
+                    if not body:
+                        slots.release()
+                        break
+                    number += 1
+                    fut = self._pool.submit(self._upload_part, key, upload_id, number, body)
+                    fut.add_done_callback(lambda _: slots.release())
+                    futures.append(fut)
+            parts = [fut.result() for fut in futures]
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={"Parts": parts},
+            )
+        except BaseException:
+            for fut in futures:
+                fut.cancel()
+            try:
+                self.client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+            except Exception:
+                logger.warning("cannot abort multipart upload of %s", key, exc_info=True)
+            raise
+
+    def _upload_part(self, key: str, upload_id: str, number: int, body: bytes) -> Dict[str, Any]:
+        resp = self.client.upload_part(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=number,
+            Body=body,
+        )
+        return {"ETag": resp["ETag"], "PartNumber": number}
+
+    # ---------------- доступ ----------------
+    def exists(self, location: str) -> bool:
+        bucket, key = self._split(location)
+        try:
+            self.client.head_object(Bucket=bucket, Key=key)
+        except Exception as e:
+            if _is_not_found(e):
+                return False
+            raise
+        return True
+
+    def delete(self, location: str) -> None:
+        bucket, key = self._split(location)
+        self.client.delete_object(Bucket=bucket, Key=key)
+
+    def input_file(self, location: str) -> InputFile:
+        # Bot API не читает из S3 сам: aiogram стримит объект по presigned URL
+        bucket, key = self._split(location)
+        url = self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket, "Key": key},
+            ExpiresIn=self.presign_ttl,
+        )
+        return URLInputFile(url, filename=Path(key).name)
+
+
+def _is_not_found(e: Exception) -> bool:
+    # botocore.exceptions.ClientError: response["Error"]["Code"]
+    code = str(getattr(e, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+# ------------------------------------------------------------
+# Выбор хранилища
+# ------------------------------------------------------------
+_storage: Optional[Storage] = None
+_local = LocalStorage()
+
+
+def get_storage() -> Storage:
+    global _storage
+    if _storage is None:
+        if STORAGE_BACKEND == "s3":
+            _storage = S3Storage()
+        elif STORAGE_BACKEND == "local":
+            _storage = _local
+        else:
+            raise ValueError(f"unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+    return _storage
+
+
+def storage_for(location: str) -> Storage:
+    """
+    Хранилище, в котором лежит location. Локальные пути, записанные до
+    переключения STORAGE_BACKEND, остаются доступны.
+    """
+    return get_storage() if is_remote(location) else _local
+
+
+def set_storage(storage: Storage) -> None:
+    """
+    Подменить хранилище (например, S3Storage с fake-клиентом).
+    """
+    global _storage
+    _storage = storage
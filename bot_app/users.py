@@ -0,0 +1,73 @@
+# bot_app/users.py
+import os
+from collections import OrderedDict
+
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.future import select
+
+from .db import AsyncSessionLocal, dialect_insert
+from .models import User
+
+
+# ------------------------------------------------------------
+# telegram_id -> users.id
+# ------------------------------------------------------------
+# Пользователи не удаляются и id не меняется, поэтому кеш не устаревает;
+# размер ограничен USER_CACHE_SIZE записей, вытеснение — LRU
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+
+_ids: "OrderedDict[int, int]" = OrderedDict()
+
+
+def _remember(telegram_id: int, user_id: int) -> int:
+    _ids[telegram_id] = user_id
+    _ids.move_to_end(telegram_id)
+    while len(_ids) > USER_CACHE_SIZE:
+        _ids.popitem(last=False)
+    return user_id
+
+
+async def get_or_create_user_id(telegram_id: int) -> int:
+    """
+    Возвращает users.id, при необходимости создавая пользователя.
+    Попадание в кеш — без запросов; иначе INSERT … ON CONFLICT DO NOTHING
+    RETURNING id (новый пользователь — один запрос), а если строка уже была —
+    SELECT id. Коллекция downloads не загружается.
+    Запись фиксируется сразу, чтобы в кеш не попал id откатившейся транзакции.
+    """
+    user_id = _ids.get(telegram_id)
+    if user_id is not None:
+        _ids.move_to_end(telegram_id)
+        return user_id
+
+    async with AsyncSessionLocal() as session:
+        stmt = dialect_insert(User)
+        if stmt is not None:
+            q = await session.execute(
+                stmt.values(telegram_id=telegram_id)
+                .on_conflict_do_nothing(index_elements=[User.telegram_id])
+                .returning(User.id)
+            )
+            user_id = q.scalar_one_or_none()
+            await session.commit()
+        else:
+            user_id = None
+
+        if user_id is None:
+            q = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+            user_id = q.scalar_one_or_none()
+
+        if user_id is None:
+            # диалект без ON CONFLICT
+            user = User(telegram_id=telegram_id)
+            session.add(user)
+            try:
+                await session.commit()
+                user_id = user.id
+            except IntegrityError:
+                # параллельный запрос успел создать пользователя
+                await session.rollback()
+                q = await session.execute(select(User.id).where(User.telegram_id == telegram_id))
+                user_id = q.scalar_one()
+
+    return _remember(telegram_id, user_id)
@@ -1,9 +1,92 @@
 import re
-from typing import List
+from typing import List, Optional
+from urllib.parse import parse_qs, urlparse
 
 URL_RE = re.compile(r"https?://[^\s]+")
 
+# 11-символьный YouTube ID
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
 def extract_urls(text: str) -> List[str]:
     if not text:
         return []
     return URL_RE.findall(text)
+
+
+def extract_video_id(url: str) -> Optional[str]:
+    """
+    Канонический ID видео YouTube из любой формы ссылки
+    (watch?v=, youtu.be/, shorts/, embed/, live/). None — если не распознали.
+    """
+    if not url:
+        return None
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host.startswith("m."):
+        host = host[2:]
+
+    candidate: Optional[str] = None
+    if host == "youtu.be":
+        candidate = parsed.path.lstrip("/").split("/", 1)[0]
+    elif host in ("youtube.com", "music.youtube.com", "youtube-nocookie.com"):
+        if parsed.path == "/watch":
+            candidate = (parse_qs(parsed.query).get("v") or [None])[0]
+        else:
+            parts = parsed.path.strip("/").split("/")
+            if len(parts) >= 2 and parts[0] in ("shorts", "embed", "live", "v"):
+                candidate = parts[1]
+
+    if candidate and _VIDEO_ID_RE.match(candidate):
+        return candidate
+    return None
+
+
+# Пути каналов (кроме /@handle), которые yt-dlp разворачивает в список видео
+_CHANNEL_SECTIONS = ("channel", "c", "user")
+
+
+def is_playlist_url(url: str) -> bool:
+    """
+    Ссылка на плейлист или канал (а не на одно видео).
+    watch?v=…&list=… считаем ссылкой на видео: пользователь открыл ролик.
+    """
+    if not url or extract_video_id(url):
+        return False
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    host = (parsed.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[4:]
+    if host.startswith("m."):
+        host = host[2:]
+    if host not in ("youtube.com", "music.youtube.com"):
+        return False
+    if parsed.path == "/playlist":
+        return bool(parse_qs(parsed.query).get("list"))
+    first = parsed.path.strip("/").split("/", 1)[0]
+    return bool(first) and (first.startswith("@") or first in _CHANNEL_SECTIONS)
+
+
+def format_duration(seconds: Optional[float]) -> str:
+    if not seconds:
+        return "—"
+    seconds = int(seconds)
+    h, rest = divmod(seconds, 3600)
+    m, s = divmod(rest, 60)
+    return f"{h}:{m:02d}:{s:02d}" if h else f"{m}:{s:02d}"
+
+
+def format_size(size: Optional[float]) -> str:
+    if not size:
+        return "—"
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GB"
@@ -0,0 +1,194 @@
+# bot_app/web.py
+import os
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot, Dispatcher
+from fastapi import FastAPI, Request, Response
+from sqlalchemy import text
+
+from . import metrics
+from .bot import dp
+from .db import AsyncSessionLocal
+from .outbox import outbox
+
+logger = logging.getLogger(__name__)
+
+
+# ------------------------------------------------------------
+# Параметры (BOT_MODE=webhook, см. main.py)
+# ------------------------------------------------------------
+# Публичный адрес, на который Telegram шлёт обновления (без пути);
+# пусто — webhook не регистрируем (например, за внешним прокси он уже задан)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+# Сверяется с заголовком X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Сколько принятых, но ещё не обработанных обновлений держим в памяти;
+# при переполнении отвечаем 503 и Telegram повторит доставку позже
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько обновлений обрабатывается одновременно
+WEBHOOK_CONSUMERS = int(os.getenv("WEBHOOK_CONSUMERS", "16"))
+# Через сколько секунд Telegram стоит повторить, если очередь полна
+WEBHOOK_RETRY_AFTER = int(os.getenv("WEBHOOK_RETRY_AFTER", "1"))
+
+
+# ------------------------------------------------------------
+# Приём обновлений: ограниченная очередь + пул обработчиков
+# ------------------------------------------------------------
+class UpdateIngress:
+    """
+    HTTP-обработчик только кладёт обновление в очередь и сразу отвечает;
+    consumers задач разбирают её и передают в Dispatcher.
+    Переполненная очередь — сигнал backpressure (503), а не рост памяти.
+    """
+
+    def __init__(
+        self,
+        bot: Bot,
+        dispatcher: Dispatcher = dp,
+        maxsize: int = WEBHOOK_QUEUE_SIZE,
+        consumers: int = WEBHOOK_CONSUMERS,
+    ) -> None:
+        self.bot = bot
+        self.dispatcher = dispatcher
+        self.consumers = max(1, consumers)
+        self._queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max(1, maxsize))
+        self._tasks: List[asyncio.Task] = []
+        self.accepted = 0
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return bool(self._tasks) and all(not t.done() for t in self._tasks)
+
+    @property
+    def backlog(self) -> int:
+        return self._queue.qsize()
+
+    @property
+    def full(self) -> bool:
+        return self._queue.full()
+
+    def offer(self, update: Dict[str, Any]) -> bool:
+        try:
+            self._queue.put_nowait(update)
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+        self.accepted += 1
+        return True
+
+    def start(self) -> None:
+        for i in range(self.consumers):
+            self._tasks.append(asyncio.create_task(self._consume(), name=f"webhook-consumer-{i}"))
+
+    async def stop(self, drain_timeout: float = 10) -> None:
+        # даём дообработать уже принятое (Telegram его повторно не пришлёт)
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning("webhook stop: %s update(s) dropped", self._queue.qsize())
+        for t in self._tasks:
+            t.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    async def _consume(self) -> None:
+        while True:
+            update = await self._queue.get()
+            try:
+                await self.dispatcher.feed_raw_update(self.bot, update)
+            except Exception:
+                logger.exception("failed to process update %s", update.get("update_id"))
+            finally:
+                self._queue.task_done()
+
+
+# ------------------------------------------------------------
+# Readiness
+# ------------------------------------------------------------
+async def _db_ready() -> bool:
+    try:
+        async with AsyncSessionLocal() as session:
+            await session.execute(text("SELECT 1"))
+        return True
+    except Exception:
+        logger.warning("readiness: database is unavailable", exc_info=True)
+        return False
+
+
+# ------------------------------------------------------------
+# Метрики Prometheus
+# ------------------------------------------------------------
+async def metrics_response() -> Response:
+    if not metrics.METRICS_ENABLED:
+        return Response(status_code=404)
+    return Response(await metrics.REGISTRY.collect(), media_type=metrics.CONTENT_TYPE)
+
+
+def create_metrics_app() -> FastAPI:
+    """
+    Только /metrics и /healthz — для режима polling, где webhook-сервера нет.
+    """
+    app = FastAPI(docs_url=None, redoc_url=None, openapi_url=None)
+    app.add_api_route("/metrics", metrics_response, methods=["GET"])
+    app.add_api_route("/healthz", _healthz, methods=["GET"])
+    return app
+
+
+async def _healthz() -> Dict[str, Any]:
+    # процесс жив и event loop отвечает
+    return {"status": "ok"}
+
+
+# ------------------------------------------------------------
+# FastAPI-приложение
+# ------------------------------------------------------------
+def create_app(bot: Bot, dispatcher: Dispatcher = dp, ingress: Optional[UpdateIngress] = None) -> FastAPI:
+    ingress = ingress or UpdateIngress(bot, dispatcher)
+
+    @asynccontextmanager
+    async def lifespan(app: FastAPI):
+        ingress.start()
+        try:
+            yield
+        finally:
+            await ingress.stop()
+
+    app = FastAPI(lifespan=lifespan, docs_url=None, redoc_url=None, openapi_url=None)
+    app.state.ingress = ingress
+
+    @app.post(WEBHOOK_PATH)
+    async def telegram_webhook(request: Request) -> Response:
+        if WEBHOOK_SECRET and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+            return Response(status_code=401)
+        try:
+            update = await request.json()
+        except ValueError:
+            return Response(status_code=400)
+        if not isinstance(update, dict):
+            return Response(status_code=400)
+        if not ingress.offer(update):
+            return Response(status_code=503, headers={"Retry-After": str(WEBHOOK_RETRY_AFTER)})
+        return Response(status_code=200)
+
+    app.add_api_route("/healthz", _healthz, methods=["GET"])
+    app.add_api_route("/metrics", metrics_response, methods=["GET"])
+
+    @app.get("/readyz")
+    async def readyz(response: Response) -> Dict[str, Any]:
+        checks = {
+            "ingress": ingress.running and not ingress.full,
+            "outbox": outbox.running,
+            "database": await _db_ready(),
+        }
+        if not all(checks.values()):
+            response.status_code = 503
+        return {"ready": all(checks.values()), "checks": checks, "backlog": ingress.backlog}
+
+    return app
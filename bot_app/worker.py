@@ -1,119 +1,866 @@
 # bot_app/worker.py
 import os
 import asyncio
-from dataclasses import dataclass
-from datetime import datetime
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Optional
+from typing import Any, Awaitable, Dict, List, Optional, Sequence, Set, Tuple
 
+from aiogram import Bot
+from sqlalchemy import insert, update
 from sqlalchemy.future import select
 
+from . import batches, metadata, metrics, postprocess, staging
+from .cache import download_cache
+from .concurrency import AdaptiveController, AdaptiveLimiter
 from .db import AsyncSessionLocal
-from .models import Download, DownloadStatus, User
-from .downloader import run_ytdlp, move_file_to_final
+from .delivery import deliver, deliver_batch, deliver_pending_batches, get_file_id
+from .diskbudget import disk_budget
+from .outbox import outbox
+from .progress import ProgressReporter, fan_out
+from .statuswriter import status_writer
+from .jobqueue import (
+    Job,
+    LEASE_SECONDS,
+    POLL_INTERVAL,
+    WORKER_ID,
+    create_queue,
+    job_priority,
+    lease_deadline,
+)
+from .models import Batch, Download, DownloadStatus, MediaKind
+from .downloader import DOWNLOAD_TMP_DIR, format_for, move_file_to_final, partial_download, run_ytdlp
+from .storage import is_remote
+from .users import get_or_create_user_id
+from .utils import extract_video_id
 
 
 # ------------------------------------------------------------
 # Параметры очереди
 # ------------------------------------------------------------
+# Стартовое число слотов; дальше его двигает AdaptiveController
+# в пределах WORKER_CONCURRENCY_MIN..WORKER_CONCURRENCY_MAX (см. concurrency.py)
 MAX_CONCURRENT = int(os.getenv("WORKER_CONCURRENCY", "2"))
-FINAL_DIR = Path(os.getenv("DOWNLOADS_DIR", "./data/downloads")).resolve()
 
-_queue: asyncio.Queue["Job"] = asyncio.Queue()
-_semaphore = asyncio.Semaphore(MAX_CONCURRENT)
+# Сколько задач пакета вставляется одной транзакцией, пока плейлист
+# ещё разворачивается (обычные ссылки сообщения помещаются в одну)
+BATCH_ENQUEUE_CHUNK = int(os.getenv("BATCH_ENQUEUE_CHUNK", "25"))
+
+# Плавная остановка: сколько секунд идущие задачи могут доработать,
+# прежде чем их прервут с сохранением точки продолжения (см. drain)
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+
+# Сколько скачанных задач одновременно ждут или проходят обработку (ffmpeg),
+# пока их воркеры уже качают следующие. Когда места нет, воркер ждёт:
+# скачанные, но не обработанные файлы не копятся в staging
+POSTPROCESS_BACKLOG = int(os.getenv("POSTPROCESS_BACKLOG", "4"))
+
+# Бэкенд очереди выбирается QUEUE_BACKEND (см. jobqueue.py)
+_queue = create_queue()
+_limiter = AdaptiveLimiter(MAX_CONCURRENT)
+_controller = AdaptiveController(_limiter, temp_dir=DOWNLOAD_TMP_DIR)
+_limiter.set_limit(min(max(MAX_CONCURRENT, _controller.min_limit), _controller.max_limit))
+
+# Задачи-воркеры; их число следует за лимитом, чтобы очередь на БД
+# не захватывала задачи, которые некому скачивать
+_workers: Set[asyncio.Task] = set()
+_retiring = 0
+# таски взятых задач: воркер ведёт задачу до конца загрузки, обработка,
+# перенос и доставка доделываются в её таске без воркера
+_jobs: Set[asyncio.Task] = set()
+_postprocess_slots = asyncio.Semaphore(max(1, POSTPROCESS_BACKLOG))
+# идёт плавная остановка: новые задачи не берутся
+_draining = False
+
+
+# ------------------------------------------------------------
+# Single-flight: одна загрузка на видео, остальные ждут её результат
+# ------------------------------------------------------------
+FlightKey = Tuple[str, str]
 
 
 @dataclass
-class Job:
-    download_id: int
+class _Flight:
+    leader_id: int
+    # резолвится, когда лидер закончил (и доставил) — успешно или нет
+    finished: asyncio.Future
+    # статусные сообщения лидера и ведомых: прогресс идёт во все
+    reporters: List[ProgressReporter] = field(default_factory=list)
+
+
+_inflight: Dict[FlightKey, _Flight] = {}
+_followers: Set[asyncio.Task] = set()
+
+logger = logging.getLogger(__name__)
 
 
 # ------------------------------------------------------------
 # Паблик-функция: постановка задачи в очередь
 # ------------------------------------------------------------
-async def enqueue_download(user_tg_id: int, url: str) -> int:
+def _new_download(
+    user_id: int,
+    url: str,
+    chat_id: Optional[int] = None,
+    status_message_id: Optional[int] = None,
+    batch_id: Optional[int] = None,
+    kind: str = MediaKind.video.value,
+) -> Tuple[Dict[str, Any], Optional[_Flight]]:
+    """
+    Значения новой строки downloads и идущая загрузка того же видео
+    в том же виде (если есть).
+    """
+    video_id = extract_video_id(url)
+    flight = _inflight.get(_flight_key(video_id, kind)) if video_id else None
+    values: Dict[str, Any] = dict(
+        user_id=user_id,
+        chat_id=chat_id,
+        status_message_id=status_message_id,
+        batch_id=batch_id,
+        url=url,
+        video_id=video_id,
+        kind=MediaKind(kind),
+        # метаданные из prefetch (если уже готовы) определяют класс приоритета
+        priority=job_priority(metadata.metadata_cache.get(metadata.cache_key(url))),
+        status=DownloadStatus.pending,
+        leader_id=None,
+        worker_id=None,
+        lease_until=None,
+    )
+    if flight is not None:
+        # это видео уже качается — не ставим в очередь, а ждём лидера;
+        # строку сразу держим за собой, чтобы её не забрал другой воркер
+        values.update(
+            status=DownloadStatus.processing,
+            leader_id=flight.leader_id,
+            worker_id=WORKER_ID,
+            lease_until=lease_deadline(),
+        )
+    return values, flight
+
+
+async def _dispatch(download_id: int, values: Dict[str, Any], flight: Optional[_Flight]) -> None:
+    # строка уже зафиксирована: в очередь или к лидеру
+    job = Job(
+        download_id=download_id,
+        video_id=values["video_id"],
+        user_id=values["user_id"],
+        priority=values["priority"],
+        kind=values["kind"].value,
+    )
+    if flight is not None:
+        _add_reporter(flight.reporters, values["chat_id"], values["status_message_id"])
+        _spawn_follower(job, flight.leader_id, flight.finished)
+        metrics.JOBS_ENQUEUED.labels("follower").inc()
+    else:
+        await _queue.put(job)
+        metrics.JOBS_ENQUEUED.labels("queued").inc()
+
+
+@metrics.timed(metrics.ENQUEUE_SECONDS)
+async def enqueue_download(
+    user_tg_id: int,
+    url: str,
+    chat_id: Optional[int] = None,
+    status_message_id: Optional[int] = None,
+    kind: str = MediaKind.video.value,
+) -> int:
     """
     Создаёт запись Download со статусом pending и ставит задачу в очередь.
+    chat_id — куда отправить готовый файл (по умолчанию личка пользователя).
+    status_message_id — сообщение в chat_id, в котором показывать прогресс.
+    kind — "video" или "audio" (только звук).
     Возвращает ID загрузки.
     """
+    # убеждаемся, что пользователь существует (обычно — из кеша, без запроса)
+    user_id = await get_or_create_user_id(user_tg_id)
+
+    values, flight = _new_download(user_id, url, chat_id, status_message_id, kind=kind)
     async with AsyncSessionLocal() as session:
-        # убеждаемся, что пользователь существует
-        q = await session.execute(select(User).where(User.telegram_id == user_tg_id))
-        user = q.scalar_one_or_none()
-        if user is None:
-            user = User(telegram_id=user_tg_id)
-            session.add(user)
-            await session.flush()
-
-        d = Download(user_id=user.id, url=url, status=DownloadStatus.pending)
+        d = Download(**values)
         session.add(d)
         await session.commit()
+    await _dispatch(d.id, values, flight)
+    return d.id
+
+
+async def _enqueue_chunk(
+    user_id: int,
+    chat_id: Optional[int],
+    batch_id: int,
+    urls: Sequence[str],
+    kind: str,
+) -> int:
+    """
+    Задачи пакета одним INSERT … RETURNING (executemany) в одной транзакции.
+    """
+    prepared = [_new_download(user_id, url, chat_id, batch_id=batch_id, kind=kind) for url in urls]
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            insert(Download).returning(Download.id, sort_by_parameter_order=True),
+            [values for values, _ in prepared],
+        )
+        ids = q.scalars().all()
+        await session.commit()
+    for download_id, (values, flight) in zip(ids, prepared):
+        await _dispatch(download_id, values, flight)
+    return len(ids)
+
+
+async def enqueue_batch(
+    batch_id: int,
+    urls: Sequence[str],
+    kind: str = MediaKind.video.value,
+) -> Tuple[int, int]:
+    """
+    Разворачивает ссылки подтверждённого пакета в задачи (все — вида kind).
+    Плейлисты читаются потоком: задачи уходят в очередь пачками по
+    BATCH_ENQUEUE_CHUNK, не дожидаясь конца плейлиста. Возвращает (число
+    задач, число ссылок, которые не удалось развернуть).
+    """
+    async with AsyncSessionLocal() as session:
+        batch = await session.get(Batch, batch_id)
+    if batch is None:
+        return 0, 0
 
-        await _queue.put(Job(download_id=d.id))
-        return d.id
+    expansion = batches.Expansion(urls)
+    total = 0
+    chunk: List[str] = []
+    async for url in expansion:
+        chunk.append(url)
+        if len(chunk) >= BATCH_ENQUEUE_CHUNK:
+            total += await _enqueue_chunk(batch.user_id, batch.chat_id, batch_id, chunk, kind)
+            chunk = []
+    if chunk:
+        total += await _enqueue_chunk(batch.user_id, batch.chat_id, batch_id, chunk, kind)
+
+    await batches.set_total(batch_id, total)
+    # задачи могли завершиться (кеш, file_id) ещё до того, как стал известен total
+    if outbox.running:
+        await deliver_batch(batch_id)
+    return total, expansion.failed
 
 
 # ------------------------------------------------------------
 # Внутренний воркер
 # ------------------------------------------------------------
 async def _worker():
-    while True:
+    global _retiring
+    while not _draining:
         job = await _queue.get()
+        handed_off = False
         try:
-            async with _semaphore:
-                await _process_job(job)
+            if not await _attach_to_leader(job):
+                handed_off = True
+                await _hand_off(job)
         finally:
-            _queue.task_done()
+            if not handed_off:
+                _queue.task_done(job)
+        if _retiring > 0:
+            # лимит уменьшили — лишний воркер завершается после своей задачи
+            _retiring -= 1
+            return
 
 
-async def _process_job(job: Job) -> None:
-    async with AsyncSessionLocal() as session:
-        d: Optional[Download] = await session.get(Download, job.download_id)
-        if d is None:
-            return
+async def _hand_off(job: Job) -> None:
+    """
+    Запускает задачу в своём таске и ждёт, пока она отпустит воркер:
+    скачанный файл ушёл в обработку или задача закончилась.
+    """
+    released = asyncio.Event()
+    task = asyncio.create_task(_run_job(job, released), name=f"job-{job.download_id}")
+    _jobs.add(task)
+    task.add_done_callback(_on_job_exit)
+    waiter = asyncio.create_task(released.wait())
+    try:
+        await asyncio.wait((task, waiter), return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        waiter.cancel()
+
+
+async def _run_job(job: Job, released: asyncio.Event) -> None:
+    try:
+        async with _queue.lease(job):
+            await _lead(job, released)
+    finally:
+        released.set()
+        _queue.task_done(job)
+
+
+def _on_job_exit(task: asyncio.Task) -> None:
+    _jobs.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("job task %s crashed", task.get_name(), exc_info=task.exception())
+
+
+def _spawn_worker() -> None:
+    task = asyncio.create_task(_worker(), name="worker")
+    _workers.add(task)
+    task.add_done_callback(_on_worker_exit)
+
+
+def _on_worker_exit(task: asyncio.Task) -> None:
+    _workers.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        logger.error("worker crashed, restarting", exc_info=task.exception())
+        _spawn_worker()
+
+
+def _resize_workers(limit: int) -> None:
+    global _retiring
+    if _draining:
+        return
+    alive = len(_workers) - _retiring
+    if limit > alive:
+        # сначала отменяем запланированный уход, потом добавляем новых
+        keep = min(_retiring, limit - alive)
+        _retiring -= keep
+        for _ in range(limit - alive - keep):
+            _spawn_worker()
+    elif limit < alive:
+        _retiring += alive - limit
+
+
+async def _lead(job: Job, released: Optional[asyncio.Event] = None) -> None:
+    """
+    Выполняет задачу как лидер: остальные запросы того же видео
+    (в этом процессе) ждут её завершения. released выставляется, когда
+    загрузка закончена и воркер может брать следующую задачу.
+    """
+    key = _flight_key(job.video_id, job.kind) if job.video_id else None
+    flight = None
+    if key is not None:
+        flight = _Flight(job.download_id, asyncio.get_running_loop().create_future())
+        _inflight[key] = flight
+    try:
+        # кеш проверяем до семафора: попадание не занимает слот
+        # (слот загрузки берёт сам _process_job — только на время yt-dlp)
+        if not await _complete_from_cache(job):
+            await _process_job(job, flight, released)
+        await _deliver(job)
+    finally:
+        if flight is not None:
+            if _inflight.get(key) is flight:
+                del _inflight[key]
+            flight.finished.set_result(None)
 
-        # помечаем как processing
-        d.status = DownloadStatus.processing
+
+def _flight_key(video_id: str, kind: str) -> FlightKey:
+    return (video_id, format_for(kind))
+
+
+def _add_reporter(reporters: List[ProgressReporter], chat_id: Optional[int], message_id: Optional[int]) -> None:
+    # без запущенного outbox правки копились бы в очереди впустую
+    if chat_id is not None and message_id is not None and outbox.running:
+        reporters.append(ProgressReporter(chat_id, message_id))
+
+
+async def _attach_to_leader(job: Job) -> bool:
+    """
+    Если то же видео уже качает другая задача (в этом или другом процессе),
+    задача становится ведомой и ждёт результат в отдельном таске,
+    не занимая воркер. Возвращает True, если задача ушла к лидеру.
+    """
+    if not job.video_id:
+        return False
+
+    flight = _inflight.get(_flight_key(job.video_id, job.kind))
+    if flight is not None:
+        leader_id, finished = flight.leader_id, flight.finished
+    else:
+        # лидер в другом процессе: задача того же видео в работе и сама не ведомая
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(
+                select(Download.id)
+                .where(
+                    Download.video_id == job.video_id,
+                    Download.kind == job.kind,
+                    Download.status == DownloadStatus.processing,
+                    Download.leader_id.is_(None),
+                    Download.id != job.download_id,
+                )
+                .order_by(Download.id)
+                .limit(1)
+            )
+            leader_id = q.scalar_one_or_none()
+        if leader_id is None:
+            return False
+        finished = None
+
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            update(Download)
+            .where(Download.id == job.download_id)
+            .values(
+                status=DownloadStatus.processing,
+                leader_id=leader_id,
+                worker_id=WORKER_ID,
+                lease_until=lease_deadline(),
+            )
+            .returning(Download.chat_id, Download.status_message_id)
+        )
+        row = q.first()
         await session.commit()
+    if row is not None and flight is not None:
+        _add_reporter(flight.reporters, row.chat_id, row.status_message_id)
+    _spawn_follower(job, leader_id, finished)
+    return True
+
+
+def _spawn_follower(job: Job, leader_id: int, finished: Optional[asyncio.Future]) -> None:
+    task = asyncio.create_task(_follow(job, leader_id, finished), name=f"follower-{job.download_id}")
+    _followers.add(task)
+    task.add_done_callback(_followers.discard)
+
+
+async def _follow(job: Job, leader_id: int, finished: Optional[asyncio.Future]) -> None:
+    """
+    Ждёт завершения лидера и копирует его результат (включая ошибку).
+    Локальный лидер будит сразу через future; если лидер в другом процессе
+    или уже успел завершиться — статус берём из его строки в БД.
+    """
+    try:
+        async with _queue.lease(job):
+            while True:
+                if finished is not None:
+                    # локальный лидер всегда резолвит future (в т.ч. при ошибке)
+                    await asyncio.shield(finished)
+                    finished = None
+                else:
+                    await asyncio.sleep(POLL_INTERVAL)
+
+                async with AsyncSessionLocal() as session:
+                    q = await session.execute(
+                        select(
+                            Download.status,
+                            Download.file_path,
+                            Download.file_size,
+                            Download.error,
+                        ).where(Download.id == leader_id)
+                    )
+                    leader = q.first()
+                if leader is None:
+                    raise RuntimeError(f"leader download {leader_id} disappeared")
+                if leader.status in (DownloadStatus.done, DownloadStatus.failed):
+                    break
+                # лидер ещё в работе (или возвращён в очередь) — ждём дальше
+
+            await status_writer.write(
+                job.download_id,
+                owner=_queue.owner,
+                status=leader.status,
+                file_path=leader.file_path,
+                file_size=leader.file_size,
+                error=leader.error,
+                finished_at=datetime.utcnow(),
+                lease_until=None,
+            )
+            await _deliver(job)
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logger.exception("follower %s of download %s failed", job.download_id, leader_id)
 
+
+async def _reaper():
+    """
+    Периодически возвращает в очередь задачи с истёкшим lease
+    (их воркер-процесс умер или завис).
+    """
+    while True:
+        await asyncio.sleep(LEASE_SECONDS / 2)
+        try:
+            await _queue.requeue_expired()
+        except Exception:
+            logger.exception("requeue of expired jobs failed")
+
+
+async def _redeliver_batches():
+    """
+    Периодически досылает пакеты, отправка которых оборвалась
+    (см. delivery.deliver_pending_batches).
+    """
+    while True:
         try:
-            # 1) Скачиваем во временную директорию (yt-dlp)
-            tmp_file = await run_ytdlp(d.url, out_filename=str(d.id))
-            if not tmp_file or not tmp_file.exists():
-                raise RuntimeError("failed to download")
-
-            # 2) Переносим в постоянное хранилище
-            final_path = move_file_to_final(tmp_file, FINAL_DIR)
-            if not final_path or not final_path.exists():
-                raise RuntimeError("failed to move file to final dir")
-
-            # 3) Обновляем запись
-            d.file_path = str(final_path)
-            d.file_size = final_path.stat().st_size
-            d.status = DownloadStatus.done
-            d.finished_at = datetime.utcnow()
-            await session.commit()
-
-        except Exception as e:
-            d.error = str(e)
-            d.status = DownloadStatus.failed
-            d.finished_at = datetime.utcnow()
-            await session.commit()
+            sent = await deliver_pending_batches()
+        except Exception:
+            logger.exception("redelivery of batches failed")
+        else:
+            if sent:
+                logger.info("redelivered %s batch(es)", sent)
+        await asyncio.sleep(LEASE_SECONDS)
+
+
+async def _complete_from_cache(job: Job) -> bool:
+    """
+    Если такое видео в том же формате уже скачано — сразу закрываем задачу
+    готовым файлом, без yt-dlp. Возвращает True при попадании в кеш.
+    """
+    if not job.video_id:
+        return False
+    fmt = format_for(job.kind)
+    cached = download_cache.get(job.video_id, fmt)
+    if cached is not None:
+        await disk_budget.touch(cached.path)
+        values = dict(file_path=cached.path, file_size=cached.size)
+    elif await get_file_id(job.video_id, fmt):
+        # локального файла нет, но Telegram уже хранит это видео —
+        # доставка пойдёт по file_id
+        values = {}
+    else:
+        return False
+
+    await status_writer.write(
+        job.download_id,
+        owner=_queue.owner,
+        status=DownloadStatus.done,
+        finished_at=datetime.utcnow(),
+        lease_until=None,
+        **values,
+    )
+    metrics.JOBS_FINISHED.labels("cache").inc()
+    return True
+
+
+async def _deliver(job: Job) -> None:
+    """
+    Отправка результата в чат. Ошибки Telegram не должны ронять воркер.
+    """
+    if not outbox.running:
+        return
+    try:
+        await deliver(job.download_id)
+    except Exception:
+        logger.exception("delivery failed for download %s", job.download_id)
+
+
+async def _warm_cache() -> None:
+    """
+    Наполняет кеш последними готовыми загрузками из БД (после рестарта).
+    """
+    if download_cache.max_entries == 0:
+        return
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            select(Download.video_id, Download.kind, Download.file_path, Download.file_size)
+            .where(
+                Download.status == DownloadStatus.done,
+                Download.video_id.is_not(None),
+                Download.file_path.is_not(None),
+            )
+            .order_by(Download.id.desc())
+            .limit(download_cache.max_entries)
+        )
+        rows = q.all()
+    # самые свежие кладём последними — они окажутся «горячими» в LRU;
+    # удалённые объекты не проверяем (кеш сам отсеет пропавшие локальные)
+    for video_id, kind, file_path, file_size in reversed(rows):
+        if is_remote(file_path) or Path(file_path).exists():
+            download_cache.put(video_id, format_for(kind), file_path, file_size or 0)
+
+
+async def _cleanup_staging() -> None:
+    """
+    Проверяет staging и убирает файлы, оставшиеся от прерванных загрузок.
+    Файлы задач pending/processing не трогаем: их ещё докачают.
+    """
+    staging.prepare()
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(
+            select(Download.id).where(
+                Download.status.in_((DownloadStatus.pending, DownloadStatus.processing))
+            )
+        )
+        active = q.scalars().all()
+    removed = await asyncio.to_thread(staging.cleanup_orphans, active)
+    if removed:
+        logger.info("removed %s orphaned staging file(s)", removed)
+
+
+async def _checkpoint(d: Download, ready: Optional[Path] = None) -> None:
+    """
+    Задачу прервали на середине (остановка бота): строка снова pending —
+    её заберёт следующий запуск или другой процесс. Если файл уже скачан
+    (ready — прервана обработка), сохраняем его: следующий запуск начнёт
+    сразу с обработки. Иначе — путь недокачанного файла и число скачанных
+    байт: yt-dlp (continuedl) и rangefetch продолжат с него, а не с нуля.
+    """
+    values: Dict[str, Any] = dict(partial_path=None, bytes_done=None, ready_path=None)
+    if ready is not None:
+        values.update(ready_path=str(ready))
+    else:
+        partial = await asyncio.to_thread(partial_download, str(d.id))
+        if partial:
+            values.update(partial_path=str(partial[0]), bytes_done=partial[1])
+    await status_writer.write(
+        d.id,
+        owner=_queue.owner,
+        status=DownloadStatus.pending,
+        worker_id=None,
+        lease_until=None,
+        **values,
+    )
+    metrics.JOB_CHECKPOINTS.labels("saved").inc()
+    if ready is not None:
+        logger.info("download %s checkpointed after download (%s)", d.id, ready.name)
+    elif values["partial_path"]:
+        logger.info("download %s checkpointed at %s bytes (%s)", d.id, values["bytes_done"], Path(values["partial_path"]).name)
+
+
+async def _publish(d: Download, tmp_file: Path, fmt: str) -> None:
+    """
+    Переносит готовый файл в постоянное хранилище (копия между ФС или
+    upload в S3 — не в event loop) и закрывает задачу.
+    """
+    size = tmp_file.stat().st_size
+    final_path = await asyncio.to_thread(move_file_to_final, tmp_file)
+    if not final_path:
+        raise RuntimeError("failed to move file to storage")
+
+    await status_writer.write(
+        d.id,
+        owner=_queue.owner,
+        file_path=final_path,
+        file_size=size,
+        status=DownloadStatus.done,
+        finished_at=datetime.utcnow(),
+        lease_until=None,
+        partial_path=None,
+        bytes_done=None,
+        ready_path=None,
+    )
+
+    if d.video_id:
+        download_cache.put(d.video_id, fmt, final_path, size)
+    metrics.JOBS_FINISHED.labels("done").inc()
+    await _register_file(final_path, size, d.video_id, fmt)
+
+
+async def _finish(aw: Awaitable[None]) -> None:
+    """
+    Доводит aw до конца, даже если текущий таск отменяют (остановка):
+    поток переноса файла всё равно не прервать, а брошенный на полпути
+    файл не остался бы ни в staging, ни в записи. Отмена пробрасывается
+    после завершения.
+    """
+    task = asyncio.ensure_future(aw)
+    cancelled = False
+    while not task.done():
+        try:
+            await asyncio.shield(task)
+        except asyncio.CancelledError:
+            cancelled = True
+    task.result()
+    if cancelled:
+        raise asyncio.CancelledError
+
+
+async def _register_file(path: str, size: int, video_id: Optional[str], fmt: str) -> None:
+    # учёт места не должен превращать готовую загрузку в ошибку
+    try:
+        await disk_budget.register(path, size, video_id, fmt)
+    except Exception:
+        logger.exception("disk budget accounting failed for %s", path)
+
+
+def _since(created_at: Optional[datetime]) -> Optional[float]:
+    # created_at — UTC; SQLite отдаёт его без tzinfo и с точностью до секунды,
+    # PostgreSQL — с tzinfo
+    if created_at is None:
+        return None
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return max(0.0, (datetime.utcnow() - created_at).total_seconds())
+
+
+async def _collect_metrics() -> None:
+    """
+    Gauges очереди и слотов — снимаются при каждом запросе /metrics.
+    """
+    metrics.QUEUE_DEPTH.set(await _queue.depth())
+    metrics.WORKER_SLOTS.labels("active").set(_limiter.active)
+    metrics.WORKER_SLOTS.labels("limit").set(_limiter.limit)
+    metrics.WORKER_SLOTS.labels("waiting").set(_limiter.waiting)
+
+
+@metrics.timed(metrics.JOB_SECONDS)
+async def _process_job(
+    job: Job,
+    flight: Optional[_Flight] = None,
+    released: Optional[asyncio.Event] = None,
+) -> None:
+    # строку только читаем: сессия не держит соединение на время загрузки,
+    # переходы статуса пишет status_writer (group commit) — и только пока
+    # строка закреплена за этим процессом (owner)
+    async with AsyncSessionLocal() as session:
+        d: Optional[Download] = await session.get(Download, job.download_id)
+    if d is None:
+        return
+
+    # прогресс: своё статусное сообщение + сообщения ведомых
+    # (ведомые могут присоединиться и во время загрузки)
+    reporters = flight.reporters if flight is not None else []
+    _add_reporter(reporters, d.chat_id, d.status_message_id)
+    progress = fan_out(reporters) if outbox.running else None
+
+    # помечаем как processing
+    await status_writer.write(d.id, owner=_queue.owner, status=DownloadStatus.processing)
+    waited = _since(d.created_at)
+    if waited is not None:
+        metrics.JOB_QUEUE_WAIT.observe(waited)
+
+    # прерванная при прошлой остановке задача: уже скачанный файл сразу
+    # идёт в обработку; недокачанный в staging с тем же именем
+    # yt-dlp/rangefetch продолжат сами
+    ready: Optional[Path] = None
+    if d.ready_path:
+        if await asyncio.to_thread(os.path.exists, d.ready_path):
+            logger.info("download %s is already downloaded, resuming post-processing", d.id)
+            metrics.JOB_CHECKPOINTS.labels("resumed").inc()
+            ready = Path(d.ready_path)
+        else:
+            logger.info("downloaded file of download %s is gone, starting over", d.id)
+    elif d.partial_path:
+        if await asyncio.to_thread(os.path.exists, d.partial_path):
+            logger.info("resuming download %s from %s bytes", d.id, d.bytes_done)
+            metrics.JOB_CHECKPOINTS.labels("resumed").inc()
+        else:
+            logger.info("partial file of download %s is gone, starting over", d.id)
+
+    fmt = format_for(d.kind)
+    published = False
+    try:
+        # 1) Скачиваем во временную директорию (yt-dlp) — в слоте загрузки;
+        #    метаданные берём из prefetch, если он уже был (prefetch выбирает
+        #    видеоформат, поэтому для аудио yt-dlp извлекает их сам)
+        if ready is None:
+            async with _limiter:
+                try:
+                    info = None
+                    if d.kind == MediaKind.video:
+                        with metrics.JOB_STAGE_SECONDS.labels("extract").time():
+                            info = await metadata.lookup(d.url)
+                    tmp_file = await run_ytdlp(d.url, out_filename=str(d.id), info=info, progress=progress, fmt=fmt)
+                except Exception:
+                    _controller.record(ok=False)
+                    raise
+                _controller.record(ok=True, nbytes=tmp_file.stat().st_size)
+            ready = tmp_file
+
+        # 2) Аудио/перепаковка/перекодирование — без слота загрузки и без
+        #    воркера: он берёт следующую задачу, как только для этой нашлось
+        #    место в очереди обработки; ffmpeg ограничен ENCODE_CONCURRENCY.
+        #    Прерванная обработка оставляет исходный файл (ready) на месте
+        async with _postprocess_slots:
+            if released is not None:
+                released.set()
+            ready = await postprocess.process(ready, d.kind.value, progress)
+
+        # 3) Переносим в хранилище и записываем результат
+        published = True
+        await _finish(_publish(d, ready, fmt))
+
+    except asyncio.CancelledError:
+        # после переноса точка продолжения не нужна: задача уже done
+        if not published:
+            await _checkpoint(d, ready)
+        raise
+
+    except Exception as e:
+        metrics.JOBS_FINISHED.labels("failed").inc()
+        await status_writer.write(
+            d.id,
+            owner=_queue.owner,
+            error=str(e),
+            status=DownloadStatus.failed,
+            finished_at=datetime.utcnow(),
+            lease_until=None,
+            partial_path=None,
+            bytes_done=None,
+            ready_path=None,
+        )
+
+
+# ------------------------------------------------------------
+# Плавная остановка
+# ------------------------------------------------------------
+async def drain(timeout: float = DRAIN_TIMEOUT) -> None:
+    """
+    Вызывается перед отменой worker_loop (см. main.py), пока outbox ещё
+    работает. Новые задачи больше не берутся; идущие получают timeout
+    секунд, чтобы закончиться и отправить результат. Не успевшие
+    прерываются: недокачанный файл остаётся в staging, а в строке
+    сохраняется точка продолжения (partial_path, bytes_done) — после
+    рестарта загрузка продолжится с неё; уже скачанный (ready_path) сразу
+    пойдёт в обработку, а начатый перенос в хранилище доводится до конца.
+    Ведомые и захваченные, но не начатые задачи возвращаются в pending.
+    """
+    global _draining
+    _draining = True
+    workers = list(_workers)
+    for t in workers:
+        # воркер ждёт очередь или свою задачу; сама задача живёт в своём таске
+        t.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    running = set(_jobs)
+    late: Set[asyncio.Task] = set()
+    if running:
+        logger.info("draining: waiting up to %g s for %s running job(s)", timeout, len(running))
+        _, late = await asyncio.wait(running, timeout=timeout)
+        for t in late:
+            t.cancel()
+    followers = list(_followers)
+    for t in followers:
+        t.cancel()
+    await asyncio.gather(*late, *followers, return_exceptions=True)
+    released = await _queue.release()
+    logger.info(
+        "drained: %s job(s) finished, %s checkpointed, %s released",
+        len(running) - len(late),
+        len(late),
+        released,
+    )
 
 
 # ------------------------------------------------------------
 # Публичный цикл воркеров
 # ------------------------------------------------------------
-async def worker_loop():
+async def worker_loop(bot: Optional[Bot] = None):
     """
     Запускает N конкурентных воркеров.
+    bot — через него (outbox) отправляются готовые файлы; без запущенного
+    outbox только скачиваем.
     Бесконечный цикл; завершение через отмену task (task.cancel()).
     """
-    workers = [asyncio.create_task(_worker(), name=f"worker-{i}") for i in range(MAX_CONCURRENT)]
+    if bot is not None:
+        outbox.start(bot)
+    await _warm_cache()
+    await _cleanup_staging()
+    await disk_budget.load()
+
+    # восстановление после рестарта: брошенные processing -> pending
+    recovered = await _queue.recover()
+    if recovered:
+        logger.info("recovered %s download job(s)", recovered)
+
+    _resize_workers(_limiter.limit)
+    metrics.REGISTRY.add_collector(_collect_metrics)
+    background = [asyncio.create_task(_reaper(), name="queue-reaper")]
+    if outbox.running:
+        background.append(asyncio.create_task(_redeliver_batches(), name="batch-redelivery"))
+    if disk_budget.enabled:
+        await disk_budget.enforce()
+        background.append(asyncio.create_task(disk_budget.run(), name="disk-budget"))
+    if _controller.enabled:
+        _controller.on_change = _resize_workers
+        background.append(asyncio.create_task(_controller.run(), name="concurrency-controller"))
     try:
-        await asyncio.gather(*workers)
+        await asyncio.gather(*background)
     finally:
-        for w in workers:
-            if not w.cancelled():
-                w.cancel()
-        await asyncio.gather(*workers, return_exceptions=True)
+        tasks = [*background, *_workers, *_jobs, *_followers]
+        for t in tasks:
+            if not t.cancelled():
+                t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # переходы, ещё не попавшие в пачку
+        await status_writer.close()
@@ -8,9 +8,14 @@ from dotenv import load_dotenv
 from aiogram import Bot
 from aiogram.client.default import DefaultBotProperties
 
+# web (FastAPI) и uvicorn импортируются только там, где нужны: polling
+# стартует без них. yt-dlp тоже грузится лениво — см. downloader.prewarm
+from bot_app import metrics
 from bot_app.bot import dp  # экспортируем только Dispatcher
 from bot_app.db import init_db
-from bot_app.worker import worker_loop
+from bot_app.downloader import prewarm, shutdown_executor
+from bot_app.outbox import outbox
+from bot_app.worker import drain, worker_loop
 
 logging.basicConfig(
     level=os.getenv("LOG_LEVEL", "INFO"),
@@ -19,18 +24,66 @@ logging.basicConfig(
 
 load_dotenv()
 TOKEN = os.getenv("BOT_TOKEN")
+# polling — long polling (по умолчанию); webhook — FastAPI/uvicorn (bot_app/web.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
 
 
-async def _start_background_workers():
+async def _start_background_workers(bot: Bot):
     """
     Запускает фоновые воркеры (очередь скачиваний и пр.).
     Возвращает список тасков, чтобы их можно было отменить при остановке.
     """
     tasks = []
-    tasks.append(asyncio.create_task(worker_loop(), name="worker_loop"))
+    tasks.append(asyncio.create_task(worker_loop(bot), name="worker_loop"))
+    # yt-dlp грузится в фоне, пока бот уже принимает обновления
+    tasks.append(asyncio.create_task(prewarm(), name="ytdlp-prewarm"))
+    if metrics.METRICS_ENABLED and BOT_MODE != "webhook":
+        # в webhook-режиме /metrics отдаёт сам webhook-сервер
+        tasks.append(asyncio.create_task(_serve_metrics(), name="metrics"))
     return tasks
 
 
+async def _serve_metrics():
+    import uvicorn
+    from bot_app import web
+
+    config = uvicorn.Config(
+        web.create_metrics_app(),
+        host=web.WEBHOOK_HOST,
+        port=metrics.METRICS_PORT,
+        log_level="warning",
+    )
+    await uvicorn.Server(config).serve()
+
+
+async def _run_webhook(bot: Bot):
+    """
+    Webhook-режим: обновления принимает FastAPI, на том же сервере —
+    /healthz и /readyz.
+    """
+    import uvicorn
+    from bot_app import web
+
+    allowed_updates = dp.resolve_used_update_types()
+    await dp.emit_startup(bot=bot)
+    try:
+        if web.WEBHOOK_URL:
+            await bot.set_webhook(
+                web.WEBHOOK_URL + web.WEBHOOK_PATH,
+                secret_token=web.WEBHOOK_SECRET or None,
+                allowed_updates=allowed_updates,
+            )
+        config = uvicorn.Config(
+            web.create_app(bot),
+            host=web.WEBHOOK_HOST,
+            port=web.WEBHOOK_PORT,
+            log_level=os.getenv("LOG_LEVEL", "INFO").lower(),
+        )
+        await uvicorn.Server(config).serve()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+
+
 async def main():
     if not TOKEN:
         raise RuntimeError("BOT_TOKEN is not set in environment")
@@ -38,23 +91,38 @@ async def main():
     # 1) Инициализируем БД (создаём таблицы, если нет)
     await init_db()
 
-    # 2) Запускаем фоновые задачи
-    bg_tasks = await _start_background_workers()
-
-    # 3) Запускаем Telegram-бота (Aiogram >= 3.7: parse_mode через DefaultBotProperties)
+    # 2) Создаём Telegram-бота (Aiogram >= 3.7: parse_mode через DefaultBotProperties)
     bot = Bot(
         token=TOKEN,
         default=DefaultBotProperties(parse_mode="HTML"),
     )
+
+    # 3) Исходящие сообщения идут через outbox (лимиты Telegram)
+    outbox.start(bot)
+
+    # 4) Запускаем фоновые задачи (воркерам нужен bot для отправки файлов)
+    bg_tasks = await _start_background_workers(bot)
+
+    # 5) Принимаем обновления: polling или webhook
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        if BOT_MODE == "webhook":
+            await _run_webhook(bot)
+        elif BOT_MODE == "polling":
+            await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        else:
+            raise RuntimeError(f"unknown BOT_MODE: {BOT_MODE}")
     finally:
+        # Плавная остановка: воркеры доделывают задачи (outbox ещё отправляет
+        # результаты), не успевшие сохраняют точку продолжения
+        await drain()
         # Корректная остановка фоновых задач
         for t in bg_tasks:
             t.cancel()
         for t in bg_tasks:
             with suppress(asyncio.CancelledError):
                 await t
+        shutdown_executor()
+        await outbox.stop()
         await bot.session.close()
 
 
@@ -0,0 +1,106 @@
+# tests/conftest.py
+"""
+Общие настройки тестов.
+
+Модули бота читают окружение при импорте (DATABASE_URL, каталоги и т.п.),
+поэтому временная SQLite и каталоги загрузок задаются здесь — до первого
+import bot_app. Асинхронный код выполняется в одном event loop на сессию:
+пул соединений движка привязан к loop'у, в котором они открыты.
+"""
+import asyncio
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+_TMP = tempfile.mkdtemp(prefix="multitoolex-tests-")
+atexit.register(shutil.rmtree, _TMP, True)
+
+os.environ.pop("DATABASE_URL", None)
+os.environ.update(
+    {
+        "SQLITE_PATH": os.path.join(_TMP, "test.db"),
+        "DOWNLOADS_DIR": os.path.join(_TMP, "downloads"),
+        "QUEUE_BACKEND": "db",
+        "METRICS_ENABLED": "0",
+    }
+)
+
+
+@pytest.fixture(scope="session")
+def loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    from bot_app.db import engine
+
+    loop.run_until_complete(engine.dispose())
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def run(loop):
+    """
+    run(coro) — выполнить корутину в общем loop'е тестов.
+    """
+    return loop.run_until_complete
+
+
+@pytest.fixture(scope="session")
+def db(run):
+    from bot_app.db import init_db
+
+    run(init_db())
+
+
+@pytest.fixture
+def rows(run, db):
+    """
+    rows(user_id, status=..., **values) -> ID новой загрузки.
+    Перед тестом таблицы downloads/batches/users очищаются, пользователи 1..5 есть
+    (telegram_id = 1000 + id).
+    """
+    from sqlalchemy import delete, insert
+
+    from bot_app.db import AsyncSessionLocal
+    from bot_app.models import Batch, Download, DownloadStatus, User
+
+    async def clear():
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(Download))
+            await session.execute(delete(Batch))
+            await session.execute(delete(User))
+            await session.execute(insert(User), [{"id": n, "telegram_id": 1000 + n} for n in range(1, 6)])
+            await session.commit()
+
+    async def add(user_id, status=DownloadStatus.pending, **values):
+        values.setdefault("url", f"https://youtu.be/u{user_id}")
+        async with AsyncSessionLocal() as session:
+            d = Download(user_id=user_id, status=status, **values)
+            session.add(d)
+            await session.commit()
+            return d.id
+
+    run(clear())
+    return lambda *a, **kw: run(add(*a, **kw))
+
+
+@pytest.fixture
+def row(run):
+    """
+    row(download_id) -> свежая строка downloads (Download).
+    """
+    from bot_app.db import AsyncSessionLocal
+    from bot_app.models import Download
+
+    async def get(download_id):
+        async with AsyncSessionLocal() as session:
+            return await session.get(Download, download_id)
+
+    return lambda download_id: run(get(download_id))
@@ -0,0 +1,265 @@
+# tests/test_batches.py
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from bot_app import batches, delivery, worker
+from bot_app.db import AsyncSessionLocal
+from bot_app.downloader import DownloadError
+from bot_app.keyboard import confirm_download
+from bot_app.models import Batch, Download, DownloadStatus
+
+PLAYLIST = "https://www.youtube.com/playlist?list=PL123"
+
+
+class FakeOutbox:
+    """
+    Вместо outbox: запоминает отправленное, send_media_group отвечает
+    сообщениями с file_id, как Telegram после upload.
+    """
+
+    running = True
+
+    def __init__(self) -> None:
+        self.texts = []
+        self.groups = []
+        self.singles = []
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.texts.append((chat_id, text))
+
+    async def send_video(self, chat_id, video, **kwargs):
+        self.singles.append((chat_id, kwargs["caption"]))
+        return _message("single")
+
+    async def send_media_group(self, chat_id, media, **kwargs):
+        self.groups.append((chat_id, [m.caption for m in media]))
+        return [_message(f"group-{n}") for n in range(len(media))]
+
+
+def _message(file_id):
+    video = SimpleNamespace(file_id=file_id, file_unique_id=f"u-{file_id}")
+    return SimpleNamespace(video=video, audio=None, document=None)
+
+
+def _collect(expansion):
+    async def collect():
+        return [url async for url in expansion]
+
+    return collect()
+
+
+def _batch(run, user_id=1, chat_id=500, total=None):
+    async def add():
+        async with AsyncSessionLocal() as session:
+            batch = Batch(user_id=user_id, chat_id=chat_id, urls="", total=total)
+            session.add(batch)
+            await session.commit()
+            return batch.id
+
+    return run(add())
+
+
+def _get_batch(run, batch_id):
+    async def get():
+        async with AsyncSessionLocal() as session:
+            return await session.get(Batch, batch_id)
+
+    return run(get())
+
+
+@pytest.fixture
+def sent(monkeypatch):
+    fake = FakeOutbox()
+    monkeypatch.setattr(delivery, "outbox", fake)
+    return fake
+
+
+# ------------------------------------------------------------
+# Expansion
+# ------------------------------------------------------------
+def test_expansion_dedups_and_limits_plain_links(run):
+    urls = [
+        "https://youtu.be/aaaaaaaaaaa",
+        "https://www.youtube.com/watch?v=aaaaaaaaaaa",
+        "https://youtu.be/bbbbbbbbbbb",
+        "https://youtu.be/ccccccccccc",
+    ]
+
+    assert run(_collect(batches.Expansion(urls))) == [urls[0], urls[2], urls[3]]
+    assert run(_collect(batches.Expansion(urls, limit=2))) == [urls[0], urls[2]]
+
+
+def test_expansion_streams_playlists_and_counts_failures(run, monkeypatch):
+    calls = []
+
+    async def iter_playlist(url, limit):
+        calls.append((url, limit))
+        if url != PLAYLIST:
+            raise DownloadError("private playlist")
+        for n in range(10):
+            yield f"https://youtu.be/{n:011d}"
+
+    monkeypatch.setattr(batches, "iter_playlist", iter_playlist)
+    expansion = batches.Expansion(
+        ["https://youtu.be/00000000001", PLAYLIST, "https://www.youtube.com/playlist?list=PLgone"],
+        limit=5,
+    )
+
+    urls = run(_collect(expansion))
+
+    # повтор ролика из плейлиста отброшен, обход остановлен на лимите
+    assert urls == ["https://youtu.be/00000000001"] + [f"https://youtu.be/{n:011d}" for n in (0, 2, 3, 4)]
+    assert calls == [(PLAYLIST, 5)]
+    assert expansion.failed == 0
+
+    expansion = batches.Expansion(["https://www.youtube.com/playlist?list=PLgone", "https://youtu.be/00000000001"])
+    assert run(_collect(expansion)) == ["https://youtu.be/00000000001"]
+    assert expansion.failed == 1
+
+
+# ------------------------------------------------------------
+# Создание, подтверждение и постановка пакета
+# ------------------------------------------------------------
+def test_start_batch_only_once_and_only_by_owner(run, rows):
+    urls = ["https://youtu.be/aaaaaaaaaaa", "https://youtu.be/bbbbbbbbbbb"]
+    # пользователи фикстуры: telegram_id = 1000 + id
+    batch_id = run(batches.create_batch(1001, 500, urls))
+
+    assert run(batches.start_batch(batch_id, 1002)) is None
+    assert run(batches.start_batch(batch_id, 1001)) == urls
+    # повторное нажатие кнопки
+    assert run(batches.start_batch(batch_id, 1001)) is None
+
+
+def test_single_link_is_kept_out_of_callback_data(run, rows):
+    rows(1)
+    url = "https://www.youtube.com/watch?v=dQw4w9WgXcQ&list=PLrAXtmErZgOeiKm4sgNOknGvNjby9efdf&t=42s&si=Fz2qJkYd"
+    link_id = run(batches.create_batch(1001, 500, [url]))
+
+    markup = confirm_download(link_id)
+    data = [button.callback_data for row in markup.inline_keyboard for button in row]
+    # лимит Telegram на callback_data — 64 байта
+    assert all(len(d.encode()) <= 64 for d in data)
+    assert f"download:{link_id}" in data and f"audio:{link_id}" in data
+
+    assert run(batches.start_batch(link_id, 1001)) == [url]
+    # повторное нажатие не ставит загрузку второй раз
+    assert run(batches.start_batch(link_id, 1001)) is None
+
+
+def test_enqueue_batch_inserts_jobs_and_sets_total(run, rows, monkeypatch):
+    monkeypatch.setattr(worker, "BATCH_ENQUEUE_CHUNK", 2)
+    urls = [f"https://youtu.be/{n:011d}" for n in range(5)] + ["https://youtu.be/00000000000"]
+    batch_id = run(batches.create_batch(1001, 500, urls))
+
+    assert run(worker.enqueue_batch(batch_id, urls)) == (5, 0)
+
+    async def load():
+        async with AsyncSessionLocal() as session:
+            items = (await session.execute(select(Download).where(Download.batch_id == batch_id))).scalars().all()
+            return items, await session.get(Batch, batch_id)
+
+    items, batch = run(load())
+    assert batch.total == 5
+    assert [d.url for d in sorted(items, key=lambda d: d.id)] == urls[:5]
+    assert {(d.user_id, d.chat_id, d.status) for d in items} == {(1, 500, DownloadStatus.pending)}
+
+
+# ------------------------------------------------------------
+# Доставка пакета
+# ------------------------------------------------------------
+def test_claim_batch_waits_for_total_and_all_items(run, rows):
+    batch_id = _batch(run)
+    first = rows(1, batch_id=batch_id, status=DownloadStatus.done)
+    rows(1, batch_id=batch_id, status=DownloadStatus.processing)
+
+    # total ещё не известен (плейлист разворачивается)
+    assert run(delivery._claim_batch(batch_id)) is None
+    run(batches.set_total(batch_id, 2))
+    # одна задача ещё в работе
+    assert run(delivery._claim_batch(batch_id)) is None
+
+    async def finish_all():
+        async with AsyncSessionLocal() as session:
+            for d in (await session.execute(select(Download).where(Download.batch_id == batch_id))).scalars():
+                if d.id != first:
+                    d.status = DownloadStatus.failed
+            await session.commit()
+
+    run(finish_all())
+    claimed = run(delivery._claim_batch(batch_id))
+    assert (claimed.user_id, claimed.chat_id, claimed.total) == (1, 500, 2)
+    # отправку пакета получает ровно один вызов
+    assert run(delivery._claim_batch(batch_id)) is None
+
+
+def test_deliver_batch_sends_album_and_summary_once(run, rows, sent, tmp_path):
+    batch_id = _batch(run, total=3)
+    files = []
+    for n in range(2):
+        path = tmp_path / f"{n}.mp4"
+        path.write_bytes(b"video")
+        files.append(
+            rows(1, batch_id=batch_id, status=DownloadStatus.done, video_id=f"batch{n:06d}", file_path=str(path))
+        )
+    failed = rows(1, batch_id=batch_id, status=DownloadStatus.failed)
+
+    async def deliver_concurrently():
+        # последние задачи пакета завершились одновременно
+        await asyncio.gather(*(delivery.deliver_batch(batch_id) for _ in range(3)))
+
+    run(deliver_concurrently())
+
+    assert sent.groups == [(500, [f"✅ ID {i}" for i in files])]
+    assert sent.texts == [(500, f"📦 Пакет {batch_id}: надіслано 2 з 3.\n❌ Не вдалося: ID {failed}")]
+    # file_id из ответа Telegram сохранён — повторная отправка без upload
+    assert run(delivery.get_file_id("batch000000")) == "group-0"
+
+
+def test_failed_batch_delivery_is_retried_after_lease(run, rows, sent, tmp_path, monkeypatch):
+    batch_id = _batch(run, total=1)
+    path = tmp_path / "1.mp4"
+    path.write_bytes(b"video")
+    ready = rows(1, batch_id=batch_id, status=DownloadStatus.done, file_path=str(path))
+
+    async def broken(chat_id, video, **kwargs):
+        raise RuntimeError("telegram is down")
+
+    monkeypatch.setattr(sent, "send_video", broken)
+    with pytest.raises(RuntimeError):
+        run(delivery.deliver_batch(batch_id))
+
+    batch = _get_batch(run, batch_id)
+    assert batch.delivering_at is not None and batch.delivered_at is None
+    # lease ещё действует — повторно не отправляем
+    assert run(delivery.deliver_pending_batches()) == 0
+
+    # Telegram ожил, lease истёк
+    monkeypatch.delattr(sent, "send_video")
+    monkeypatch.setattr(delivery, "BATCH_DELIVERY_TIMEOUT", -1)
+    assert run(delivery.deliver_pending_batches()) == 1
+
+    assert sent.singles == [(500, f"✅ Готово (ID {ready})")]
+    assert sent.texts == [(500, f"📦 Пакет {batch_id}: надіслано 1 з 1.")]
+    batch = _get_batch(run, batch_id)
+    assert batch.delivered_at is not None and batch.delivering_at is None
+    assert run(delivery.deliver_pending_batches()) == 0
+
+
+def test_deliver_batch_single_ready_item_goes_alone(run, rows, sent, tmp_path):
+    batch_id = _batch(run, total=2)
+    path = tmp_path / "1.mp4"
+    path.write_bytes(b"video")
+    ready = rows(1, batch_id=batch_id, status=DownloadStatus.done, file_path=str(path))
+    # файл пропал из хранилища
+    gone = rows(1, batch_id=batch_id, status=DownloadStatus.done, file_path=str(tmp_path / "gone.mp4"))
+
+    run(delivery.deliver(ready))
+
+    # альбом из одного элемента Telegram не принимает
+    assert sent.groups == []
+    assert sent.singles == [(500, f"✅ Готово (ID {ready})")]
+    assert sent.texts == [(500, f"📦 Пакет {batch_id}: надіслано 1 з 2.\n❌ Не вдалося: ID {gone}")]
@@ -0,0 +1,103 @@
+# tests/test_cache.py
+import pytest
+
+from bot_app import worker
+from bot_app.cache import DownloadCache, download_cache
+from bot_app.downloader import YTDLP_FORMAT
+from bot_app.models import DownloadStatus
+from bot_app.utils import extract_video_id
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://www.youtube.com/watch?v=dQw4w9WgXcQ&t=42s",
+        "https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ",
+        "https://youtu.be/dQw4w9WgXcQ?si=abc",
+        "youtube.com/shorts/dQw4w9WgXcQ",
+        "https://www.youtube-nocookie.com/embed/dQw4w9WgXcQ",
+        "https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RD1",
+    ],
+)
+def test_every_link_form_maps_to_one_cache_key(url):
+    assert extract_video_id(url) == "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize(
+    "url",
+    ["", "https://example.com/watch?v=dQw4w9WgXcQ", "https://youtu.be/short", "https://www.youtube.com/feed"],
+)
+def test_unknown_links_have_no_cache_key(url):
+    assert extract_video_id(url) is None
+
+
+def test_cache_is_lru_and_forgets_deleted_files(tmp_path):
+    files = {}
+    for name in "abc":
+        files[name] = tmp_path / f"{name}.mp4"
+        files[name].write_bytes(b"x")
+    cache = DownloadCache(max_entries=2)
+
+    cache.put("a", "fmt", files["a"], 1)
+    cache.put("b", "fmt", files["b"], 1)
+    assert cache.get("a", "fmt").path == str(files["a"])
+    # «b» давно не читали — вытесняется он, а не «a»
+    cache.put("c", "fmt", files["c"], 1)
+    assert cache.get("b", "fmt") is None
+    assert len(cache) == 2
+
+    # другой формат — другой ключ
+    assert cache.get("a", "other") is None
+
+    files["a"].unlink()
+    assert cache.get("a", "fmt") is None
+    assert len(cache) == 1
+
+
+def test_cache_disabled_with_zero_entries(tmp_path):
+    cache = DownloadCache(max_entries=0)
+    cache.put("a", "fmt", tmp_path, 1)
+
+    assert len(cache) == 0
+
+
+@pytest.fixture
+def cache():
+    download_cache.clear()
+    yield download_cache
+    download_cache.clear()
+
+
+def test_cache_hit_completes_job_without_download(run, rows, row, cache, tmp_path):
+    path = tmp_path / "ready.mp4"
+    path.write_bytes(b"video")
+    cache.put("dQw4w9WgXcQ", YTDLP_FORMAT, path, 5)
+    download_id = rows(1, status=DownloadStatus.processing, worker_id=worker.WORKER_ID, video_id="dQw4w9WgXcQ")
+
+    assert run(worker._complete_from_cache(worker.Job(download_id, "dQw4w9WgXcQ")))
+
+    d = row(download_id)
+    assert (d.status, d.file_path, d.file_size) == (DownloadStatus.done, str(path), 5)
+    assert d.finished_at is not None
+
+
+def test_cache_miss_leaves_job_alone(run, rows, row, cache):
+    download_id = rows(1, video_id="dQw4w9WgXcQ")
+
+    assert not run(worker._complete_from_cache(worker.Job(download_id, "dQw4w9WgXcQ")))
+    assert not run(worker._complete_from_cache(worker.Job(download_id, None)))
+    assert row(download_id).status == DownloadStatus.pending
+
+
+def test_warm_cache_loads_recent_done_files(run, rows, cache, tmp_path):
+    present = tmp_path / "present.mp4"
+    present.write_bytes(b"video")
+    rows(1, status=DownloadStatus.done, video_id="aaaaaaaaaaa", file_path=str(present), file_size=5)
+    rows(1, status=DownloadStatus.done, video_id="bbbbbbbbbbb", file_path=str(tmp_path / "gone.mp4"))
+    rows(1, status=DownloadStatus.failed, video_id="ccccccccccc", file_path=str(present))
+
+    run(worker._warm_cache())
+
+    assert cache.get("aaaaaaaaaaa", YTDLP_FORMAT).path == str(present)
+    assert cache.get("bbbbbbbbbbb", YTDLP_FORMAT) is None
+    assert cache.get("ccccccccccc", YTDLP_FORMAT) is None
@@ -0,0 +1,88 @@
+# tests/test_concurrency.py
+import asyncio
+
+from bot_app import concurrency
+from bot_app.concurrency import AdaptiveController, AdaptiveLimiter
+
+
+def _controller(monkeypatch, limit=2, **kw):
+    # без сигналов перегрузки от машины, на которой идут тесты
+    monkeypatch.setattr(AdaptiveController, "_cpu_overloaded", lambda self: False)
+    limiter = AdaptiveLimiter(limit)
+    return limiter, AdaptiveController(limiter, interval=1, **kw)
+
+
+def test_controller_is_off_by_default():
+    assert concurrency.CONCURRENCY_MIN == concurrency.CONCURRENCY_MAX
+    assert not AdaptiveController(AdaptiveLimiter(2)).enabled
+
+
+def test_limiter_set_limit_wakes_waiters(run):
+    async def scenario():
+        limiter = AdaptiveLimiter(1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.waiting == 1 and not waiter.done()
+
+        limiter.set_limit(2)
+        await asyncio.wait_for(waiter, timeout=1)
+        return limiter.active, limiter.peak
+
+    assert run(scenario()) == (2, 2)
+
+
+def test_limiter_cancelled_waiter_leaves_queue(run):
+    async def scenario():
+        limiter = AdaptiveLimiter(1)
+        await limiter.acquire()
+        waiter = asyncio.create_task(limiter.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.gather(waiter, return_exceptions=True)
+        limiter.release()
+        return limiter.active, limiter.waiting
+
+    assert run(scenario()) == (0, 0)
+
+
+def test_controller_adds_slot_when_saturated_and_rolls_back_without_gain(monkeypatch):
+    limiter, controller = _controller(monkeypatch, min_limit=1, max_limit=4)
+    limiter.peak = 2
+    controller.record(True, 1000)
+    assert controller.step() == 3
+
+    # прибавка не дала прироста пропускной способности — шаг назад
+    limiter.peak = 3
+    controller.record(True, 1000)
+    assert controller.step() == 2
+    assert limiter.limit == 2
+
+
+def test_controller_keeps_growing_while_throughput_grows(monkeypatch):
+    changes = []
+    limiter, controller = _controller(monkeypatch, min_limit=1, max_limit=3, on_change=changes.append)
+    for nbytes in (1000, 2000, 3000):
+        limiter.peak = limiter.limit
+        controller.record(True, nbytes)
+        controller.step()
+
+    # упёрлись в max_limit
+    assert limiter.limit == 3
+    assert changes == [3]
+
+
+def test_controller_halves_on_errors(monkeypatch):
+    limiter, controller = _controller(monkeypatch, limit=4, min_limit=1, max_limit=8)
+    controller.record(False)
+    controller.record(False)
+    controller.record(True)
+
+    assert controller.step() == 2
+
+
+def test_controller_halves_on_cpu_but_not_below_min(monkeypatch):
+    limiter, controller = _controller(monkeypatch, limit=3, min_limit=2, max_limit=8)
+    monkeypatch.setattr(AdaptiveController, "_cpu_overloaded", lambda self: True)
+
+    assert controller.step() == 2
@@ -0,0 +1,77 @@
+# tests/test_db.py
+from sqlalchemy import create_engine, inspect, select
+from sqlalchemy.orm import Session
+
+from bot_app.db import upgrade_schema
+from bot_app.models import Download, DownloadStatus, MediaKind
+
+# схема первой версии бота (до кеша, очереди на БД, пакетов и т.д.)
+FIRST_RELEASE_SCHEMA = [
+    """
+    CREATE TABLE users (
+        id INTEGER NOT NULL,
+        telegram_id BIGINT NOT NULL,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        PRIMARY KEY (id)
+    )
+    """,
+    "CREATE UNIQUE INDEX ix_users_telegram_id ON users (telegram_id)",
+    """
+    CREATE TABLE downloads (
+        id INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        url VARCHAR(1024) NOT NULL,
+        status VARCHAR(10) NOT NULL,
+        file_path VARCHAR(1024),
+        file_size INTEGER,
+        error TEXT,
+        created_at DATETIME DEFAULT CURRENT_TIMESTAMP NOT NULL,
+        finished_at DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(user_id) REFERENCES users (id) ON DELETE CASCADE
+    )
+    """,
+    "CREATE INDEX ix_downloads_status ON downloads (status)",
+    "CREATE INDEX ix_downloads_user_id ON downloads (user_id)",
+]
+
+
+def test_upgrade_schema_adds_columns_to_existing_tables(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        for ddl in FIRST_RELEASE_SCHEMA:
+            conn.exec_driver_sql(ddl)
+        conn.exec_driver_sql("INSERT INTO users (id, telegram_id) VALUES (1, 100)")
+        conn.exec_driver_sql(
+            "INSERT INTO downloads (id, user_id, url, status) VALUES (1, 1, 'https://youtu.be/x', 'done')"
+        )
+
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+    # повторный запуск (следующий старт бота) ничего не меняет
+    with engine.begin() as conn:
+        upgrade_schema(conn)
+
+    columns = {c["name"] for c in inspect(engine).get_columns("downloads")}
+    assert set(Download.__table__.columns.keys()) <= columns
+    indexes = {i["name"] for i in inspect(engine).get_indexes("downloads")}
+    assert {
+        "ix_downloads_batch_id",
+        "ix_downloads_video_id",
+        "ix_downloads_user_created",
+        "ix_downloads_file_path",
+    } <= indexes
+    assert inspect(engine).has_table("batches")
+
+    with Session(engine) as session:
+        old = session.get(Download, 1)
+        # server_default заполнил новые NOT NULL колонки у старых строк
+        assert old.status == DownloadStatus.done
+        assert old.kind == MediaKind.video
+        assert old.priority == 1
+        assert old.batch_id is None and old.bytes_done is None and old.ready_path is None
+
+        session.add(Download(user_id=1, url="https://youtu.be/y", video_id="y", kind=MediaKind.audio, batch_id=None))
+        session.commit()
+        assert session.scalar(select(Download.kind).where(Download.video_id == "y")) == MediaKind.audio
+    engine.dispose()
@@ -0,0 +1,134 @@
+# tests/test_delivery.py
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import FSInputFile
+
+from sqlalchemy import delete
+
+from bot_app import delivery, worker
+from bot_app.cache import download_cache
+from bot_app.db import AsyncSessionLocal
+from bot_app.downloader import YTDLP_FORMAT
+from bot_app.models import DownloadStatus, TelegramFile
+from bot_app.outbox import Outbox
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+class FakeBot:
+    """
+    Вместо aiogram.Bot: запоминает отправленное и отвечает, как Telegram
+    после upload. stale — file_id, которые Telegram больше не принимает.
+    """
+
+    def __init__(self, stale=()) -> None:
+        self.videos = []
+        self.texts = []
+        self.stale = set(stale)
+        self._uploads = 0
+
+    async def send_video(self, chat_id, video, caption=None, **kwargs):
+        if isinstance(video, str) and video in self.stale:
+            raise TelegramBadRequest(method=None, message="wrong file identifier")
+        self.videos.append((chat_id, video))
+        if isinstance(video, FSInputFile):
+            self._uploads += 1
+            video = f"file-{self._uploads}"
+        media = SimpleNamespace(file_id=video, file_unique_id=f"u-{video}")
+        return SimpleNamespace(video=media, document=None)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        self.texts.append((chat_id, text))
+
+
+@pytest.fixture(autouse=True)
+def no_file_ids(run, db):
+    async def clear():
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(TelegramFile))
+            await session.commit()
+
+    run(clear())
+
+
+@pytest.fixture
+def bot(run, monkeypatch):
+    """
+    FakeBot за отдельным outbox без ограничений скорости (delivery шлёт через него).
+    """
+    fake = FakeBot()
+    box = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+    monkeypatch.setattr(delivery, "outbox", box)
+
+    async def start():
+        box.start(fake)
+
+    run(start())
+    yield fake
+    run(box.stop())
+
+
+@pytest.fixture
+def ready(rows, tmp_path):
+    """
+    ready(video_id=VIDEO_ID) -> ID готовой загрузки с файлом на диске.
+    """
+    path = tmp_path / "ready.mp4"
+    path.write_bytes(b"video")
+
+    def make(video_id=VIDEO_ID, **values):
+        values.setdefault("file_path", str(path))
+        return rows(1, status=DownloadStatus.done, video_id=video_id, chat_id=500, **values)
+
+    return make
+
+
+def test_first_delivery_uploads_and_repeats_reuse_file_id(run, bot, ready):
+    run(delivery.deliver(ready()))
+    assert len(bot.videos) == 1 and isinstance(bot.videos[0][1], FSInputFile)
+    assert run(delivery.get_file_id(VIDEO_ID)) == "file-1"
+
+    # повторный запрос того же видео — по file_id, без upload
+    run(delivery.deliver(ready(file_path=None)))
+    assert bot.videos[1] == (500, "file-1")
+    assert bot.texts == []
+
+
+def test_stale_file_id_is_forgotten_and_file_uploaded_again(run, bot, ready):
+    run(delivery.deliver(ready()))
+
+    bot.stale.add("file-1")
+    run(delivery.deliver(ready()))
+
+    assert isinstance(bot.videos[1][1], FSInputFile)
+    assert run(delivery.get_file_id(VIDEO_ID)) == "file-2"
+
+
+def test_file_id_is_per_format(run, bot, ready):
+    run(delivery.deliver(ready()))
+
+    assert run(delivery.get_file_id(VIDEO_ID, YTDLP_FORMAT)) == "file-1"
+    assert run(delivery.get_file_id(VIDEO_ID, "bestaudio")) is None
+
+
+def test_missing_file_and_failed_job_are_reported(run, bot, rows, ready):
+    run(delivery.deliver(ready(file_path="/nonexistent/video.mp4")))
+    failed = rows(1, status=DownloadStatus.failed)
+    run(delivery.deliver(failed))
+
+    assert bot.videos == []
+    # без chat_id — в личку пользователя (telegram_id = 1001)
+    assert [chat for chat, _ in bot.texts] == [500, 1001]
+    assert "більше недоступний" in bot.texts[0][1]
+    assert f"ID {failed}" in bot.texts[1][1]
+
+
+def test_known_file_id_completes_job_without_local_file(run, bot, rows, row, ready):
+    download_cache.clear()
+    run(delivery.deliver(ready()))
+    download_id = rows(2, status=DownloadStatus.processing, worker_id=worker.WORKER_ID, video_id=VIDEO_ID)
+
+    assert run(worker._complete_from_cache(worker.Job(download_id, VIDEO_ID)))
+    assert row(download_id).status == DownloadStatus.done
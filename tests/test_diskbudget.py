@@ -0,0 +1,131 @@
+# tests/test_diskbudget.py
+import pytest
+from sqlalchemy import delete, text
+
+from bot_app import diskbudget
+from bot_app.cache import download_cache
+from bot_app.db import AsyncSessionLocal
+from bot_app.diskbudget import DiskBudget
+from bot_app.downloader import YTDLP_AUDIO_FORMAT, YTDLP_FORMAT
+from bot_app.models import DownloadStatus, MediaKind, StoredFile
+
+
+@pytest.fixture(autouse=True)
+def empty_index(run, db, monkeypatch):
+    # touch() сразу после register() пишет в БД, а не ждёт TOUCH_INTERVAL
+    monkeypatch.setattr(diskbudget, "TOUCH_INTERVAL", 0)
+    download_cache.clear()
+
+    async def clear():
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(StoredFile))
+            await session.commit()
+
+    run(clear())
+
+
+@pytest.fixture
+def stored(run, rows, tmp_path):
+    """
+    stored(budget, name, size) -> (путь, ID загрузки): готовый файл
+    зарегистрирован в бюджете и лежит в кеше.
+    """
+    def make(budget, name, size):
+        path = tmp_path / f"{name}.mp4"
+        path.write_bytes(b"x" * size)
+        download_id = rows(1, status=DownloadStatus.done, video_id=name, file_path=str(path), file_size=size)
+        download_cache.put(name, YTDLP_FORMAT, path, size)
+        run(budget.register(path, size, name))
+        return path, download_id
+
+    return make
+
+
+def test_register_evicts_least_recently_used(run, row, stored, tmp_path):
+    budget = DiskBudget(root=tmp_path, max_bytes=250)
+    a, a_id = stored(budget, "a", 100)
+    b, _ = stored(budget, "b", 100)
+    assert budget.used == 200
+
+    # третий файл не влезает — уходит самый давний (a), сам новый остаётся
+    c, _ = stored(budget, "c", 100)
+
+    assert not a.exists() and b.exists() and c.exists()
+    assert budget.used == 200
+    d = row(a_id)
+    assert d.file_path is None and d.evicted_at is not None
+    assert download_cache.get("a", YTDLP_FORMAT) is None
+
+    # b снова понадобился — следующим уходит c
+    run(budget.touch(b))
+    stored(budget, "d", 100)
+
+    assert b.exists() and not c.exists()
+    assert download_cache.get("b", YTDLP_FORMAT) is not None
+
+
+def test_eviction_clears_every_download_of_the_file(run, rows, row, stored, tmp_path):
+    budget = DiskBudget(root=tmp_path, max_bytes=150)
+    a, leader = stored(budget, "a", 100)
+    # попадание в кеш: вторая загрузка ссылается на тот же файл
+    hit = rows(2, status=DownloadStatus.done, video_id="a", file_path=str(a), file_size=100)
+
+    stored(budget, "b", 100)
+
+    assert not a.exists()
+    assert all(row(i).file_path is None and row(i).evicted_at is not None for i in (leader, hit))
+
+
+def test_eviction_finds_downloads_by_index(run, db):
+    async def plan():
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(
+                text("EXPLAIN QUERY PLAN UPDATE downloads SET file_path = NULL WHERE file_path = 'x'")
+            )
+            return " ".join(str(r[-1]) for r in q.all())
+
+    assert "ix_downloads_file_path" in run(plan())
+
+
+def test_load_backfills_index_from_finished_downloads(run, rows, tmp_path):
+    path = tmp_path / "old.mp4"
+    path.write_bytes(b"x" * 70)
+    rows(1, status=DownloadStatus.done, video_id="old", file_path=str(path))
+    # файла уже нет, загрузка не закончена — в индекс не попадают
+    rows(1, status=DownloadStatus.done, video_id="gone", file_path=str(tmp_path / "gone.mp4"))
+    rows(1, status=DownloadStatus.processing, file_path=str(path))
+    budget = DiskBudget(root=tmp_path, max_bytes=1000)
+
+    assert run(budget.load()) == 70
+    # повторный запуск не дублирует индекс
+    assert run(DiskBudget(root=tmp_path, max_bytes=1000).load()) == 70
+
+
+def test_load_backfill_indexes_audio_under_its_format(run, rows, tmp_path):
+    video, audio = tmp_path / "v.mp4", tmp_path / "a.m4a"
+    video.write_bytes(b"x" * 100)
+    audio.write_bytes(b"x" * 100)
+    rows(1, status=DownloadStatus.done, video_id="clip", file_path=str(video))
+    rows(1, status=DownloadStatus.done, video_id="clip", kind=MediaKind.audio, file_path=str(audio))
+    download_cache.put("clip", YTDLP_FORMAT, video, 100)
+    download_cache.put("clip", YTDLP_AUDIO_FORMAT, audio, 100)
+    budget = DiskBudget(root=tmp_path, max_bytes=1000)
+    run(budget.load())
+
+    # вытесняем аудио: из кеша уходит именно аудиозапись
+    budget.max_bytes = 150
+    run(budget.touch(video))
+    assert run(budget.enforce(keep=(str(video),))) == 1
+
+    assert not audio.exists() and video.exists()
+    assert download_cache.get("clip", YTDLP_AUDIO_FORMAT) is None
+    assert download_cache.get("clip", YTDLP_FORMAT) is not None
+
+
+def test_disabled_budget_never_evicts(run, stored, tmp_path):
+    budget = DiskBudget(root=tmp_path)
+    paths = [stored(budget, name, 100)[0] for name in ("a", "b")]
+
+    assert not budget.enabled
+    assert run(budget.enforce()) == 0
+    assert all(p.exists() for p in paths)
@@ -0,0 +1,110 @@
+# tests/test_executors.py
+import os
+import subprocess
+import sys
+
+import pytest
+
+from bot_app import downloader
+from bot_app.downloader import DownloadError, ProcessExecutor, SubprocessExecutor, ThreadExecutor
+
+OPTS = {
+    "format": "mp4",
+    "outtmpl": "/tmp/x/1.%(ext)s",
+    "merge_output_format": "mp4",
+    "retries": 3,
+    "nocheckcertificate": True,
+    "geo_bypass": True,
+    "continuedl": True,
+}
+
+
+def test_cli_args_mirror_ydl_opts():
+    args = downloader._ytdlp_cli_args("https://youtu.be/x", OPTS)
+
+    assert args[: len(downloader.YTDLP_CMD)] == downloader.YTDLP_CMD
+    assert args[-2:] == ["--", "https://youtu.be/x"]
+    for flag, value in (("-f", "mp4"), ("-o", OPTS["outtmpl"]), ("--retries", "3")):
+        assert args[args.index(flag) + 1] == value
+    assert {"--no-check-certificates", "--geo-bypass", "--continue"} <= set(args)
+
+
+def test_create_executor_by_name():
+    assert isinstance(downloader._create_executor("thread"), ThreadExecutor)
+    assert isinstance(downloader._create_executor("process"), ProcessExecutor)
+    assert isinstance(downloader._create_executor("subprocess"), SubprocessExecutor)
+    with pytest.raises(ValueError):
+        downloader._create_executor("gpu")
+
+
+def _fake_cli(monkeypatch, code):
+    # вместо yt-dlp — python -c code; аргументы yt-dlp уходят в sys.argv
+    monkeypatch.setattr(downloader, "YTDLP_CMD", [sys.executable, "-c", code])
+
+
+def test_subprocess_executor_returns_printed_path(run, monkeypatch):
+    _fake_cli(monkeypatch, "print('[info] merging'); print('/tmp/x/1.mp4')")
+
+    assert run(SubprocessExecutor(1).download("https://youtu.be/x", OPTS)) == "/tmp/x/1.mp4"
+
+
+def test_subprocess_executor_raises_last_stderr_line(run, monkeypatch):
+    _fake_cli(monkeypatch, "import sys; sys.stderr.write('WARNING: x\\nERROR: Video unavailable\\n'); sys.exit(1)")
+
+    with pytest.raises(DownloadError, match="^ERROR: Video unavailable$"):
+        run(SubprocessExecutor(1).download("https://youtu.be/x", OPTS))
+
+
+def test_thread_executor_wraps_ytdlp_errors(run, monkeypatch):
+    class YoutubeDL:
+        def __init__(self, opts):
+            pass
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *exc):
+            return False
+
+        def extract_info(self, url, download):
+            raise KeyError("format")
+
+    monkeypatch.setattr(downloader, "_new_ydl", YoutubeDL)
+
+    # исключение yt-dlp превращается в DownloadError с его текстом
+    with pytest.raises(DownloadError, match="format"):
+        run(ThreadExecutor().download("https://youtu.be/x", OPTS))
+
+
+def test_importing_downloader_does_not_load_ytdlp():
+    code = "import sys, bot_app.downloader; print('yt_dlp' in sys.modules)"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=os.path.dirname(os.path.dirname(downloader.__file__)),
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert out.stdout.strip() == "False"
+
+
+def test_pooled_ydl_reuses_instances_per_options(monkeypatch):
+    created = []
+
+    def new_ydl(opts):
+        created.append(opts)
+        return object()
+
+    monkeypatch.setattr(downloader, "_new_ydl", new_ydl)
+    monkeypatch.setattr(downloader, "_ydl_pools", {})
+
+    with downloader._pooled_ydl({"a": 1}) as first:
+        # одновременный вызов получает свой экземпляр
+        with downloader._pooled_ydl({"a": 1}) as second:
+            assert second is not first
+    with downloader._pooled_ydl({"a": 1}) as again:
+        assert again in (first, second)
+    with downloader._pooled_ydl({"a": 2}):
+        pass
+
+    assert len(created) == 3
@@ -0,0 +1,119 @@
+# tests/test_fsm.py
+import asyncio
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+from sqlalchemy import delete, func, select
+
+from bot_app.db import AsyncSessionLocal
+from bot_app.fsm import SQLAlchemyStorage
+from bot_app.models import FsmState
+
+KEY = StorageKey(bot_id=1, chat_id=10, user_id=10)
+
+
+@pytest.fixture(autouse=True)
+def no_states(run, db):
+    async def clear():
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(FsmState))
+            await session.commit()
+
+    run(clear())
+
+
+async def _stored():
+    async with AsyncSessionLocal() as session:
+        q = await session.execute(select(FsmState.key, FsmState.state, FsmState.data))
+        return {key: (state, data) for key, state, data in q.all()}
+
+
+def test_writes_are_batched_behind_the_cache(run):
+    storage = SQLAlchemyStorage(flush_interval=60)
+
+    async def scenario():
+        await storage.set_state(KEY, "Form:url")
+        await storage.update_data(KEY, {"step": 1})
+        await storage.update_data(KEY, {"step": 2})
+        # чтение — из кеша, в БД ещё ничего
+        before = (await storage.get_state(KEY), await storage.get_data(KEY), await _stored())
+        assert await storage.flush() == 1
+        after = await _stored()
+        await storage.close()
+        return before, after
+
+    before, after = run(scenario())
+
+    assert before == ("Form:url", {"step": 2}, {})
+    assert list(after.values()) == [("Form:url", {"step": 2})]
+
+
+def test_flush_batch_wakes_the_flusher(run):
+    storage = SQLAlchemyStorage(flush_interval=60, flush_batch=3)
+
+    async def scenario():
+        for user in range(3):
+            await storage.set_state(StorageKey(bot_id=1, chat_id=user, user_id=user), "Form:url")
+        # не ждём flush_interval: пачка набралась
+        for _ in range(50):
+            if len(await _stored()) == 3:
+                break
+            await asyncio.sleep(0.01)
+        await storage.close()
+        return len(await _stored())
+
+    assert run(scenario()) == 3
+
+
+def test_other_replica_sees_write_after_flush_and_cache_ttl(run):
+    writer = SQLAlchemyStorage(flush_interval=60)
+    reader = SQLAlchemyStorage(cache_ttl=0.05)
+
+    async def scenario():
+        assert await reader.get_state(KEY) is None
+        await writer.set_state(KEY, "Form:url")
+        await writer.flush()
+        # в пределах cache_ttl реплика отвечает из своего кеша
+        stale = await reader.get_state(KEY)
+        await asyncio.sleep(0.06)
+        fresh = await reader.get_state(KEY)
+        await writer.close()
+        await reader.close()
+        return stale, fresh
+
+    assert run(scenario()) == (None, "Form:url")
+
+
+def test_cleared_state_removes_row_on_flush(run):
+    storage = SQLAlchemyStorage(flush_interval=60)
+
+    async def scenario():
+        await storage.set_state(KEY, "Form:url")
+        await storage.flush()
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        # close() дописывает незаписанное
+        await storage.close()
+        async with AsyncSessionLocal() as session:
+            return (await session.execute(select(func.count()).select_from(FsmState))).scalar_one()
+
+    assert run(scenario()) == 0
+
+
+def test_failed_flush_keeps_keys_dirty(run, monkeypatch):
+    storage = SQLAlchemyStorage(flush_interval=60)
+
+    async def broken(session, rows):
+        raise RuntimeError("database is down")
+
+    async def scenario():
+        await storage.set_state(KEY, "Form:url")
+        monkeypatch.setattr(storage, "_upsert", broken)
+        with pytest.raises(RuntimeError):
+            await storage.flush()
+        monkeypatch.undo()
+        assert await storage.flush() == 1
+        await storage.close()
+        return await _stored()
+
+    assert list(run(scenario()).values()) == [("Form:url", {})]
@@ -0,0 +1,49 @@
+# tests/test_history.py
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert
+
+from bot_app import history
+from bot_app.db import AsyncSessionLocal
+from bot_app.models import Download, DownloadStatus, User
+
+
+def test_history_pages_and_urls_without_video_id(run, db):
+    async def fill():
+        async with AsyncSessionLocal() as session:
+            await session.execute(delete(Download))
+            await session.execute(delete(User))
+            await session.execute(insert(User), [{"id": 1, "telegram_id": 1001}])
+            start = datetime(2024, 1, 1)
+            await session.execute(
+                insert(Download),
+                [
+                    {
+                        "id": n,
+                        "user_id": 1,
+                        "url": f"https://example.com/v{n}",
+                        # у каждой третьей загрузки ID видео неизвестен
+                        "video_id": None if n % 3 == 0 else f"vid{n:08d}",
+                        "status": DownloadStatus.done,
+                        "created_at": start + timedelta(minutes=n),
+                    }
+                    for n in range(1, 8)
+                ],
+            )
+            await session.commit()
+
+    run(fill())
+    first = run(history.fetch_page(1, page_size=3))
+    assert [row.id for row in first.items] == [7, 6, 5]
+    assert first.newer is None and first.older is not None
+    # url дочитан только для строки без video_id
+    assert first.urls == {6: "https://example.com/v6"}
+    text = history.page_text(first)
+    assert "https://example.com/v6" in text and "https://youtu.be/vid00000007" in text
+
+    second = run(history.fetch_page(1, first.older, page_size=3))
+    assert [row.id for row in second.items] == [4, 3, 2]
+    assert second.urls == {3: "https://example.com/v3"}
+
+    back = run(history.fetch_page(1, second.newer, page_size=3))
+    assert [row.id for row in back.items] == [7, 6, 5]
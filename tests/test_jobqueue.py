@@ -0,0 +1,284 @@
+# tests/test_jobqueue.py
+import asyncio
+from datetime import datetime, timedelta
+
+from sqlalchemy import update
+
+from bot_app.db import AsyncSessionLocal
+from bot_app.jobqueue import WORKER_ID, PRIORITY_HIGH, DbQueue, FairScheduler, Job, MemoryQueue
+from bot_app.models import Download, DownloadStatus
+from bot_app.statuswriter import StatusWriter
+
+
+def _claim_all(run, queue):
+    claimed = []
+    while (job := run(queue._claim())) is not None:
+        claimed.append(job)
+    return claimed
+
+
+# ------------------------------------------------------------
+# FairScheduler
+# ------------------------------------------------------------
+def _drain(scheduler):
+    popped = []
+    while (job := scheduler.pop()) is not None:
+        popped.append(job.download_id)
+    return popped
+
+
+def test_scheduler_round_robin_across_users():
+    scheduler = FairScheduler(per_user_limit=10)
+    # пользователь 1 поставил всё раньше остальных
+    for n in range(1, 4):
+        scheduler.push(Job(download_id=n, user_id=1))
+    scheduler.push(Job(download_id=4, user_id=2))
+    scheduler.push(Job(download_id=5, user_id=3))
+    scheduler.push(Job(download_id=6, user_id=2))
+
+    assert len(scheduler) == 6
+    assert _drain(scheduler) == [1, 4, 5, 2, 6, 3]
+    assert len(scheduler) == 0
+
+
+def test_scheduler_serves_high_priority_first():
+    scheduler = FairScheduler(per_user_limit=10)
+    scheduler.push(Job(download_id=1, user_id=1))
+    scheduler.push(Job(download_id=2, user_id=2))
+    scheduler.push(Job(download_id=3, user_id=2, priority=PRIORITY_HIGH))
+    scheduler.push(Job(download_id=4, user_id=1, priority=PRIORITY_HIGH))
+
+    # короткие ролики — раньше; дальше круг продолжается с того, кого
+    # обслужили давнее всех (пользователь 2)
+    assert _drain(scheduler) == [3, 4, 2, 1]
+
+
+def test_scheduler_per_user_limit_and_release():
+    scheduler = FairScheduler(per_user_limit=1)
+    first, second = Job(download_id=1, user_id=1), Job(download_id=2, user_id=1)
+    scheduler.push(first)
+    scheduler.push(second)
+    scheduler.push(Job(download_id=3, user_id=2))
+
+    assert _drain(scheduler) == [1, 3]
+    # вторая задача пользователя 1 ждёт, пока первая не завершится
+    assert len(scheduler) == 1 and scheduler.pop() is None
+
+    scheduler.release(first)
+    assert scheduler.pop() is second
+
+
+def test_scheduler_jobs_without_user_do_not_share_a_lane():
+    scheduler = FairScheduler(per_user_limit=1)
+    for n in (1, 2, 3):
+        scheduler.push(Job(download_id=n))
+
+    assert _drain(scheduler) == [1, 2, 3]
+
+
+# ------------------------------------------------------------
+# DbQueue: порядок захвата
+# ------------------------------------------------------------
+def test_db_claim_round_robin_across_users(run, rows, row):
+    ids = {user: [rows(user) for _ in range(3)] for user in (1, 2, 3)}
+    queue = DbQueue(per_user_limit=2)
+
+    claimed = _claim_all(run, queue)
+
+    # по кругу, по старшинству внутри пользователя; третья задача каждого
+    # ждёт, пока освободится слот
+    assert [j.download_id for j in claimed] == [
+        ids[1][0], ids[2][0], ids[3][0], ids[1][1], ids[2][1], ids[3][1],
+    ]
+    assert row(ids[1][2]).status == DownloadStatus.pending
+
+
+def test_db_claim_serves_high_priority_first(run, rows):
+    normal = rows(1)
+    high = [rows(2, priority=PRIORITY_HIGH), rows(3, priority=PRIORITY_HIGH)]
+    queue = DbQueue(per_user_limit=2)
+
+    claimed = [j.download_id for j in _claim_all(run, queue)]
+
+    assert claimed == [*high, normal]
+
+
+def test_db_claim_skips_busy_users_and_ignores_followers(run, rows, row):
+    # у пользователя 1 уже две задачи в работе — его очередь ждёт
+    rows(1, status=DownloadStatus.processing)
+    rows(1, status=DownloadStatus.processing)
+    waiting = rows(1)
+    # ведомая задача (ждёт лидера) слот не занимает
+    rows(2, status=DownloadStatus.processing, leader_id=1)
+    other = rows(2)
+    queue = DbQueue(per_user_limit=2)
+
+    claimed = [j.download_id for j in _claim_all(run, queue)]
+
+    assert claimed == [other]
+    assert row(waiting).status == DownloadStatus.pending
+
+
+def test_db_claim_resumes_after_cursor(run, rows):
+    first = [rows(user) for user in (1, 2, 3)]
+    queue = DbQueue(per_user_limit=5)
+    assert run(queue._claim()).download_id == first[0]
+
+    # новая задача пользователя 1 не обгоняет пользователей 2 и 3
+    again = rows(1)
+    claimed = [j.download_id for j in _claim_all(run, queue)]
+
+    assert claimed == [first[1], first[2], again]
+
+
+# ------------------------------------------------------------
+# DbQueue: захват, lease, heartbeat, reaper, recover
+# ------------------------------------------------------------
+def test_db_claim_takes_oldest_row_with_lease(run, rows, row):
+    first = rows(1, video_id="abc")
+    second = rows(2)
+    rows(3, status=DownloadStatus.done)
+    queue = DbQueue(lease_seconds=60)
+
+    job = run(queue._claim())
+
+    assert (job.download_id, job.video_id) == (first, "abc")
+    d = row(first)
+    assert (d.status, d.worker_id) == (DownloadStatus.processing, WORKER_ID)
+    assert d.lease_until > datetime.utcnow() + timedelta(seconds=50)
+    assert [j.download_id for j in _claim_all(run, queue)] == [second]
+
+
+def test_db_heartbeat_extends_only_own_lease(run, rows, row):
+    queue = DbQueue(lease_seconds=60)
+    rows(1)
+    job = run(queue._claim())
+    before = row(job.download_id).lease_until
+    stolen = rows(2, status=DownloadStatus.processing, worker_id="other:1", lease_until=before)
+
+    assert run(queue._heartbeat(job))
+    assert row(job.download_id).lease_until >= before
+    # чужая задача и задача, уже вернувшаяся в pending, не продлеваются
+    assert not run(queue._heartbeat(Job(download_id=stolen)))
+    assert row(stolen).lease_until == before
+    assert not run(queue._heartbeat(Job(download_id=rows(3))))
+
+
+def test_db_lease_keeps_row_alive(run, rows, row):
+    rows(1)
+    queue = DbQueue(lease_seconds=0.3)
+    job = run(queue._claim())
+
+    async def hold():
+        async with queue.lease(job):
+            await asyncio.sleep(0.5)
+
+    run(hold())
+
+    # без heartbeat lease истёк бы через 0.3 с, и reaper вернул бы задачу
+    assert run(queue.requeue_expired()) == 0
+    assert row(job.download_id).status == DownloadStatus.processing
+
+
+def test_db_lost_lease_cancels_job_and_blocks_stale_writes(run, rows, row):
+    rows(1)
+    queue = DbQueue(lease_seconds=0.3)
+    job = run(queue._claim())
+    writer = StatusWriter(interval=0)
+
+    async def steal():
+        # reaper вернул строку, её забрал другой процесс
+        async with AsyncSessionLocal() as session:
+            await session.execute(
+                update(Download).where(Download.id == job.download_id).values(worker_id="other:1")
+            )
+            await session.commit()
+
+    async def hold():
+        try:
+            async with queue.lease(job):
+                await steal()
+                await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            # как _checkpoint в worker: запись старого владельца не применяется
+            await writer.write(job.download_id, owner=queue.owner, status=DownloadStatus.failed)
+            raise
+        finally:
+            await writer.close()
+
+    async def check():
+        task = asyncio.create_task(hold())
+        await asyncio.wait_for(asyncio.gather(task, return_exceptions=True), timeout=1)
+        return task.cancelled()
+
+    assert run(check())
+    d = row(job.download_id)
+    assert (d.status, d.worker_id) == (DownloadStatus.processing, "other:1")
+
+
+def test_db_requeue_expired_returns_abandoned_rows(run, rows, row):
+    now = datetime.utcnow()
+    expired = rows(1, status=DownloadStatus.processing, worker_id="other:1", lease_until=now - timedelta(seconds=1))
+    legacy = rows(2, status=DownloadStatus.processing)
+    alive = rows(3, status=DownloadStatus.processing, worker_id="other:1", lease_until=now + timedelta(seconds=60))
+    queue = DbQueue()
+
+    assert run(queue.requeue_expired()) == 2
+
+    for download_id in (expired, legacy):
+        d = row(download_id)
+        assert (d.status, d.worker_id, d.lease_until) == (DownloadStatus.pending, None, None)
+    assert row(alive).status == DownloadStatus.processing
+    # вернувшиеся задачи снова можно захватить
+    assert [j.download_id for j in _claim_all(run, queue)] == [expired, legacy]
+
+
+def test_db_recover_returns_own_and_expired_rows(run, rows, row):
+    later = datetime.utcnow() + timedelta(seconds=60)
+    own = rows(1, status=DownloadStatus.processing, worker_id=WORKER_ID, lease_until=later)
+    other = rows(2, status=DownloadStatus.processing, worker_id="other:1", lease_until=later)
+    expired = rows(3, status=DownloadStatus.processing, worker_id="other:1", lease_until=datetime.utcnow())
+    queue = DbQueue()
+
+    assert run(queue.recover()) == 1
+
+    assert (row(own).status, row(own).worker_id) == (DownloadStatus.pending, None)
+    assert row(expired).status == DownloadStatus.pending
+    # живой lease другого процесса не трогаем
+    assert row(other).status == DownloadStatus.processing
+
+
+def test_db_get_wakes_on_put(run, rows):
+    queue = DbQueue(poll_interval=30)
+
+    async def scenario():
+        getter = asyncio.create_task(queue.get())
+        await asyncio.sleep(0.05)
+        assert not getter.done()
+        async with AsyncSessionLocal() as session:
+            d = Download(user_id=1, url="https://youtu.be/u1", status=DownloadStatus.pending)
+            session.add(d)
+            await session.commit()
+        # без put() воркер заметил бы задачу только через poll_interval
+        await queue.put(Job(download_id=d.id))
+        return d.id, await asyncio.wait_for(getter, timeout=5)
+
+    download_id, job = run(scenario())
+    assert job.download_id == download_id
+
+
+# ------------------------------------------------------------
+# MemoryQueue
+# ------------------------------------------------------------
+def test_memory_recover_requeues_processing_and_pending(run, rows, row):
+    pending = rows(1)
+    processing = rows(2, status=DownloadStatus.processing, worker_id="old:1")
+    rows(3, status=DownloadStatus.done)
+    queue = MemoryQueue()
+
+    assert run(queue.recover()) == 2
+    # повторный recover не дублирует задачи в очереди
+    assert run(queue.recover()) == 2
+
+    assert row(processing).status == DownloadStatus.pending
+    assert [run(queue.get()).download_id for _ in range(2)] == [pending, processing]
@@ -0,0 +1,110 @@
+# tests/test_metadata.py
+import asyncio
+
+import pytest
+
+from bot_app import metadata
+from bot_app.downloader import DownloadError
+from bot_app.metadata import MetadataCache, estimate_size
+from bot_app.utils import format_duration, format_size
+
+URL = "https://www.youtube.com/watch?v=dQw4w9WgXcQ"
+
+
+async def _prefetch(url):
+    # prefetch() запускает таск — нужен работающий loop
+    return await metadata.prefetch(url)
+
+
+@pytest.fixture
+def extractor(monkeypatch):
+    """
+    Вместо yt-dlp: считает вызовы, отвечает после release.set().
+    Ссылки с "broken" в адресе падают с DownloadError.
+    """
+    calls = []
+    release = asyncio.Event()
+
+    async def extract_metadata(url):
+        calls.append(url)
+        await release.wait()
+        if "broken" in url:
+            raise DownloadError("Video unavailable")
+        return {"id": "dQw4w9WgXcQ", "title": "Song", "thumbnails": [{}] * 50, "heatmap": [{}]}
+
+    monkeypatch.setattr(metadata, "extract_metadata", extract_metadata)
+    monkeypatch.setattr(metadata, "metadata_cache", MetadataCache(ttl=60, max_entries=8))
+    monkeypatch.setattr(metadata, "_pending", {})
+    return calls, release
+
+
+def test_prefetch_shares_one_request_and_strips_heavy_fields(run, extractor):
+    calls, release = extractor
+
+    async def scenario():
+        first = metadata.prefetch(URL)
+        # другая форма ссылки на то же видео — тот же запрос
+        second = metadata.prefetch("https://youtu.be/dQw4w9WgXcQ")
+        waiting = asyncio.create_task(metadata.lookup(URL))
+        await asyncio.sleep(0)
+        release.set()
+        return await first, await second, await waiting
+
+    first, second, looked_up = run(scenario())
+
+    assert calls == [URL]
+    assert first is second is looked_up
+    assert first == {"id": "dQw4w9WgXcQ", "title": "Song"}
+    # дальше — из кеша, без yt-dlp
+    assert run(metadata.lookup(URL)) is first
+    assert run(_prefetch(URL)) is first
+    assert calls == [URL]
+
+
+def test_failed_prefetch_is_not_cached(run, extractor):
+    calls, release = extractor
+    release.set()
+    url = "https://example.com/broken"
+
+    assert run(_prefetch(url)) is None
+    assert run(metadata.lookup(url)) is None
+    assert len(metadata.metadata_cache) == 0
+
+
+def test_lookup_does_not_start_a_request(run, extractor):
+    calls, _ = extractor
+
+    assert run(metadata.lookup(URL)) is None
+    assert calls == []
+
+
+def test_metadata_cache_expires_and_evicts(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(metadata.time, "monotonic", lambda: now[0])
+    cache = MetadataCache(ttl=10, max_entries=2)
+
+    cache.put("a", {"n": 1})
+    cache.put("b", {"n": 2})
+    assert cache.get("a") == {"n": 1}
+    cache.put("c", {"n": 3})
+    # «b» читали давнее всех — вытеснен
+    assert cache.get("b") is None
+
+    now[0] += 11
+    assert cache.get("a") is None and cache.get("c") is None
+    assert len(cache) == 0
+
+
+def test_estimate_size_sums_separate_streams():
+    video = {"filesize": 10_000_000}
+    audio = {"filesize_approx": 1_500_000}
+
+    assert estimate_size({"requested_formats": [video, audio]}) == 11_500_000
+    assert estimate_size({"filesize_approx": 4096.7}) == 4096
+    # размер одного из потоков неизвестен — оценки нет
+    assert estimate_size({"requested_formats": [video, {}]}) is None
+
+
+def test_format_duration_and_size():
+    assert [format_duration(s) for s in (None, 59, 61, 3725)] == ["—", "0:59", "1:01", "1:02:05"]
+    assert [format_size(s) for s in (None, 512, 1536, 5 * 1024 ** 3)] == ["—", "512 B", "1.5 KB", "5.0 GB"]
@@ -0,0 +1,89 @@
+# tests/test_metrics.py
+import pytest
+
+from bot_app import metrics
+from bot_app.metrics import Counter, Gauge, Histogram, Registry, timed
+
+
+def test_disabled_metrics_are_noops_and_timed_does_not_wrap():
+    assert not metrics.METRICS_ENABLED
+    noop = metrics.counter("x_total", "x", ["mode"])
+
+    noop.labels("a").inc()
+    with noop.time():
+        pass
+
+    def fn():
+        return 1
+
+    assert timed(noop)(fn) is fn
+
+
+def test_counter_and_gauge_render_with_labels():
+    jobs = Counter("jobs_total", "Jobs", ["result"])
+    jobs.labels("done").inc()
+    jobs.labels("done").inc(2)
+    jobs.labels('fa"il').inc()
+    depth = Gauge("depth", "Depth")
+    depth.set(5)
+    depth.dec()
+
+    assert jobs.render() == [
+        "# HELP jobs_total Jobs",
+        "# TYPE jobs_total counter",
+        'jobs_total{result="done"} 3',
+        'jobs_total{result="fa\\"il"} 1',
+    ]
+    assert depth.render()[-1] == "depth 4"
+    with pytest.raises(ValueError):
+        jobs.labels("done", "extra")
+
+
+def test_histogram_buckets_are_cumulative():
+    latency = Histogram("latency_seconds", "Latency", buckets=(1, 0.1))
+    for value in (0.05, 0.5, 0.7, 3):
+        latency.observe(value)
+
+    assert latency.render()[2:] == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 3',
+        'latency_seconds_bucket{le="+Inf"} 4',
+        "latency_seconds_sum 4.25",
+        "latency_seconds_count 4",
+    ]
+
+
+def test_timed_observes_sync_and_async_calls(run):
+    seconds = Histogram("call_seconds", "Calls", ["fn"])
+
+    @timed(seconds.labels("sync"))
+    def sync():
+        return "s"
+
+    @timed(seconds.labels("async"))
+    async def coro():
+        return "a"
+
+    assert sync() == "s"
+    assert run(coro()) == "a"
+    assert [seconds.labels(fn).count for fn in ("sync", "async")] == [1, 1]
+
+
+def test_registry_runs_collectors_before_export(run, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_ENABLED", True)
+    registry = Registry()
+    depth = registry.register(Gauge("queue_depth", "Depth"))
+
+    async def collect_depth():
+        depth.set(7)
+
+    async def broken():
+        raise RuntimeError("db is down")
+
+    registry.add_collector(collect_depth)
+    registry.add_collector(collect_depth)
+    registry.add_collector(broken)
+
+    # сломанный сборщик не мешает остальным метрикам
+    assert run(registry.collect()).endswith("queue_depth 7\n")
+    assert len(registry._collectors) == 2
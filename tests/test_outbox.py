@@ -0,0 +1,120 @@
+# tests/test_outbox.py
+import asyncio
+import time
+
+import pytest
+from aiogram.exceptions import TelegramRetryAfter
+
+from bot_app.outbox import MAX_RETRIES, PRIORITY_STATUS, PRIORITY_USER, Outbox, TokenBucket
+
+
+class RecordingBot:
+    """
+    Запоминает (время, вызов) каждого обращения к API; flood — сколько раз
+    подряд ответить TelegramRetryAfter.
+    """
+
+    def __init__(self, flood: int = 0) -> None:
+        self.calls = []
+        self.flood = flood
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.flood:
+            self.flood -= 1
+            raise TelegramRetryAfter(method=None, message="flood", retry_after=0)
+        self.calls.append((time.monotonic(), "send", chat_id, text))
+        return text
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.calls.append((time.monotonic(), "edit", chat_id, text))
+        return text
+
+
+async def _drain(box, bot, futures):
+    # ставим всё до старта диспетчера, чтобы порядок не зависел от планировщика
+    box.start(bot)
+    try:
+        return await asyncio.wait_for(asyncio.gather(*futures), timeout=5)
+    finally:
+        await box.stop()
+
+
+def test_token_bucket_burst_then_rate():
+    bucket = TokenBucket(rate=2, burst=3)
+    now = bucket.updated
+    for _ in range(3):
+        assert bucket.delay(now) == 0
+        bucket.consume()
+
+    assert bucket.delay(now) == 0.5
+    # за полсекунды набежал один токен
+    assert bucket.delay(now + 0.5) == 0
+
+
+def test_chat_rate_limits_one_chat_but_not_others(run):
+    bot = RecordingBot()
+    box = Outbox(global_rate=1000, chat_rate=10, chat_burst=1)
+
+    async def scenario():
+        futures = [box.send_message(1, f"a{n}") for n in range(3)]
+        futures.append(box.send_message(2, "b"))
+        return await _drain(box, bot, futures)
+
+    assert run(scenario()) == ["a0", "a1", "a2", "b"]
+
+    sent = {text: at for at, _, _, text in bot.calls}
+    # третье сообщение в чат 1 ждёт два токена (по 0.1 с), чат 2 — нет
+    assert sent["a2"] - sent["a0"] >= 0.18
+    assert sent["b"] - sent["a0"] < 0.05
+
+
+def test_unsent_edits_of_one_message_are_coalesced(run):
+    bot = RecordingBot()
+    box = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+    async def scenario():
+        futures = [box.edit_message_text(1, 42, f"{n}%") for n in (10, 50, 90)]
+        futures.append(box.edit_message_text(1, 43, "other"))
+        return await _drain(box, bot, futures)
+
+    # все, кто ждал промежуточные edit, получают результат последнего
+    assert run(scenario()) == ["90%", "90%", "90%", "other"]
+    assert [text for *_, text in bot.calls] == ["90%", "other"]
+
+
+def test_user_lane_goes_before_status_lane(run):
+    bot = RecordingBot()
+    box = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+    async def scenario():
+        futures = [
+            box.send_message(1, "status", priority=PRIORITY_STATUS),
+            box.send_message(1, "reply", priority=PRIORITY_USER),
+        ]
+        return await _drain(box, bot, futures)
+
+    run(scenario())
+    assert [text for *_, text in bot.calls] == ["reply", "status"]
+
+
+def test_retry_after_requeues_the_call(run):
+    bot = RecordingBot(flood=2)
+    box = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+    async def scenario():
+        return await _drain(box, bot, [box.send_message(1, "hi")])
+
+    assert run(scenario()) == ["hi"]
+    assert bot.flood == 0 and len(bot.calls) == 1
+
+
+def test_retry_after_gives_up_after_max_retries(run):
+    bot = RecordingBot(flood=MAX_RETRIES + 1)
+    box = Outbox(global_rate=1000, chat_rate=1000, chat_burst=1000)
+
+    async def scenario():
+        return await _drain(box, bot, [box.send_message(1, "hi")])
+
+    with pytest.raises(TelegramRetryAfter):
+        run(scenario())
+    assert bot.calls == []
@@ -0,0 +1,320 @@
+# tests/test_postprocess.py
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+import pytest
+
+from bot_app import worker
+from bot_app.jobqueue import Job
+from bot_app.models import DownloadStatus
+
+from bot_app.postprocess import (
+    AUDIO_BITRATE,
+    MIN_VIDEO_BITRATE,
+    SIZE_HEADROOM,
+    Plan,
+    PostprocessError,
+    media_info,
+    plan_audio,
+    plan_video,
+)
+
+MB = 1024 * 1024
+LIMIT = 50 * MB
+MP4 = "mov,mp4,m4a,3gp,3g2,mj2"
+WEBM = "matroska,webm"
+
+
+def probe(container, duration=None, video=None, audio=None, height=1080, cover=False):
+    """
+    Ответ ffprobe -show_format -show_streams в том виде, в каком его
+    разбирает media_info. video/audio — (кодек, битрейт или None).
+    """
+    streams = []
+    if cover:
+        # обложка аудиофайла — не видеопоток
+        streams.append({"codec_type": "video", "codec_name": "mjpeg", "disposition": {"attached_pic": 1}})
+    if video:
+        streams.append({"codec_type": "video", "codec_name": video[0], "height": height, "bit_rate": video[1]})
+    if audio:
+        streams.append({"codec_type": "audio", "codec_name": audio[0], "bit_rate": audio[1]})
+    fmt = {"format_name": container}
+    if duration is not None:
+        fmt["duration"] = str(duration)
+    return {"format": fmt, "streams": streams}
+
+
+def _fit(duration, limit=LIMIT):
+    return int(limit * 8 * SIZE_HEADROOM / duration)
+
+
+def test_media_info_reads_streams_and_skips_cover_art():
+    info = media_info(probe(MP4, 12.5, ("h264", "900000"), ("aac", None), height=720, cover=True), 10 * MB)
+
+    assert (info.container, info.size, info.duration) == (MP4, 10 * MB, 12.5)
+    assert (info.vcodec, info.height, info.video_bitrate) == ("h264", 720, 900000)
+    assert (info.acodec, info.audio_bitrate) == ("aac", None)
+
+    audio_only = media_info(probe("mp3", audio=("mp3", "N/A"), cover=True), MB)
+    assert (audio_only.vcodec, audio_only.duration, audio_only.audio_bitrate) == (None, None, None)
+
+
+# ------------------------------------------------------------
+# plan_video
+# ------------------------------------------------------------
+def test_plan_video_keeps_compatible_mp4():
+    info = media_info(probe(MP4, 60, ("h264", 1_000_000), ("aac", 128_000)), 10 * MB)
+
+    assert plan_video(info, LIMIT) == Plan("keep", "mp4")
+
+
+def test_plan_video_remuxes_other_containers_and_codecs():
+    mkv = media_info(probe(WEBM, 60, ("h264", None), ("aac", None)), 10 * MB)
+    assert plan_video(mkv, LIMIT) == Plan("remux", "mp4", video="copy", audio="copy", audio_bitrate=AUDIO_BITRATE)
+
+    # видео подходит, звук (opus) — нет: перекодируется только звук
+    opus = media_info(probe(MP4, 60, ("h264", None), ("opus", None)), 10 * MB)
+    assert plan_video(opus, LIMIT) == Plan("remux", "mp4", video="copy", audio="encode", audio_bitrate=AUDIO_BITRATE)
+
+    silent = media_info(probe(WEBM, 60, ("hevc", None)), 10 * MB)
+    assert plan_video(silent, LIMIT) == Plan("remux", "mp4", video="copy", audio=None, audio_bitrate=AUDIO_BITRATE)
+
+
+def test_plan_video_transcodes_incompatible_codec_at_source_bitrate():
+    info = media_info(probe(WEBM, 60, ("vp9", 2_000_000), ("opus", 160_000), height=1080), 16 * MB)
+
+    plan = plan_video(info, LIMIT)
+
+    assert plan == Plan(
+        "transcode", "mp4", video="encode", audio="encode",
+        video_bitrate=2_000_000, audio_bitrate=AUDIO_BITRATE, height=None,
+    )
+
+
+def test_plan_video_shrinks_oversized_file_to_limit():
+    info = media_info(probe(MP4, 600, ("h264", 1_500_000), ("aac", 128_000), height=1080), 120 * MB)
+
+    plan = plan_video(info, LIMIT)
+
+    # общий битрейт под лимит минус копируемый звук; при таком битрейте 1080p -> 720p
+    assert (plan.action, plan.video, plan.audio) == ("transcode", "encode", "copy")
+    assert plan.video_bitrate == _fit(600) - 128_000
+    assert plan.audio_bitrate == 128_000
+    assert plan.height == 720
+
+
+def test_plan_video_bitrate_from_size_and_floor():
+    # битрейт видео неизвестен — считается по размеру и длительности
+    info = media_info(probe(WEBM, 100, ("vp9", None)), 5 * MB)
+    plan = plan_video(info, LIMIT)
+    assert (plan.audio, plan.audio_bitrate) == (None, None)
+    assert plan.video_bitrate == int(5 * MB * 8 / 100)
+
+    # совсем низкий битрейт — не ниже MIN_VIDEO_BITRATE и с уменьшением до 480p
+    tiny = media_info(probe(WEBM, 100, ("vp9", 50_000)), MB)
+    plan = plan_video(tiny, LIMIT)
+    assert (plan.video_bitrate, plan.height) == (MIN_VIDEO_BITRATE, 480)
+
+
+def test_plan_video_does_not_transcode_hopeless_size():
+    # трёхчасовой ролик в предел не влезет ни при каком разумном битрейте
+    info = media_info(probe(MP4, 3 * 3600, ("h264", None), ("aac", None)), 800 * MB)
+
+    assert plan_video(info, LIMIT) == Plan("keep", "mp4")
+    # limit=0 — предела нет
+    assert plan_video(media_info(probe(MP4, 600, ("h264", None), ("aac", None)), 800 * MB), 0) == Plan("keep", "mp4")
+
+
+def test_plan_video_without_video_stream_keeps_file():
+    info = media_info(probe("mp3", 60, audio=("mp3", None), cover=True), MB)
+
+    assert plan_video(info, LIMIT) == Plan("keep", "mp4")
+
+
+# ------------------------------------------------------------
+# plan_audio
+# ------------------------------------------------------------
+def test_plan_audio_keeps_or_extracts_compatible_track():
+    m4a = media_info(probe(MP4, 180, audio=("aac", 128_000)), 3 * MB)
+    assert plan_audio(m4a, LIMIT) == Plan("keep", "m4a")
+
+    mp3 = media_info(probe("mp3", 180, audio=("mp3", 192_000), cover=True), 4 * MB)
+    assert plan_audio(mp3, LIMIT) == Plan("keep", "mp3")
+
+    # звук из видео: дорожка влезает в предел, хотя весь файл — нет
+    video = media_info(probe(MP4, 1800, ("h264", 3_000_000), ("aac", 128_000)), 700 * MB)
+    assert plan_audio(video, LIMIT) == Plan("remux", "m4a", audio="copy")
+
+
+def test_plan_audio_transcodes_incompatible_or_oversized_track():
+    opus = media_info(probe(WEBM, 180, audio=("opus", 160_000)), 3 * MB)
+    assert plan_audio(opus, LIMIT) == Plan("transcode", "m4a", audio="encode", audio_bitrate=AUDIO_BITRATE)
+
+    # двухчасовая запись в AAC 256k больше предела — битрейт под лимит
+    long = media_info(probe(MP4, 2 * 3600, audio=("aac", 256_000)), 220 * MB)
+    assert plan_audio(long, LIMIT) == Plan("transcode", "m4a", audio="encode", audio_bitrate=_fit(2 * 3600))
+
+    # а пятичасовую пришлось бы сжать ниже MIN_AUDIO_BITRATE — остаётся как есть
+    longer = media_info(probe(MP4, 5 * 3600, audio=("aac", 256_000)), 550 * MB)
+    assert plan_audio(longer, LIMIT) == Plan("keep", "m4a")
+
+
+def test_plan_audio_requires_audio_stream():
+    with pytest.raises(PostprocessError):
+        plan_audio(media_info(probe(WEBM, 60, ("vp9", None)), MB), LIMIT)
+
+
+# ------------------------------------------------------------
+# Воркер не ждёт обработку скачанного файла
+# ------------------------------------------------------------
+class FakeQueue:
+    owner = None
+
+    def __init__(self) -> None:
+        self.leased = []
+        self.done = []
+
+    @asynccontextmanager
+    async def lease(self, job):
+        self.leased.append(job.download_id)
+        yield
+
+    def task_done(self, job):
+        self.done.append(job.download_id)
+
+
+def test_worker_is_released_when_download_goes_to_postprocess(run, monkeypatch):
+    queue = FakeQueue()
+    transcoding, finish = asyncio.Event(), asyncio.Event()
+
+    async def lead(job, released):
+        # загрузка закончилась, файл ушёл в ffmpeg
+        released.set()
+        transcoding.set()
+        await finish.wait()
+
+    monkeypatch.setattr(worker, "_queue", queue)
+    monkeypatch.setattr(worker, "_lead", lead)
+
+    async def scenario():
+        await asyncio.wait_for(worker._hand_off(Job(download_id=1)), timeout=1)
+        # воркер свободен, а задача ещё обрабатывается и держит lease
+        state = (transcoding.is_set(), len(worker._jobs), list(queue.done))
+        finish.set()
+        await asyncio.gather(*worker._jobs)
+        return state
+
+    assert run(scenario()) == (True, 1, [])
+    assert queue.leased == queue.done == [1]
+    assert not worker._jobs
+
+
+def test_worker_waits_for_job_that_never_reaches_postprocess(run, monkeypatch):
+    queue = FakeQueue()
+
+    async def lead(job, released):
+        raise RuntimeError("yt-dlp crashed")
+
+    monkeypatch.setattr(worker, "_queue", queue)
+    monkeypatch.setattr(worker, "_lead", lead)
+
+    # упавшая задача тоже отпускает воркер и завершает lease
+    run(asyncio.wait_for(worker._hand_off(Job(download_id=2)), timeout=1))
+    run(asyncio.sleep(0))
+
+    assert queue.done == [2]
+    assert not worker._jobs
+
+
+# ------------------------------------------------------------
+# Остановка после загрузки: файл не скачивается заново
+# ------------------------------------------------------------
+@pytest.fixture
+def job_env(monkeypatch, tmp_path):
+    """
+    _process_job без сети: run_ytdlp «скачивает» файл в staging,
+    перенос в хранилище — в tmp_path.
+    """
+    calls = {"ytdlp": 0}
+
+    async def run_ytdlp(url, out_filename, **kw):
+        calls["ytdlp"] += 1
+        path = worker.DOWNLOAD_TMP_DIR / f"{out_filename}.mp4"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b"x" * 100)
+        return path
+
+    async def lookup(url):
+        return None
+
+    def move(path):
+        final = tmp_path / path.name
+        path.replace(final)
+        return str(final)
+
+    monkeypatch.setattr(worker, "_queue", FakeQueue())
+    monkeypatch.setattr(worker, "run_ytdlp", run_ytdlp)
+    monkeypatch.setattr(worker.metadata, "lookup", lookup)
+    monkeypatch.setattr(worker, "move_file_to_final", move)
+    return calls
+
+
+def _interrupt(run, coro, started):
+    async def scenario():
+        task = asyncio.create_task(coro)
+        await asyncio.wait_for(started.wait(), timeout=1)
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return task.cancelled()
+
+    return run(scenario())
+
+
+def test_cancel_during_postprocess_keeps_downloaded_file(run, rows, row, job_env, monkeypatch):
+    download_id = rows(1, status=DownloadStatus.processing)
+    started = asyncio.Event()
+
+    async def process(src, kind, progress=None):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(worker.postprocess, "process", process)
+
+    assert _interrupt(run, worker._process_job(Job(download_id)), started)
+    d = row(download_id)
+    assert (d.status, d.partial_path) == (DownloadStatus.pending, None)
+    assert d.ready_path and worker.Path(d.ready_path).exists()
+
+    # следующий запуск сразу обрабатывает готовый файл
+    async def keep(src, kind, progress=None):
+        return src
+
+    monkeypatch.setattr(worker.postprocess, "process", keep)
+    run(worker._process_job(Job(download_id)))
+    d = row(download_id)
+    assert (d.status, d.ready_path, job_env["ytdlp"]) == (DownloadStatus.done, None, 1)
+    assert worker.Path(d.file_path).exists()
+
+
+def test_cancel_during_move_finishes_the_job(loop, run, rows, row, job_env, monkeypatch):
+    download_id = rows(1, status=DownloadStatus.processing)
+    started = asyncio.Event()
+    move = worker.move_file_to_final
+
+    def slow_move(path):
+        loop.call_soon_threadsafe(started.set)
+        time.sleep(0.2)
+        return move(path)
+
+    async def keep(src, kind, progress=None):
+        return src
+
+    monkeypatch.setattr(worker.postprocess, "process", keep)
+    monkeypatch.setattr(worker, "move_file_to_final", slow_move)
+
+    # отмена пробрасывается, но только после записи результата
+    assert _interrupt(run, worker._process_job(Job(download_id)), started)
+    d = row(download_id)
+    assert (d.status, d.partial_path, d.ready_path) == (DownloadStatus.done, None, None)
+    assert worker.Path(d.file_path).exists()
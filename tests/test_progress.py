@@ -0,0 +1,101 @@
+# tests/test_progress.py
+import time
+
+import pytest
+
+from bot_app import downloader, progress
+from bot_app.downloader import ProgressGate, _parse_cli_progress, _progress_hook
+from bot_app.progress import ProgressReporter, fan_out, progress_text
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """
+    Управляемое time.monotonic (ProgressGate, ProgressReporter): clock.now += ...
+    """
+    class Clock:
+        now = 1000.0
+
+    monkeypatch.setattr(time, "monotonic", lambda: Clock.now)
+    return Clock
+
+
+@pytest.fixture
+def edits(monkeypatch):
+    sent = []
+
+    class FakeOutbox:
+        def edit_message_text(self, chat_id, message_id, text, priority=None):
+            sent.append((chat_id, message_id, text))
+
+    monkeypatch.setattr(progress, "outbox", FakeOutbox())
+    return sent
+
+
+def test_gate_needs_both_interval_and_percent_change(clock):
+    gate = ProgressGate(interval=5, min_delta=5)
+
+    assert gate.allow(10, 100)
+    # рано
+    clock.now += 1
+    assert not gate.allow(50, 100)
+    # время прошло, но процент почти не изменился
+    clock.now += 10
+    assert not gate.allow(12, 100)
+    assert gate.allow(20, 100)
+    # размер неизвестен — хватает интервала
+    clock.now += 5
+    assert gate.allow(21, None)
+
+
+def test_progress_hook_passes_only_gated_downloading_snapshots(clock):
+    seen = []
+    hook = _progress_hook(seen.append)
+
+    hook({"status": "finished", "downloaded_bytes": 100})
+    hook({"status": "downloading", "downloaded_bytes": 10, "total_bytes_estimate": 100, "speed": 5, "eta": 18})
+    hook({"status": "downloading", "downloaded_bytes": 90, "total_bytes": 100})
+
+    assert seen == [{"downloaded": 10, "total": 100, "speed": 5, "eta": 18}]
+
+
+def test_parse_cli_progress_line():
+    line = downloader._CLI_PROGRESS_PREFIX + "1024 NA 4096 512.5 NA"
+
+    assert _parse_cli_progress(line) == {
+        "status": "downloading",
+        "downloaded_bytes": 1024,
+        "total_bytes": None,
+        "total_bytes_estimate": 4096.0,
+        "speed": 512.5,
+        "eta": None,
+    }
+
+
+def test_progress_text():
+    assert progress_text({"downloaded": 0}) == "📥 Завантаження…"
+    text = progress_text({"downloaded": 512 * 1024, "total": 1024 * 1024, "speed": 1024, "eta": 65})
+    assert text.startswith("📥 Завантаження… 50% (")
+    assert "\n⚡ " in text and "ETA" in text
+
+
+def test_reporter_edits_at_most_once_per_interval(clock, edits):
+    reporter = ProgressReporter(7, 70, interval=5)
+
+    reporter({"downloaded": 10, "total": 100})
+    reporter({"downloaded": 60, "total": 100})
+    clock.now += 5
+    reporter({"downloaded": 60, "total": 100})
+    # тот же текст ещё раз не отправляется
+    clock.now += 5
+    reporter({"downloaded": 60, "total": 100})
+
+    assert [text.split()[2] for *_, text in edits] == ["10%", "60%"]
+
+
+def test_fan_out_reports_to_every_message(clock, edits):
+    report = fan_out([ProgressReporter(7, 70), ProgressReporter(8, 80)])
+
+    report({"downloaded": 1, "total": 2})
+
+    assert [(chat, message) for chat, message, _ in edits] == [(7, 70), (8, 80)]
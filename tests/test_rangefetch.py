@@ -0,0 +1,137 @@
+# tests/test_rangefetch.py
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from benchmarks.range_download import make_handler
+from bot_app.rangefetch import JOURNAL_SUFFIX, Interrupted, download_ranges, journal_bytes, probe_size
+
+BLOB = bytes(i * 7 % 256 for i in range(256 * 1024))
+CHUNK = 32 * 1024
+
+
+@pytest.fixture
+def serve():
+    """
+    serve(handler) -> URL локального HTTP-сервера (останавливается после теста).
+    """
+    servers = []
+
+    def start(handler):
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return f"http://127.0.0.1:{server.server_port}/video.mp4"
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def recording_handler(requests: list, bad_start=None):
+    # как make_handler, но запоминает начала Range; bad_start отвечает 500
+    base = make_handler(BLOB, rate=1024 * 1024)
+
+    class Handler(base):
+        def do_GET(self):
+            start = int(self.headers.get("Range", "bytes=0-")[6:].partition("-")[0] or 0)
+            requests.append(start)
+            if start == bad_start:
+                self.send_response(500)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            super().do_GET()
+
+    return Handler
+
+
+def test_download_ranges_reassembles_file(tmp_path, serve):
+    url = serve(make_handler(BLOB, rate=16 * 1024 * 1024))
+    dest = tmp_path / "1.mp4"
+    seen = []
+
+    assert probe_size(url) == len(BLOB)
+    size = download_ranges(url, dest, connections=4, chunk_size=CHUNK, progress=lambda d, t: seen.append((d, t)))
+
+    assert size == len(BLOB)
+    assert dest.read_bytes() == BLOB
+    assert not (tmp_path / "1.mp4.part").exists()
+    assert not (tmp_path / f"1.mp4.part{JOURNAL_SUFFIX}").exists()
+    assert seen[-1] == (len(BLOB), len(BLOB))
+
+
+def test_download_ranges_failure_removes_part_and_journal(tmp_path, serve):
+    requests = []
+    url = serve(recording_handler(requests, bad_start=CHUNK * 2))
+    dest = tmp_path / "2.mp4"
+
+    with pytest.raises(OSError):
+        download_ranges(url, dest, connections=2, total_size=len(BLOB), chunk_size=CHUNK)
+
+    assert not dest.exists()
+    assert list(tmp_path.iterdir()) == []
+    # плохой чанк повторяется _ATTEMPTS раз, потом загрузка сдаётся
+    assert requests.count(CHUNK * 2) == 3
+
+
+# ------------------------------------------------------------
+# Журнал и докачка
+# ------------------------------------------------------------
+def test_journal_bytes_counts_finished_chunks(tmp_path):
+    part = tmp_path / "3.mp4.part"
+    assert journal_bytes(part) is None
+
+    journal = tmp_path / f"3.mp4.part{JOURNAL_SUFFIX}"
+    # последний чанк короче chunk_size
+    journal.write_text("1000 300\n0\n900\n")
+    assert journal_bytes(part) == 300 + 100
+
+    journal.write_text("garbage")
+    assert journal_bytes(part) is None
+
+
+def test_download_ranges_resumes_after_interrupt(tmp_path, serve):
+    first, second = [], []
+    dest = tmp_path / "4.mp4"
+    part = tmp_path / "4.mp4.part"
+
+    with pytest.raises(Interrupted):
+        download_ranges(
+            serve(recording_handler(first)), dest, connections=2, total_size=len(BLOB), chunk_size=CHUNK,
+            # стоп, как только два чанка записаны в журнал
+            should_stop=lambda: (journal_bytes(part) or 0) >= 2 * CHUNK,
+        )
+
+    kept = journal_bytes(part)
+    assert 2 * CHUNK <= kept < len(BLOB)
+    assert not dest.exists()
+    finished = {int(x) for x in (tmp_path / f"4.mp4.part{JOURNAL_SUFFIX}").read_text().split()[2:]}
+
+    seen = []
+    size = download_ranges(
+        serve(recording_handler(second)), dest, connections=2, total_size=len(BLOB), chunk_size=CHUNK,
+        progress=lambda d, t: seen.append(d),
+    )
+
+    assert size == len(BLOB)
+    assert dest.read_bytes() == BLOB
+    # готовые чанки повторно не запрашиваются, прогресс начинается с них
+    assert sorted(second) == [s for s in range(0, len(BLOB), CHUNK) if s not in finished]
+    assert seen[0] > kept
+    assert list(tmp_path.iterdir()) == [dest]
+
+
+def test_download_ranges_restarts_on_foreign_journal(tmp_path, serve):
+    requests = []
+    dest = tmp_path / "5.mp4"
+    (tmp_path / "5.mp4.part").write_bytes(b"x" * len(BLOB))
+    # журнал от другого размера чанка — ему верить нельзя
+    (tmp_path / f"5.mp4.part{JOURNAL_SUFFIX}").write_text(f"{len(BLOB)} {CHUNK * 2}\n0\n")
+
+    download_ranges(serve(recording_handler(requests)), dest, connections=4, total_size=len(BLOB), chunk_size=CHUNK)
+
+    assert dest.read_bytes() == BLOB
+    assert sorted(requests) == list(range(0, len(BLOB), CHUNK))
@@ -0,0 +1,102 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+from sqlalchemy import update
+
+from bot_app import worker
+from bot_app.db import AsyncSessionLocal
+from bot_app.jobqueue import WORKER_ID, Job
+from bot_app.models import Download, DownloadStatus, MediaKind
+
+
+async def _future():
+    return asyncio.get_running_loop().create_future()
+
+
+def _finish(run, download_id, **values):
+    # лидер записал результат
+    async def write():
+        async with AsyncSessionLocal() as session:
+            await session.execute(update(Download).where(Download.id == download_id).values(**values))
+            await session.commit()
+
+    run(write())
+
+
+def _wait_followers(run):
+    async def wait():
+        await asyncio.wait_for(asyncio.gather(*worker._followers), timeout=5)
+
+    run(wait())
+
+
+@pytest.fixture
+def flight(run, monkeypatch):
+    """
+    flight(video_id, leader_id) -> _Flight лидера, идущего в этом процессе.
+    """
+    def start(video_id, leader_id):
+        started = worker._Flight(leader_id, run(_future()))
+        monkeypatch.setitem(worker._inflight, worker._flight_key(video_id, MediaKind.video.value), started)
+        return started
+
+    return start
+
+
+def test_enqueue_joins_local_flight(run, rows, row, flight):
+    leader = rows(1, video_id="dQw4w9WgXcQ", status=DownloadStatus.processing, worker_id=WORKER_ID)
+    started = flight("dQw4w9WgXcQ", leader)
+
+    follower = run(worker.enqueue_download(1002, "https://youtu.be/dQw4w9WgXcQ?t=5"))
+
+    d = row(follower)
+    assert (d.status, d.leader_id, d.worker_id) == (DownloadStatus.processing, leader, WORKER_ID)
+    # результат лидера приходит ведомому без очереди
+    _finish(run, leader, status=DownloadStatus.done, file_path="/srv/a.mp4", file_size=7)
+    started.finished.set_result(None)
+    _wait_followers(run)
+    assert row(follower).status == DownloadStatus.done
+
+
+def test_follower_copies_local_leader_result(run, rows, row, flight):
+    leader = rows(1, video_id="abc", status=DownloadStatus.processing, worker_id=WORKER_ID)
+    follower = rows(2, video_id="abc")
+    started = flight("abc", leader)
+
+    assert run(worker._attach_to_leader(Job(download_id=follower, video_id="abc")))
+    d = row(follower)
+    assert (d.status, d.leader_id) == (DownloadStatus.processing, leader)
+
+    _finish(run, leader, status=DownloadStatus.done, file_path="/srv/abc.mp4", file_size=42)
+    started.finished.set_result(None)
+    _wait_followers(run)
+
+    d = row(follower)
+    assert (d.status, d.file_path, d.file_size) == (DownloadStatus.done, "/srv/abc.mp4", 42)
+    assert d.lease_until is None
+
+
+def test_follower_polls_remote_leader_and_copies_failure(run, rows, row, monkeypatch):
+    monkeypatch.setattr(worker, "POLL_INTERVAL", 0.02)
+    # лидер в другом процессе: только строка в БД
+    leader = rows(1, video_id="xyz", status=DownloadStatus.processing, worker_id="other:1")
+    follower = rows(2, video_id="xyz")
+
+    assert run(worker._attach_to_leader(Job(download_id=follower, video_id="xyz")))
+    _finish(run, leader, status=DownloadStatus.failed, error="boom")
+    _wait_followers(run)
+
+    d = row(follower)
+    assert (d.status, d.error) == (DownloadStatus.failed, "boom")
+
+
+def test_no_leader_means_no_attach(run, rows, row):
+    # другие задачи того же видео: ведомая и завершённая
+    rows(1, video_id="abc", status=DownloadStatus.processing, leader_id=1)
+    rows(1, video_id="abc", status=DownloadStatus.done)
+    job = Job(download_id=rows(2, video_id="abc"), video_id="abc")
+
+    assert not run(worker._attach_to_leader(job))
+    assert not run(worker._attach_to_leader(Job(download_id=rows(2))))
+    assert row(job.download_id).status == DownloadStatus.pending
@@ -0,0 +1,96 @@
+# tests/test_staging.py
+import errno
+import os
+import time
+
+import pytest
+
+from bot_app import staging
+
+
+@pytest.fixture
+def dirs(tmp_path, monkeypatch):
+    """
+    Отдельные staging/final на время теста; возвращает (staging, final).
+    """
+    staging_dir, final_dir = tmp_path / "staging", tmp_path / "final"
+    monkeypatch.setattr(staging, "STAGING_DIR", staging_dir)
+    monkeypatch.setattr(staging, "FINAL_DIR", final_dir)
+    monkeypatch.setattr(staging, "_cross_device", None)
+    assert staging.prepare() is False
+    return staging_dir, final_dir
+
+
+def test_publish_on_same_filesystem_is_a_rename(dirs):
+    staging_dir, final_dir = dirs
+    src = staging_dir / "7.mp4"
+    src.write_bytes(b"video")
+    inode = src.stat().st_ino
+
+    dest = staging.publish(src, final_dir)
+
+    assert dest == final_dir / "7.mp4"
+    assert dest.stat().st_ino == inode
+    assert not src.exists()
+
+
+def test_publish_across_filesystems_copies_via_part(dirs, monkeypatch):
+    staging_dir, final_dir = dirs
+    monkeypatch.setattr(staging, "_cross_device", True)
+    src = staging_dir / "8.mp4"
+    src.write_bytes(os.urandom(300_000))
+    data = src.read_bytes()
+
+    dest = staging.publish(src, final_dir)
+
+    assert dest.read_bytes() == data
+    assert not src.exists()
+    assert list(final_dir.iterdir()) == [dest]
+
+
+def test_failed_copy_leaves_source_and_no_part(dirs, monkeypatch):
+    staging_dir, final_dir = dirs
+    monkeypatch.setattr(staging, "_cross_device", True)
+
+    def broken(src, dst):
+        dst.write_bytes(b"half")
+        raise OSError(errno.ENOSPC, "no space left")
+
+    monkeypatch.setattr(staging, "zero_copy", broken)
+    src = staging_dir / "9.mp4"
+    src.write_bytes(b"video")
+
+    with pytest.raises(OSError):
+        staging.publish(src, final_dir)
+
+    assert src.exists()
+    assert list(final_dir.iterdir()) == []
+
+
+def test_zero_copy_falls_back_to_plain_copy(tmp_path, monkeypatch):
+    def unsupported(*args):
+        raise OSError(errno.ENOSYS, "not supported")
+
+    monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    monkeypatch.setattr(os, "sendfile", None, raising=False)
+    src, dst = tmp_path / "src", tmp_path / "dst"
+    src.write_bytes(b"x" * 5000)
+
+    assert staging.zero_copy(src, dst) == 5000
+    assert dst.read_bytes() == src.read_bytes()
+
+
+def test_cleanup_orphans_keeps_active_and_fresh_files(dirs):
+    staging_dir, final_dir = dirs
+    for name in ("1.mp4.part", "1.f137.mp4", "2.mp4", "fresh.tmp", "old.tmp"):
+        (staging_dir / name).write_bytes(b"x")
+    (final_dir / "3.mp4.part").write_bytes(b"x")
+    (final_dir / "3.mp4").write_bytes(b"x")
+    hour_ago = time.time() - 2 * staging.ORPHAN_MAX_AGE
+    os.utime(staging_dir / "old.tmp", (hour_ago, hour_ago))
+
+    # загрузка 1 ещё идёт; 2 и недокопированный 3 брошены
+    assert staging.cleanup_orphans([1]) == 3
+
+    assert sorted(p.name for p in staging_dir.iterdir()) == ["1.f137.mp4", "1.mp4.part", "fresh.tmp"]
+    assert [p.name for p in final_dir.iterdir()] == ["3.mp4"]
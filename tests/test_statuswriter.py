@@ -0,0 +1,91 @@
+# tests/test_statuswriter.py
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from bot_app.db import AsyncSessionLocal
+from bot_app.models import Download, DownloadStatus
+from bot_app.statuswriter import StatusWriter
+
+
+def _statuses(run, *ids):
+    async def get():
+        async with AsyncSessionLocal() as session:
+            result = await session.execute(select(Download.id, Download.status).where(Download.id.in_(ids)))
+            return dict(result.all())
+
+    return run(get())
+
+
+def test_writes_are_committed_in_one_batch(run, rows):
+    ids = [rows(user) for user in (1, 2, 3)]
+    writer = StatusWriter(interval=0.05)
+
+    async def write_all():
+        await asyncio.gather(*(writer.write(i, status=DownloadStatus.done) for i in ids))
+        await writer.close()
+
+    run(write_all())
+
+    assert _statuses(run, *ids) == {i: DownloadStatus.done for i in ids}
+    assert (writer.writes, writer.batches) == (3, 1)
+
+
+def test_failed_batch_retries_rows_and_fails_only_bad_one(run, rows):
+    good, bad, other = rows(1), rows(2), rows(3)
+    writer = StatusWriter(interval=0.05)
+
+    async def write_all():
+        results = await asyncio.gather(
+            writer.write(good, status=DownloadStatus.done),
+            # не значение DownloadStatus — Enum отвергает его при подстановке
+            writer.write(bad, status=42),
+            writer.write(other, status=DownloadStatus.failed),
+            return_exceptions=True,
+        )
+        await writer.close()
+        return results
+
+    results = run(write_all())
+
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], Exception)
+    assert _statuses(run, good, bad, other) == {
+        good: DownloadStatus.done,
+        bad: DownloadStatus.pending,
+        other: DownloadStatus.failed,
+    }
+    assert writer.writes == 2
+
+
+def test_single_failed_row_is_not_retried(run, rows):
+    bad = rows(1)
+    writer = StatusWriter(interval=0)
+
+    async def write():
+        try:
+            await writer.write(bad, status=42)
+        finally:
+            await writer.close()
+
+    with pytest.raises(Exception):
+        run(write())
+    assert writer.writes == 0
+
+
+def test_owner_write_skips_row_held_by_another_worker(run, rows):
+    own = rows(1, status=DownloadStatus.processing, worker_id="me:1")
+    stolen = rows(2, status=DownloadStatus.processing, worker_id="other:1")
+    writer = StatusWriter(interval=0.05)
+
+    async def write_all():
+        await asyncio.gather(
+            writer.write(own, owner="me:1", status=DownloadStatus.done),
+            writer.write(stolen, owner="me:1", status=DownloadStatus.done),
+        )
+        await writer.close()
+
+    run(write_all())
+
+    assert _statuses(run, own, stolen) == {own: DownloadStatus.done, stolen: DownloadStatus.processing}
@@ -0,0 +1,196 @@
+# tests/test_storage.py
+import itertools
+import threading
+
+import pytest
+from aiogram.types import FSInputFile, URLInputFile
+
+from bot_app.storage import LocalStorage, S3Storage, Storage
+
+
+# ------------------------------------------------------------
+# In-process S3
+# ------------------------------------------------------------
+class FakeClientError(Exception):
+    # как botocore.exceptions.ClientError: код — в response["Error"]["Code"]
+    def __init__(self, code: str) -> None:
+        super().__init__(code)
+        self.response = {"Error": {"Code": code}}
+
+
+class FakeS3Client:
+    """
+    Замена boto3 S3 client для S3Storage: объекты в словаре, части
+    multipart собираются в complete_multipart_upload. fail_part — номер
+    части, на которой upload_part падает.
+    """
+
+    def __init__(self, fail_part=None) -> None:
+        self.objects = {}
+        self.uploads = {}
+        self.aborted = []
+        self.part_calls = 0
+        self.fail_part = fail_part
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+        return {"ETag": '"single"'}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = f"upload-{next(self._ids)}"
+        self.uploads[upload_id] = {}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        with self._lock:
+            self.part_calls += 1
+        if PartNumber == self.fail_part:
+            raise FakeClientError("InternalError")
+        with self._lock:
+            self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {"ETag": f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        listed = MultipartUpload["Parts"]
+        assert [p["PartNumber"] for p in listed] == sorted(parts)
+        assert all(p["ETag"] == f'"etag-{p["PartNumber"]}"' for p in listed)
+        self.objects[(Bucket, Key)] = b"".join(parts[p["PartNumber"]] for p in listed)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+        self.aborted.append(UploadId)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise FakeClientError("404")
+        return {"ContentLength": len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket, Key):
+        self.objects.pop((Bucket, Key), None)
+
+    def generate_presigned_url(self, ClientMethod, Params, ExpiresIn):
+        return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+
+
+@pytest.fixture
+def staged(tmp_path):
+    def make(name: str, size: int):
+        path = tmp_path / "staging" / name
+        path.parent.mkdir(exist_ok=True)
+        path.write_bytes(bytes(i % 251 for i in range(size)))
+        return path
+
+    return make
+
+
+def test_storage_is_abstract():
+    with pytest.raises(TypeError):
+        Storage()
+
+    class Partial(Storage):
+        def publish(self, src):
+            return str(src)
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+# ------------------------------------------------------------
+# LocalStorage
+# ------------------------------------------------------------
+def test_local_publish_exists_input_file_delete(tmp_path, staged):
+    storage = LocalStorage(root=tmp_path / "final")
+    src = staged("1.mp4", 1000)
+    data = src.read_bytes()
+
+    location = storage.publish(src)
+
+    assert location == str(tmp_path / "final" / "1.mp4")
+    assert not src.exists()
+    assert storage.exists(location)
+    assert (tmp_path / "final" / "1.mp4").read_bytes() == data
+
+    input_file = storage.input_file(location)
+    assert isinstance(input_file, FSInputFile)
+    assert str(input_file.path) == location
+
+    storage.delete(location)
+    assert not storage.exists(location)
+    # повторное удаление — не ошибка
+    storage.delete(location)
+
+
+# ------------------------------------------------------------
+# S3Storage
+# ------------------------------------------------------------
+def test_s3_publish_small_file_single_put(staged):
+    client = FakeS3Client()
+    storage = S3Storage(bucket="media", prefix="dl/", client=client, part_size=4096)
+    src = staged("2.mp4", 1000)
+    data = src.read_bytes()
+
+    location = storage.publish(src)
+
+    assert location == "s3://media/dl/2.mp4"
+    assert client.objects[("media", "dl/2.mp4")] == data
+    assert client.part_calls == 0
+    assert not src.exists()
+
+
+def test_s3_publish_multipart_in_order(staged):
+    client = FakeS3Client()
+    storage = S3Storage(bucket="media", prefix="dl/", client=client, part_size=1024, concurrency=3)
+    src = staged("3.mp4", 10 * 1024 + 17)
+    data = src.read_bytes()
+
+    location = storage.publish(src)
+
+    assert location == "s3://media/dl/3.mp4"
+    assert client.objects[("media", "dl/3.mp4")] == data
+    assert client.part_calls == 11
+    assert client.uploads == {} and client.aborted == []
+    assert not src.exists()
+
+
+def test_s3_multipart_failure_aborts_and_keeps_source(staged):
+    client = FakeS3Client(fail_part=3)
+    storage = S3Storage(bucket="media", prefix="dl/", client=client, part_size=1024, concurrency=2)
+    src = staged("4.mp4", 8 * 1024)
+
+    with pytest.raises(FakeClientError):
+        storage.publish(src)
+
+    assert client.aborted == ["upload-1"]
+    assert ("media", "dl/4.mp4") not in client.objects
+    # файл остаётся в staging — задачу можно повторить
+    assert src.exists()
+
+
+def test_s3_exists_delete_and_input_file(staged):
+    client = FakeS3Client()
+    storage = S3Storage(bucket="media", prefix="dl/", client=client, presign_ttl=600)
+    location = storage.publish(staged("5.mp4", 100))
+
+    assert storage.exists(location)
+    assert not storage.exists("s3://media/dl/missing.mp4")
+
+    input_file = storage.input_file(location)
+    assert isinstance(input_file, URLInputFile)
+    assert input_file.url == "https://s3.test/media/dl/5.mp4?expires=600"
+    assert input_file.filename == "5.mp4"
+
+    storage.delete(location)
+    assert not storage.exists(location)
+
+
+def test_s3_exists_propagates_other_errors():
+    class Broken(FakeS3Client):
+        def head_object(self, Bucket, Key):
+            raise FakeClientError("AccessDenied")
+
+    storage = S3Storage(bucket="media", client=Broken())
+    with pytest.raises(FakeClientError):
+        storage.exists("s3://media/dl/1.mp4")
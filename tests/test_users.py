@@ -0,0 +1,68 @@
+# tests/test_users.py
+import pytest
+from sqlalchemy import event, func, select
+
+from bot_app import users
+from bot_app.db import AsyncSessionLocal, engine
+from bot_app.models import User
+
+
+@pytest.fixture(autouse=True)
+def empty_cache(monkeypatch):
+    monkeypatch.setattr(users, "_ids", type(users._ids)())
+
+
+@pytest.fixture
+def statements():
+    """
+    Список SQL, выполненных движком за время теста.
+    """
+    seen = []
+
+    def record(conn, cursor, statement, *args):
+        seen.append(statement.split()[0].upper())
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    yield seen
+    event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+
+def _count(run, telegram_id):
+    async def count():
+        async with AsyncSessionLocal() as session:
+            q = await session.execute(select(func.count()).select_from(User).where(User.telegram_id == telegram_id))
+            return q.scalar_one()
+
+    return run(count())
+
+
+def test_new_user_is_created_with_one_upsert(run, rows, statements):
+    user_id = run(users.get_or_create_user_id(777))
+
+    assert statements == ["INSERT"]
+    assert _count(run, 777) == 1
+    assert users._ids[777] == user_id
+
+
+def test_existing_user_is_found_without_duplicate(run, rows, statements):
+    # пользователь 3 создан фикстурой (telegram_id = 1003)
+    assert run(users.get_or_create_user_id(1003)) == 3
+    assert statements == ["INSERT", "SELECT"]
+    assert _count(run, 1003) == 1
+
+
+def test_cached_user_costs_no_queries(run, rows, statements):
+    first = run(users.get_or_create_user_id(1002))
+    statements.clear()
+
+    assert run(users.get_or_create_user_id(1002)) == first
+    assert statements == []
+
+
+def test_cache_is_bounded_lru(run, rows, monkeypatch):
+    monkeypatch.setattr(users, "USER_CACHE_SIZE", 2)
+    for telegram_id in (1001, 1002, 1001, 1003):
+        run(users.get_or_create_user_id(telegram_id))
+
+    # 1002 использовали давнее всех
+    assert list(users._ids) == [1001, 1003]
@@ -0,0 +1,86 @@
+# tests/test_web.py
+import httpx
+import pytest
+
+from bot_app import web
+from bot_app.web import WEBHOOK_PATH, UpdateIngress, create_app
+
+
+class FakeDispatcher:
+    def __init__(self) -> None:
+        self.updates = []
+
+    async def feed_raw_update(self, bot, update):
+        self.updates.append(update["update_id"])
+
+
+@pytest.fixture
+def post(run):
+    """
+    post(app, path, json=..., headers=...) -> httpx.Response (ASGI, без сети).
+    """
+    def send(app, path=WEBHOOK_PATH, **kwargs):
+        async def request():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bot") as client:
+                if "json" in kwargs or "content" in kwargs:
+                    return await client.post(path, **kwargs)
+                return await client.get(path, **kwargs)
+
+        return run(request())
+
+    return send
+
+
+def test_full_queue_answers_503_with_retry_after(post):
+    dispatcher = FakeDispatcher()
+    # обработчики не запущены — очередь только наполняется
+    ingress = UpdateIngress(bot=None, dispatcher=dispatcher, maxsize=2)
+    app = create_app(None, dispatcher, ingress)
+
+    codes = [post(app, json={"update_id": n}).status_code for n in range(3)]
+    rejected = post(app, json={"update_id": 3})
+
+    assert codes == [200, 200, 503]
+    assert rejected.headers["Retry-After"] == str(web.WEBHOOK_RETRY_AFTER)
+    assert (ingress.accepted, ingress.rejected, ingress.backlog) == (2, 2, 2)
+
+
+def test_consumers_feed_dispatcher_and_stop_drains_queue(run):
+    dispatcher = FakeDispatcher()
+    ingress = UpdateIngress(bot=None, dispatcher=dispatcher, maxsize=10, consumers=2)
+
+    async def scenario():
+        for n in range(5):
+            assert ingress.offer({"update_id": n})
+        ingress.start()
+        assert ingress.running
+        await ingress.stop(drain_timeout=5)
+
+    run(scenario())
+
+    assert sorted(dispatcher.updates) == [0, 1, 2, 3, 4]
+    assert not ingress.running and ingress.backlog == 0
+
+
+def test_webhook_rejects_bad_secret_and_body(post, monkeypatch):
+    monkeypatch.setattr(web, "WEBHOOK_SECRET", "s3cret")
+    ingress = UpdateIngress(bot=None, dispatcher=FakeDispatcher())
+    app = create_app(None, ingress.dispatcher, ingress)
+
+    assert post(app, json={"update_id": 1}).status_code == 401
+    headers = {"X-Telegram-Bot-Api-Secret-Token": "s3cret"}
+    assert post(app, content=b"not json", headers=headers).status_code == 400
+    assert post(app, json=[1], headers=headers).status_code == 400
+    assert post(app, json={"update_id": 1}, headers=headers).status_code == 200
+    assert ingress.accepted == 1
+
+
+def test_readyz_fails_until_ingress_and_outbox_run(post):
+    ingress = UpdateIngress(bot=None, dispatcher=FakeDispatcher())
+    app = create_app(None, ingress.dispatcher, ingress)
+
+    assert post(app, "/healthz").status_code == 200
+    ready = post(app, "/readyz")
+    assert ready.status_code == 503
+    assert ready.json()["checks"] == {"ingress": False, "outbox": False, "database": True}